@@ -9,8 +9,6 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import pyreadr
-import sbi
-import sbi.utils as sbi_utils
 import seaborn as sns
 import statsmodels.formula.api as smf
 import torch
@@ -54,11 +52,7 @@ def generate_and_save_simulations(
 
 
 def infer_and_save_posterior(device: str, simulator_type: str, simulation_type: str, params: Dict) -> None:
-    parameter_prior = sbi_utils.BoxUniform(
-        low=torch.tensor([0.0, 0.0, 0.0]).type(torch.FloatTensor),
-        high=torch.tensor([4.0, 4.0, 1.0]).type(torch.FloatTensor),
-    )
-    inferrer = inference_class.TimeSeriesInference(parameter_prior=parameter_prior, device=device)
+    inferrer = inference_class.TimeSeriesInference(device=device)
     inferrer.load_simulator(dirname=ARTIFACT_PATH, simulator_type=simulator_type, simulation_type=simulation_type)
     batch_size = params.pop("batch_size")
     learning_rate = params.pop("learning_rate")
@@ -77,12 +71,7 @@ def infer_and_save_posterior(device: str, simulator_type: str, simulation_type:
 def sample_posterior_with_observed(
     observations: np.array, num_samples: int, simulator_type: str, simulation_type: str
 ) -> np.array:
-    # The parameter prior doesn't matter here as it will be overridden by that of the loaded inference object
-    parameter_prior = sbi.utils.BoxUniform(
-        low=torch.tensor([0.0, 0.0, 0.0]).type(torch.FloatTensor),
-        high=torch.tensor([4.0, 4.0, 1.0]).type(torch.FloatTensor),
-    )
-    inferrer = inference_class.TimeSeriesInference(parameter_prior=parameter_prior)
+    inferrer = inference_class.TimeSeriesInference()
     inferrer.load_simulator(dirname=ARTIFACT_PATH, simulator_type=simulator_type, simulation_type=simulation_type)
     inferrer.load_inference(dirname=ARTIFACT_PATH)
     posterior_samples = inferrer.get_posterior_samples(observations, num_samples=num_samples)
@@ -176,12 +165,7 @@ def plot_test_parameter_recovery(
         )
     simulations = np.array(simulations)
 
-    # The parameter prior doesn't matter here as it will be overridden by that of the loaded inference object
-    parameter_prior = sbi.utils.BoxUniform(
-        low=torch.tensor([0.0, 0.0, 0.0]).type(torch.FloatTensor),
-        high=torch.tensor([4.0, 4.0, 1.0]).type(torch.FloatTensor),
-    )
-    inferrer = inference_class.TimeSeriesInference(parameter_prior=parameter_prior)
+    inferrer = inference_class.TimeSeriesInference()
     inferrer.load_simulator(dirname=ARTIFACT_PATH, simulator_type=simulator_type, simulation_type=simulation_type)
     inferrer.load_inference(dirname=ARTIFACT_PATH)
     posterior_samples = inferrer.get_posterior_samples(simulations, num_samples=num_posterior_samples)
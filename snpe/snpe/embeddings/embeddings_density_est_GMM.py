@@ -2,7 +2,7 @@ import os
 import pickle
 
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -42,6 +42,18 @@ class EmbeddingDensityGMM:
             verbose_interval=20,
         )
 
+    @classmethod
+    def from_models(
+        cls, product_model: GaussianMixture, user_model: GaussianMixture, artifact_path: Path = ARTIFACT_PATH
+    ) -> "EmbeddingDensityGMM":
+        # Wraps already fitted density estimators, skipping the checks done in __init__
+        # Used by simulation workers that load the fitted density estimators from shared memory
+        density_estimator = cls.__new__(cls)
+        density_estimator.artifact_path = artifact_path
+        density_estimator.product_model = product_model
+        density_estimator.user_model = user_model
+        return density_estimator
+
     def process_input_data(self) -> Tuple[np.ndarray, np.ndarray]:
         # Load the product and user embeddings
         product_embeddings = pd.read_csv(self.artifact_path / "productspace.tsv", sep="\t", header=None)
@@ -136,3 +148,59 @@ class EmbeddingDensityGMM:
             model_dict = pickle.load(f)
         for key in model_dict:
             setattr(self, key, model_dict[key])
+
+
+class GMMSampler:
+    # Fast sampler from a fitted sklearn GaussianMixture, for drawing large numbers of embeddings during simulations
+    # GaussianMixture.sample validates its inputs, makes a multinomial draw over components and factorizes every
+    # covariance matrix on each call, which dominates the time taken when it is called once per visitor
+    # Here the component weights, means and Cholesky factors of the covariances are cached once, and samples are drawn
+    # in blocks of block_size. draw() hands out samples from the current block and refills it lazily
+    # Unlike GaussianMixture.sample, samples come in random order instead of being grouped by mixture component
+    def __init__(self, gmm: GaussianMixture, block_size: int = 4096) -> None:
+        self.block_size = block_size
+        self.weights = gmm.weights_ / np.sum(gmm.weights_)
+        self.means = gmm.means_
+        n_components, n_features = gmm.means_.shape
+        # Bring every covariance_type to one (n_components, n_features, n_features) array of covariance matrices
+        if gmm.covariance_type == "full":
+            covariances = gmm.covariances_
+        elif gmm.covariance_type == "tied":
+            covariances = np.repeat(gmm.covariances_[None, :, :], n_components, axis=0)
+        elif gmm.covariance_type == "diag":
+            covariances = np.stack([np.diag(covariance) for covariance in gmm.covariances_])
+        else:
+            covariances = np.stack([np.eye(n_features) * covariance for covariance in gmm.covariances_])
+        self.cholesky_factors = np.linalg.cholesky(covariances)
+        self.rng = np.random.default_rng()
+        self._block = np.empty((0, n_features))
+        self._position = 0
+
+    def reset(self, rng: Optional[np.random.Generator] = None) -> None:
+        # Discard the current block of samples, and draw all subsequent samples from the provided random generator
+        if rng is not None:
+            self.rng = rng
+        self._block = self._block[:0]
+        self._position = 0
+
+    def sample(self, n_samples: int) -> np.ndarray:
+        # Draw n_samples new samples, of shape (n_samples, n_features)
+        components = self.rng.choice(len(self.weights), size=n_samples, p=self.weights)
+        samples = self.rng.standard_normal((n_samples, self.means.shape[1]))
+        for component in np.unique(components):
+            in_component = components == component
+            samples[in_component] = self.means[component] + samples[in_component] @ self.cholesky_factors[component].T
+        return samples
+
+    def draw(self, n_samples: int = 1) -> np.ndarray:
+        # Hand out the next n_samples samples from the pre-drawn blocks, of shape (n_samples, n_features)
+        samples = []
+        while n_samples > 0:
+            if self._position == len(self._block):
+                self._block = self.sample(self.block_size)
+                self._position = 0
+            num_taken = min(n_samples, len(self._block) - self._position)
+            samples.append(self._block[self._position : self._position + num_taken])
+            self._position += num_taken
+            n_samples -= num_taken
+        return np.concatenate(samples, axis=0)
@@ -3,7 +3,7 @@ import os
 import pickle
 
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -18,8 +18,13 @@ from . import ARTIFACT_PATH, STARSPACE_PARAMS
 
 
 class EmbeddingRatingPredictor:
-    def __init__(self, predict_fractions: bool = False, artifact_path: Path = ARTIFACT_PATH):
-        torch.set_num_threads(mp.cpu_count())
+    def __init__(
+        self, predict_fractions: bool = False, artifact_path: Path = ARTIFACT_PATH, num_threads: Optional[int] = None
+    ):
+        # Torch threads are only changed if num_threads is given (e.g, mp.cpu_count() for training). Setting them here
+        # unconditionally used to oversubscribe the CPUs whenever the predictor was loaded for parallel simulations
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
         print(f"\t Device set to cpu, using torch num threads={torch.get_num_threads()}")
         self.artifact_path = artifact_path
         # Assert that starspace training has been done before embedding->rating predictor is used
@@ -0,0 +1,111 @@
+import copy
+
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import sbi
+import torch
+
+from sbi.inference.posteriors.direct_posterior import DirectPosterior
+from sbi.utils.sbiutils import Standardize
+
+
+class DensityEstimatorTrainer:
+    # Single round SNPE training of a density estimator outside of sbi's SNPE.train, shared by the training loops that
+    # can't hand all their simulations to sbi as one in-memory tensor (streaming from padded timeseries and online
+    # training from a replay buffer). The loops only decide where minibatches come from and when to validate, while
+    # this class does everything that has to stay the same between them, as it does in SNPE.train:
+    #   building the density estimator with z-scoring from a subset of the training simulations
+    #   the optimization step (Adam on the negative log prob of the parameters, with gradient clipping)
+    #   the validation log prob and keeping the state of the density estimator with the best one
+    #   building the posterior from the best density estimator
+    def __init__(
+        self,
+        standardization_parameters: torch.Tensor,
+        standardization_simulations: torch.Tensor,
+        embedding_net_creator: Optional[Callable] = None,
+        embedding_net_conf: Optional[Dict] = None,
+        model: str = "maf",
+        learning_rate: float = 5e-4,
+        hidden_features: int = 50,
+        num_transforms: int = 5,
+        clip_max_norm: Optional[float] = 5.0,
+        standardize_per_rating: bool = False,
+        device: str = "cpu",
+    ):
+        # Get the embedding net for the simulations
+        if embedding_net_creator is not None:
+            assert (
+                embedding_net_conf is not None
+            ), f"""embedding_net_conf dict not provided even though
+               embedding_net_creator function {embedding_net_creator} provided"""
+            embedding_net = embedding_net_creator(standardization_simulations[:5], **embedding_net_conf)
+        else:
+            embedding_net = torch.nn.Identity()
+        z_score_x = True
+        if standardize_per_rating:
+            # sbi z-scores every entry of the (5 X length) simulations separately, which needs a fixed length. For
+            # timeseries of varying lengths, the simulations are z-scored per star rating instead, across all timesteps
+            embedding_net = torch.nn.Sequential(
+                Standardize(
+                    standardization_simulations.mean(dim=(0, 2))[:, None],
+                    standardization_simulations.std(dim=(0, 2)).clamp(min=1e-7)[:, None],
+                ),
+                embedding_net,
+            )
+            z_score_x = False
+        print(f"Embedding net created: \n {embedding_net}")
+        posterior_net = sbi.utils.posterior_nn(
+            model=model,
+            z_score_x=z_score_x,
+            embedding_net=embedding_net,
+            hidden_features=hidden_features,
+            num_transforms=num_transforms,
+        )
+        self.device = device
+        self.clip_max_norm = clip_max_norm
+        self.density_estimator = posterior_net(standardization_parameters, standardization_simulations).to(device)
+        self.optimizer = torch.optim.Adam(list(self.density_estimator.parameters()), lr=learning_rate)
+        self.best_validation_log_prob = -np.inf
+        self.best_state_dict = copy.deepcopy(self.density_estimator.state_dict())
+
+    def training_step(self, parameters: torch.Tensor, simulations: torch.Tensor) -> float:
+        # One optimization step on a minibatch, returns its loss
+        self.density_estimator.train()
+        self.optimizer.zero_grad()
+        loss = -self.density_estimator.log_prob(parameters.to(self.device), simulations.to(self.device)).mean()
+        loss.backward()
+        if self.clip_max_norm is not None:
+            torch.nn.utils.clip_grad_norm_(self.density_estimator.parameters(), max_norm=self.clip_max_norm)
+        self.optimizer.step()
+        return loss.item()
+
+    def validate(self, validation_batches: Iterable[Tuple[torch.Tensor, torch.Tensor]]) -> Tuple[float, bool]:
+        # Mean log prob of all the validation examples, in minibatches of (parameters, simulations). The state of the
+        # density estimator is kept if it is the best one so far
+        # Returns the validation log prob and whether it improved on the best one
+        self.density_estimator.eval()
+        log_prob_sum, num_examples = 0.0, 0
+        with torch.no_grad():
+            for parameters, simulations in validation_batches:
+                log_prob_sum += (
+                    self.density_estimator.log_prob(parameters.to(self.device), simulations.to(self.device))
+                    .sum()
+                    .item()
+                )
+                num_examples += len(parameters)
+        validation_log_prob = log_prob_sum / num_examples
+        improved = validation_log_prob > self.best_validation_log_prob
+        if improved:
+            self.best_validation_log_prob = validation_log_prob
+            self.best_state_dict = copy.deepcopy(self.density_estimator.state_dict())
+        return validation_log_prob, improved
+
+    def build_posterior(self, prior: torch.distributions.Distribution, x_shape: torch.Size) -> DirectPosterior:
+        # Restores the best density estimator and builds the posterior from it, as SNPE.build_posterior does
+        self.density_estimator.load_state_dict(self.best_state_dict)
+        # Always move the trained density estimator to cpu, as in infer_snpe_posterior
+        self.density_estimator.to(device="cpu")
+        return DirectPosterior(
+            method_family="snpe", neural_net=self.density_estimator, prior=prior, x_shape=x_shape, device="cpu"
+        )
@@ -1,9 +1,13 @@
+import copy
+import hashlib
 import itertools
 import multiprocessing as mp
 import pickle
+import time
 
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from pathlib import Path
-from typing import Callable, Dict, Optional
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import numpy as np
 import sbi
@@ -11,13 +15,38 @@ import sbi.inference as sbi_inference
 import sklearn
 import torch
 
+from joblib.externals.loky import get_reusable_executor
+from sbi.utils.sbiutils import within_support
 from snpe.simulations import marketplace_simulator_class, simulator_class
-from snpe.utils.data_transforms import pad_timeseries_for_cnn
+from snpe.simulations.parameter_schema import get_parameter_prior, get_parameter_schema, get_registered_simulator
+from snpe.simulations.review_timeseries import timeseries_to_object_array
+from snpe.utils.data_transforms import (
+    LengthBucketBatchSampler,
+    PaddedTimeseriesDataset,
+    pad_timeseries_batch,
+    pad_timeseries_for_cnn,
+)
 from snpe.utils.embedding_nets import get_cnn_1d
 
+from .density_estimator_training import DensityEstimatorTrainer
+from .online_training import ReplayBuffer, simulate_training_batch
+
+
+def get_sbi_training_summary(inference: sbi_inference.SNPE) -> Tuple[float, int]:
+    # Best validation log prob and number of epochs of the latest training round of an sbi inference object. The keys
+    # of sbi's training summary differ between sbi versions
+    summary = inference._summary
+    best_validation_log_prob_key = (
+        "best_validation_log_prob" if "best_validation_log_prob" in summary else "best_validation_log_probs"
+    )
+    epochs_key = "epochs_trained" if "epochs_trained" in summary else "epochs"
+    return summary[best_validation_log_prob_key][-1], summary[epochs_key][-1]
+
 
 class BaseInference:
-    def __init__(self, parameter_prior: torch.distributions.Distribution, device: str = "cpu"):
+    def __init__(self, parameter_prior: Optional[torch.distributions.Distribution] = None, device: str = "cpu"):
+        # Without a parameter prior, inference uses the uniform prior over the parameter bounds of the simulator type,
+        # as registered in its parameter schema, once the simulator is known
         self.parameter_prior = parameter_prior
         assert device in ["cpu", "cuda"], f"Device needs to be cpu or cuda, unknown device {device} provided"
         self.device = device
@@ -26,77 +55,50 @@ class BaseInference:
             print(f"\t Device set to {self.device}, using torch num threads={torch.get_num_threads()}")
         # Attribute that stores the length of the padded timeseries simulations
         self.padded_simulation_length = None  # type: Optional[int]
+        # Number of checkpoints (and their spacing) that timeseries were resampled to during training, if any
+        self.num_checkpoints = None  # type: Optional[int]
+        self.checkpoint_spacing = "linear"
+        # Cache of embedding net outputs of observations, per hash of the observation. Needs to be emptied whenever
+        # the posterior changes
+        self.embedding_cache = {}  # type: Dict[str, torch.Tensor]
 
     def load_simulator(
-        self, dirname: Path, simulator_type: str = "double_rho", simulation_type: str = "timeseries"
+        self, dirname: Path, simulator_type: str = "double_rho", simulation_type: str = "timeseries", lazy: bool = False
     ) -> None:
         # The parameters used to initialize the simulator object don't matter here
         # as they will be overridden by those of the loaded simulator
         params = {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": simulation_type}
         self.simulator_type = simulator_type
         self.simulation_type = simulation_type
-        if self.simulator_type == "single_rho":
-            simulator = simulator_class.SingleRhoSimulator(params)
-        elif self.simulator_type == "double_rho":
-            simulator = simulator_class.DoubleRhoSimulator(params)
-        elif self.simulator_type == "single_herding":
-            # Add the additional parameters that the herding simulator needs to initialize
-            # Again the values aren't important as they will be overridden by those of the loaded simulator
-            params.update({"previous_rating_measure": "mean", "min_reviews_for_herding": 5})
-            simulator = simulator_class.HerdingSimulator(params)
-        elif self.simulator_type == "double_herding":
-            # 3 additional parameter for the double herding simulator, will be overridden by the loaded simulator
-            params.update(
-                {
-                    "previous_rating_measure": "mean",
-                    "min_reviews_for_herding": 5,
-                    "herding_differentiating_measure": "mean",
-                }
-            )
-            simulator = simulator_class.DoubleHerdingSimulator(params)
-        elif self.simulator_type == "rating_scale":
-            # As with the other simulators, the parameter values here are placeholders and will be overriden
-            params.update(
-                {
-                    "previous_rating_measure": "mean",
-                    "min_reviews_for_herding": 5,
-                    "one_star_lowest_limit": -1.5,
-                    "five_star_highest_limit": 1.5,
-                    "max_bias_5_star": 0.5,
-                }
-            )
-            simulator = simulator_class.RatingScaleSimulator(params)
-        elif self.simulator_type == "marketplace":
-            # The additional parameters for the marketplace simulator, will be overridden by the loaded simulator
-            params.update(
-                {
-                    "previous_rating_measure": "mean",
-                    "min_reviews_for_herding": 5,
-                    "one_star_lowest_limit": -1.5,
-                    "five_star_highest_limit": 1.5,
-                    "max_bias_5_star": 0.5,
-                    "num_products": 1400,
-                    "num_total_marketplace_reviews": 140_000,
-                    "consideration_set_size": 5,
-                }
-            )
-            simulator = marketplace_simulator_class.MarketplaceSimulator(params)
-        else:
-            raise ValueError(
-                f"""
-                simulator_type has to be one of single_rho, double_rho, single_herding, double_herding, rating_scale
-                or marketplace. Found {self.simulator_type} instead
-                """
-            )
+        self.set_default_parameter_prior()
+        # Simulator classes are looked up by simulator_type in the registry of simulators, along with the additional
+        # parameters they need to initialize. Again the values aren't important as they will be overridden by those of
+        # the loaded simulator
+        simulator_cls = get_registered_simulator(self.simulator_type)
+        params.update(simulator_cls.placeholder_params)
+        simulator = simulator_cls(params)
 
-        simulator.load_simulator(dirname)
+        # Reads both simulations saved with save_simulations and sharded runs written by simulate_sharded
+        # With lazy=True, simulations are memory-mapped from their store and only read as they are indexed
+        simulator.load_simulator(dirname, lazy=lazy)
         # For marketplace simulations, we need the extra step of unravelling the simulations from shape
         # (num_marketplaces X num_products, ) to shape (num_simulations, )
-        if self.simulator_type == "marketplace":
-            # https://mathieularose.com/how-not-to-flatten-a-list-of-lists-in-python
-            simulator.simulations = np.array(list(itertools.chain.from_iterable(simulator.simulations)), dtype=object)
+        if isinstance(simulator, marketplace_simulator_class.MarketplaceSimulator):
+            if not lazy:
+                # https://mathieularose.com/how-not-to-flatten-a-list-of-lists-in-python
+                simulator.simulations = np.array(
+                    list(itertools.chain.from_iterable(simulator.simulations)), dtype=object
+                )
+            elif self.simulation_type == "histogram":
+                # Lazily loaded histograms are a memory-mapped (num_marketplaces, num_products, 5) array, which is
+                # flattened without reading it. Lazily loaded timeseries are a SimulationStore, which is already flat
+                simulator.simulations = simulator.simulations.reshape(-1, 5)
         self.simulator = simulator
 
+    def set_default_parameter_prior(self) -> None:
+        if self.parameter_prior is None:
+            self.parameter_prior = get_parameter_prior(self.simulator_type, self.device)
+
     def infer_snpe_posterior(
         self,
         embedding_net_creator: Optional[Callable],
@@ -122,6 +124,8 @@ class BaseInference:
             "parameter_prior": self.parameter_prior,
             "device": self.device,
             "padded_simulation_length": self.padded_simulation_length,
+            "num_checkpoints": self.num_checkpoints,
+            "checkpoint_spacing": self.checkpoint_spacing,
             "posterior": self.posterior,
         }
         with open(dirname / (self.__class__.__name__ + f"_{self.simulator_type}.pkl"), "wb") as f:
@@ -132,10 +136,11 @@ class BaseInference:
             inference_dict = pickle.load(f)
         for key in inference_dict:
             setattr(self, key, inference_dict[key])
+        self.embedding_cache = {}
 
 
 class HistogramInference(BaseInference):
-    def __init__(self, parameter_prior: torch.distributions.Distribution, device: str = "cpu"):
+    def __init__(self, parameter_prior: Optional[torch.distributions.Distribution] = None, device: str = "cpu"):
         super(HistogramInference, self).__init__(parameter_prior, device)
 
     def infer_snpe_posterior(
@@ -157,64 +162,7 @@ class HistogramInference(BaseInference):
         # Add the length of the padded simulations (if timeseries) for later use
         if self.simulation_type == "timeseries":
             self.padded_simulation_length = int(simulations.size()[-1])
-        # Get the simulation parameters
-        # Remember that the simulation parameter arrays have num_dist_samples as their first axis
-        # This is there to allow posterior distributions of parameters to be sampled during simulations, and
-        # num_dist_samples refers to the number of posterior samples available
-        # However, when simulating from scratch (and running inference thereafter) there is no meaning to
-        # num_dist_samples. We resolve this by just tiling the parameter arrays a small number of times (like 10)
-        # to recreate the effect of sampling parameters from a distribution
-        # So, that means that during inference we can just pick 1 copy of these parameter arrays and ignore the
-        # others (which are all identical) - we just pick the first copy here
-        if self.simulator_type in ("single_rho", "double_rho"):
-            parameters = torch.from_numpy(self.simulator.simulation_parameters["rho"][0, :, :]).type(torch.FloatTensor)
-        elif self.simulator_type == "single_herding":
-            parameters = np.hstack(
-                (
-                    self.simulator.simulation_parameters["rho"][0, :, :],
-                    self.simulator.simulation_parameters["h_p"][0, :, None],
-                )
-            )
-            np.testing.assert_array_equal(parameters[:, :2], self.simulator.simulation_parameters["rho"][0])
-            np.testing.assert_array_equal(parameters[:, 2], self.simulator.simulation_parameters["h_p"][0])
-            parameters = torch.from_numpy(parameters).type(torch.FloatTensor)
-        elif self.simulator_type == "double_herding":
-            parameters = np.hstack(
-                (
-                    self.simulator.simulation_parameters["rho"][0, :, :],
-                    self.simulator.simulation_parameters["h_p"][0, :, :],
-                )
-            )
-            np.testing.assert_array_equal(parameters[:, :2], self.simulator.simulation_parameters["rho"][0])
-            np.testing.assert_array_equal(parameters[:, 2:], self.simulator.simulation_parameters["h_p"][0])
-            parameters = torch.from_numpy(parameters).type(torch.FloatTensor)
-        elif self.simulator_type in ("rating_scale", "marketplace"):
-            parameters = np.hstack(
-                (
-                    self.simulator.simulation_parameters["rho"][0, :, :],
-                    self.simulator.simulation_parameters["h_p"][0, :, None],
-                    self.simulator.simulation_parameters["p_1"][0, :, None],
-                    self.simulator.simulation_parameters["p_2"][0, :, None],
-                    self.simulator.simulation_parameters["p_4"][0, :, None],
-                    self.simulator.simulation_parameters["p_5"][0, :, None],
-                    self.simulator.simulation_parameters["bias_5_star"][0, :, None]
-                )
-            )
-            np.testing.assert_array_equal(parameters[:, :2], self.simulator.simulation_parameters["rho"][0])
-            np.testing.assert_array_equal(parameters[:, 2], self.simulator.simulation_parameters["h_p"][0])
-            np.testing.assert_array_equal(parameters[:, 3], self.simulator.simulation_parameters["p_1"][0])
-            np.testing.assert_array_equal(parameters[:, 4], self.simulator.simulation_parameters["p_2"][0])
-            np.testing.assert_array_equal(parameters[:, 5], self.simulator.simulation_parameters["p_4"][0])
-            np.testing.assert_array_equal(parameters[:, 6], self.simulator.simulation_parameters["p_5"][0])
-            np.testing.assert_array_equal(parameters[:, 7], self.simulator.simulation_parameters["bias_5_star"][0])
-            parameters = torch.from_numpy(parameters).type(torch.FloatTensor)
-        else:
-            raise ValueError(
-                f"""
-                simulator_type has to be one of single_rho, double_rho, single_herding, double_herding, rating_scale
-                or marketplace. Found {self.simulator_type} instead
-                """
-            )
+        parameters = self.get_training_parameters()
 
         # Get the embedding net for the simulations
         if embedding_net_creator is not None:
@@ -245,42 +193,497 @@ class HistogramInference(BaseInference):
         if self.device == "cuda":
             inference._neural_net.to(device="cpu")
         # Get the training related metrics
-        self.best_validation_log_prob = inference._summary["best_validation_log_prob"][-1]
-        self.training_epochs = inference._summary["epochs_trained"][-1]
+        self.best_validation_log_prob, self.training_epochs = get_sbi_training_summary(inference)
         # Build the posterior from the density estimator
         self.posterior = inference.build_posterior(density_estimator)
+        self.embedding_cache = {}
 
-    def get_posterior_samples(self, observations: np.ndarray, num_samples: int = 5_000) -> np.ndarray:
-        # Check if array of observations is 2-D and has 5 dimensions (ratings go from 1 to 5)
-        observations = sklearn.utils.check_array(observations, ensure_min_features=5)
-        if self.simulator_type == "single_rho":
-            num_parameters = 1
-        elif self.simulator_type == "double_rho":
-            num_parameters = 2
-        elif self.simulator_type == "single_herding":
-            num_parameters = 3
-        elif self.simulator_type == "double_herding":
-            num_parameters = 4
-        elif self.simulator_type in ("rating_scale", "marketplace"):
-            num_parameters = 8
-        else:
-            raise ValueError(
+    def infer_snpe_posterior_online(
+        self,
+        simulator: simulator_class.BaseSimulator,
+        embedding_net_creator: Optional[Callable] = None,
+        embedding_net_conf: Optional[Dict] = None,
+        model: str = "maf",
+        batch_size: int = 50,
+        learning_rate: float = 5e-4,
+        hidden_features: int = 50,
+        num_transforms: int = 5,
+        num_producers: Optional[int] = None,
+        simulation_batch_size: int = 100,
+        compiled: bool = False,
+        vectorized: bool = False,
+        replay_buffer_size: int = 100_000,
+        min_replay_buffer_size: int = 1_000,
+        num_validation_simulations: int = 1_000,
+        validation_interval: int = 500,
+        target_validation_log_prob: Optional[float] = None,
+        stop_after_validations: int = 20,
+        max_num_simulations: Optional[int] = None,
+        max_num_training_steps: Optional[int] = None,
+        clip_max_norm: Optional[float] = 5.0,
+    ) -> None:
+        # Online version of infer_snpe_posterior, in which simulation and training overlap instead of running back to
+        # back. No simulations need to exist beforehand: a pool of num_producers processes (all CPUs but one by
+        # default) keeps simulating batches of simulation_batch_size histograms, with fresh parameters drawn from the
+        # prior of the simulator for every batch. In the meantime, the density estimator trains on minibatches drawn
+        # from a bounded replay buffer of the latest replay_buffer_size simulations, which is topped up with new
+        # batches as soon as producers finish them
+        # The first num_validation_simulations simulations are held out as a fixed validation set (and also used to
+        # z-score parameters and simulations). Every validation_interval training steps the validation log prob is
+        # calculated, along with the throughput of simulations and training steps, and training stops once:
+        #   the validation log prob reaches target_validation_log_prob, or
+        #   the validation log prob has not improved for stop_after_validations validations, or
+        #   max_num_training_steps training steps have been done
+        # Producers stop after max_num_simulations simulations (if given), training then continues on the buffer
+        # Only histogram simulations of the per-product simulators are supported, as timeseries have no fixed shape
+        # to keep in a replay buffer and marketplaces can't be simulated one product at a time
+        assert (
+            simulator.simulation_type == "histogram"
+        ), f"Online training needs a simulator of review histograms, found simulation_type={simulator.simulation_type}"
+        assert not isinstance(
+            simulator, marketplace_simulator_class.MarketplaceSimulator
+        ), "Marketplaces can't be simulated in batches of products, online training is not available for them"
+        # Training only starts once the validation set and the minimum replay buffer are full, which would never happen
+        # if producers stopped before simulating enough for both
+        num_warm_up_simulations = num_validation_simulations + min(min_replay_buffer_size, replay_buffer_size)
+        assert (
+            max_num_simulations is None or max_num_simulations >= num_warm_up_simulations
+        ), f"""
+        max_num_simulations={max_num_simulations} is too low to start training, at least {num_warm_up_simulations}
+        simulations are needed to fill the validation set ({num_validation_simulations} simulations) and the minimum
+        replay buffer ({min(min_replay_buffer_size, replay_buffer_size)} simulations)
+        """
+        self.simulator = simulator
+        self.simulator_type = simulator.simulator_type
+        self.simulation_type = simulator.simulation_type
+        self.set_default_parameter_prior()
+        if num_producers is None:
+            num_producers = max(mp.cpu_count() - 1, 1)
+        # Training gets the CPUs that producers leave free, so that producers and training don't oversubscribe them
+        if self.device == "cpu":
+            torch.set_num_threads(max(mp.cpu_count() - num_producers, 1))
+        # Producers get a copy of the simulator without any simulations it may hold, as it is pickled with every batch
+        producer_simulator = copy.copy(simulator)
+        producer_simulator.__dict__.pop("simulations", None)
+        producer_simulator.__dict__.pop("simulation_parameters", None)
+        root_seed = np.random.SeedSequence(simulator.seed)
+
+        def submit_batch(batch: int) -> Future:
+            batch_seed = np.random.SeedSequence(root_seed.entropy, spawn_key=(batch,)).generate_state(4).tolist()
+            return executor.submit(
+                simulate_training_batch, producer_simulator, batch_seed, simulation_batch_size, compiled, vectorized
+            )
+
+        # Keep twice as many batches in flight as there are producers, so that producers never wait on the trainer
+        executor = get_reusable_executor(max_workers=num_producers)
+        num_submitted_batches = 0
+        num_received_simulations = 0
+        pending_batches = set()  # type: Set[Future]
+        validation_parameters, validation_simulations = [], []  # type: List[torch.Tensor], List[torch.Tensor]
+        replay_buffer = None  # type: Optional[ReplayBuffer]
+
+        def receive_batches(block: bool) -> None:
+            nonlocal num_submitted_batches, num_received_simulations, pending_batches, replay_buffer
+            while len(pending_batches) < 2 * num_producers and (
+                max_num_simulations is None or num_submitted_batches * simulation_batch_size < max_num_simulations
+            ):
+                pending_batches.add(submit_batch(num_submitted_batches))
+                num_submitted_batches += 1
+            if len(pending_batches) == 0:
+                return
+            done_batches, pending_batches = wait(
+                pending_batches, timeout=None if block else 0, return_when=FIRST_COMPLETED
+            )
+            for done_batch in done_batches:
+                simulation_parameters, simulations, _ = done_batch.result()
+                parameters = self.get_training_parameters(simulation_parameters)
+                simulations = torch.from_numpy(simulations).type(torch.FloatTensor)
+                num_received_simulations += len(simulations)
+                # Simulations go to the validation set until it is full, and to the replay buffer afterwards
+                num_missing_validation = num_validation_simulations - sum(len(val) for val in validation_simulations)
+                if num_missing_validation > 0:
+                    validation_parameters.append(parameters[:num_missing_validation])
+                    validation_simulations.append(simulations[:num_missing_validation])
+                    parameters, simulations = parameters[num_missing_validation:], simulations[num_missing_validation:]
+                if len(simulations) > 0:
+                    if replay_buffer is None:
+                        replay_buffer = ReplayBuffer(replay_buffer_size, parameters.shape[1], simulations.shape[1:])
+                    replay_buffer.add(parameters, simulations)
+            # Pull in any other batches that finished in the meantime as well
+            if block and any(pending_batch.done() for pending_batch in pending_batches):
+                receive_batches(block=False)
+
+        start = time.time()
+        try:
+            # Wait for the validation set and the minimum size of the replay buffer before training starts
+            while replay_buffer is None or len(replay_buffer) < min(min_replay_buffer_size, replay_buffer_size):
+                receive_batches(block=True)
+            print(
+                f"Starting online training after {num_received_simulations} simulations in {time.time() - start:.1f}s"
+            )
+            validation_parameters, validation_simulations = (
+                torch.cat(validation_parameters),
+                torch.cat(validation_simulations),
+            )
+            # As in infer_snpe_posterior_streaming, parameters and simulations are z-scored with the statistics of a
+            # subset of simulations, here the validation set
+            trainer = DensityEstimatorTrainer(
+                validation_parameters,
+                validation_simulations,
+                embedding_net_creator=embedding_net_creator,
+                embedding_net_conf=embedding_net_conf,
+                model=model,
+                learning_rate=learning_rate,
+                hidden_features=hidden_features,
+                num_transforms=num_transforms,
+                clip_max_norm=clip_max_norm,
+                device=self.device,
+            )
+            validations_since_last_improvement = 0
+            summary = {
+                "training_steps": [],
+                "num_simulations": [],
+                "validation_log_prob": [],
+                "simulations_per_second": [],
+                "training_steps_per_second": [],
+            }  # type: Dict[str, List]
+            training_start = time.time()
+            num_training_steps = 0
+            while max_num_training_steps is None or num_training_steps < max_num_training_steps:
+                # Top up the replay buffer with any batches that producers have finished, without waiting on them
+                receive_batches(block=False)
+                trainer.training_step(*replay_buffer.sample(batch_size))
+                num_training_steps += 1
+                if num_training_steps % validation_interval != 0:
+                    continue
+
+                validation_log_prob, improved = trainer.validate([(validation_parameters, validation_simulations)])
+                elapsed = time.time() - start
+                summary["training_steps"].append(num_training_steps)
+                summary["num_simulations"].append(num_received_simulations)
+                summary["validation_log_prob"].append(validation_log_prob)
+                summary["simulations_per_second"].append(num_received_simulations / elapsed)
+                summary["training_steps_per_second"].append(num_training_steps / (time.time() - training_start))
+                print(
+                    f"\t Step {num_training_steps}: validation log prob {validation_log_prob:.4f}, "
+                    + f"{num_received_simulations} simulations ({summary['simulations_per_second'][-1]:.1f}/s), "
+                    + f"{summary['training_steps_per_second'][-1]:.1f} steps/s",
+                    end="\r",
+                )
+                validations_since_last_improvement = 0 if improved else validations_since_last_improvement + 1
+                if target_validation_log_prob is not None and validation_log_prob >= target_validation_log_prob:
+                    print(f"\n Reached target validation log prob of {target_validation_log_prob}")
+                    break
+                if validations_since_last_improvement >= stop_after_validations:
+                    break
+        finally:
+            # Simulations still in flight are not needed anymore
+            for pending_batch in pending_batches:
+                pending_batch.cancel()
+            executor.shutdown(wait=True, kill_workers=True)
+
+        print(
+            f"""
+            Online training stopped after {num_training_steps} steps and {num_received_simulations} simulations in
+            {time.time() - start:.1f}s, best validation log prob {trainer.best_validation_log_prob}
+            """
+        )
+        self.best_validation_log_prob = trainer.best_validation_log_prob
+        self.training_steps = num_training_steps
+        self.online_training_summary = summary
+        self.posterior = trainer.build_posterior(
+            self.parameter_prior, torch.Size([1, *validation_simulations.shape[1:]])
+        )
+        self.embedding_cache = {}
+
+    def infer_snpe_posterior_sequential(
+        self,
+        simulator: simulator_class.BaseSimulator,
+        observation: np.ndarray,
+        num_rounds: int = 3,
+        num_simulations_per_round: int = 10_000,
+        proposal_type: str = "truncated",
+        truncation_quantile: float = 1e-4,
+        embedding_net_creator: Optional[Callable] = None,
+        embedding_net_conf: Optional[Dict] = None,
+        model: str = "maf",
+        batch_size: int = 50,
+        learning_rate: float = 5e-4,
+        hidden_features: int = 50,
+        num_transforms: int = 5,
+        **simulate_kwargs,
+    ) -> None:
+        # Sequential (multi-round) version of infer_snpe_posterior, for a single observed product histogram. Instead
+        # of spending the whole simulation budget on parameters from the full prior, only the first round simulates
+        # from the prior, and every later round simulates from a proposal that focuses on the region of parameter
+        # space that is plausible for the observation. This matters for expensive simulators like the marketplace
+        # simulator. Simulations of all rounds are kept and reused for training in every round
+        # proposal_type picks the proposal of later rounds:
+        #   truncated: the prior, truncated to the highest density region of the current posterior of the observation
+        #       that holds 1 - truncation_quantile of its mass (TSNPE). As truncated prior samples are still prior
+        #       samples within that region, the standard (first round) SNPE loss applies and the posterior stays
+        #       amortized, i.e, valid for other observations within the region too
+        #   atomic: the current posterior of the observation itself, with sbi's atomic (APT / SNPE-C) loss correcting
+        #       for the proposal. The posterior is then only valid for the observation
+        # The simulator isn't loaded from disk but run here, with any further simulate_kwargs (e.g, the embeddings
+        # artifact path of the marketplace simulator). Parameters are drawn in the form of training parameters and
+        # converted to simulation parameters with get_simulation_parameters
+        # Simulations per round are rounded up to full marketplaces for the marketplace simulator, whose products are
+        # all used as separate training simulations. The simulations spent in every round are reported and kept in
+        # sequential_training_summary
+        assert proposal_type in (
+            "truncated",
+            "atomic",
+        ), f"Proposal type needs to be one of truncated or atomic, found {proposal_type} instead"
+        assert (
+            simulator.simulation_type == "histogram"
+        ), f"""
+        Sequential inference needs a simulator of review histograms, found simulation_type={simulator.simulation_type}
+        """
+        self.simulator = simulator
+        self.simulator_type = simulator.simulator_type
+        self.simulation_type = simulator.simulation_type
+        self.set_default_parameter_prior()
+        observation = torch.from_numpy(
+            sklearn.utils.check_array(np.atleast_2d(observation), ensure_min_features=5)
+        ).type(torch.FloatTensor)
+        assert len(observation) == 1, f"Sequential inference is done for a single observation, found {len(observation)}"
+        is_marketplace = isinstance(simulator, marketplace_simulator_class.MarketplaceSimulator)
+        products_per_simulation = simulator.num_products if is_marketplace else 1
+        num_simulator_runs = int(np.ceil(num_simulations_per_round / products_per_simulation))
+        # With a root seed, every round gets its own stream derived from it, so that rounds don't repeat the same
+        # random draws with different parameters
+        root_seed = np.random.SeedSequence(simulator.seed)
+
+        inference = None  # type: Optional[sbi_inference.SNPE]
+        proposal = self.parameter_prior
+        summary = {
+            "num_simulations": [],
+            "total_simulations": [],
+            "proposal_acceptance_rate": [],
+            "best_validation_log_prob": [],
+        }  # type: Dict[str, List]
+        for sequential_round in range(num_rounds):
+            num_round_simulations = num_simulator_runs * products_per_simulation
+            if sequential_round == 0:
+                parameters, acceptance_rate = self.parameter_prior.sample((num_round_simulations,)), 1.0
+            elif proposal_type == "truncated":
+                parameters, acceptance_rate = self.sample_truncated_prior(
+                    observation, num_round_simulations, truncation_quantile
+                )
+            else:
+                parameters, acceptance_rate = proposal.sample((num_round_simulations,), x=observation), 1.0
+            if simulator.seed is not None:
+                simulator.simulation_seed = (
+                    np.random.SeedSequence(root_seed.entropy, spawn_key=(sequential_round,)).generate_state(4).tolist()
+                )
+            simulator.simulate(
+                num_simulator_runs,
+                simulation_parameters=self.get_simulation_parameters(parameters.numpy()),
+                **simulate_kwargs,
+            )
+            # Marketplace simulations have shape (num_marketplaces X num_products X 5), and the parameters of product
+            # p in marketplace m are at index m * num_products + p, so they line up with the flattened simulations
+            simulations = torch.from_numpy(simulator.simulations.reshape(-1, 5).astype(np.float32))
+
+            if inference is None:
+                # Get the embedding net for the simulations
+                if embedding_net_creator is not None:
+                    assert (
+                        embedding_net_conf is not None
+                    ), f"""embedding_net_conf dict not provided even though
+                       embedding_net_creator function {embedding_net_creator} provided"""
+                    embedding_net = embedding_net_creator(simulations[:5], **embedding_net_conf)
+                else:
+                    embedding_net = torch.nn.Identity()
+                print(f"Embedding net created: \n {embedding_net}")
+                posterior_net = sbi.utils.posterior_nn(
+                    model=model,
+                    embedding_net=embedding_net,
+                    hidden_features=hidden_features,
+                    num_transforms=num_transforms,
+                )
+                inference = sbi_inference.SNPE(
+                    prior=self.parameter_prior,
+                    density_estimator=posterior_net,
+                    device=self.device,
+                    show_progress_bars=True,
+                )
+            # Truncated prior samples are appended as if they came from the prior, so that the first round loss is used
+            inference.append_simulations(
+                parameters, simulations, proposal=proposal if proposal_type == "atomic" else None
+            )
+            density_estimator = inference.train(
+                training_batch_size=batch_size, learning_rate=learning_rate, show_train_summary=True
+            )
+            if self.device == "cuda":
+                inference._neural_net.to(device="cpu")
+            self.posterior = inference.build_posterior(density_estimator)
+            self.embedding_cache = {}
+            proposal = self.posterior.set_default_x(observation)
+            if self.device == "cuda":
+                inference._neural_net.to(device=self.device)
+
+            summary["num_simulations"].append(len(simulations))
+            summary["total_simulations"].append(int(np.sum(summary["num_simulations"])))
+            summary["proposal_acceptance_rate"].append(acceptance_rate)
+            summary["best_validation_log_prob"].append(get_sbi_training_summary(inference)[0])
+            print(
                 f"""
-                simulator_type has to be one of single_rho, double_rho, single_herding, double_herding, rating_scale
-                or marketplace. Found {self.simulator_type} instead
+                Round {sequential_round + 1} of {num_rounds}: {len(simulations)} simulations
+                ({summary["total_simulations"][-1]} in total), proposal acceptance rate {acceptance_rate:.4f},
+                best validation log prob {summary["best_validation_log_prob"][-1]}
                 """
             )
-        posterior_samples = np.empty((num_samples, observations.shape[0], num_parameters), dtype=np.float64)
 
-        for row in range(observations.shape[0]):
-            posterior_samples[:, row, :] = self.posterior.sample(
-                (num_samples,), x=torch.tensor(observations[row, :]).type(torch.FloatTensor), show_progress_bars=False
-            ).numpy()
-        return posterior_samples
+        if self.device == "cuda":
+            inference._neural_net.to(device="cpu")
+        self.best_validation_log_prob, self.training_epochs = get_sbi_training_summary(inference)
+        self.sequential_training_summary = summary
+
+    def sample_truncated_prior(
+        self,
+        observation: torch.Tensor,
+        num_samples: int,
+        truncation_quantile: float = 1e-4,
+        num_threshold_samples: int = 10_000,
+        max_sampling_batch_size: int = 100_000,
+        max_num_prior_samples: int = 100_000_000,
+    ) -> Tuple[torch.Tensor, float]:
+        # Draws num_samples samples from the prior, truncated to the highest density region of the current posterior of
+        # the observation. The boundary of the region is the truncation_quantile quantile of the posterior log probs of
+        # num_threshold_samples posterior samples, and prior samples are accepted if their posterior log prob is above
+        # it. Prior samples are drawn and evaluated in batches of max_sampling_batch_size
+        # Returns the samples and the fraction of prior samples that were accepted
+        density_estimator = self.posterior.net
+        density_estimator.eval()
+        device = next(density_estimator.parameters()).device
+        observation = observation.to(device)
+        with torch.no_grad():
+            posterior_samples = self.sample_posterior_batch(observation, num_threshold_samples)[:, 0, :]
+            posterior_log_probs = density_estimator.log_prob(
+                torch.from_numpy(posterior_samples).type(torch.FloatTensor).to(device),
+                observation.repeat(num_threshold_samples, 1),
+            )
+            threshold = torch.quantile(posterior_log_probs, truncation_quantile)
+            accepted_samples = []  # type: List[torch.Tensor]
+            num_accepted, num_prior_samples = 0, 0
+            while num_accepted < num_samples:
+                assert (
+                    num_prior_samples < max_num_prior_samples
+                ), f"""
+                Only {num_accepted} out of {num_prior_samples} prior samples were in the truncated region of the
+                posterior. Increase truncation_quantile or max_num_prior_samples
+                """
+                prior_samples = self.parameter_prior.sample((max_sampling_batch_size,))
+                is_accepted = (
+                    density_estimator.log_prob(
+                        prior_samples.to(device), observation.repeat(max_sampling_batch_size, 1)
+                    ).cpu()
+                    >= threshold.cpu()
+                )
+                accepted_samples.append(prior_samples[is_accepted])
+                num_accepted += int(is_accepted.sum())
+                num_prior_samples += max_sampling_batch_size
+        return torch.cat(accepted_samples)[:num_samples], num_accepted / num_prior_samples
+
+    def get_training_parameters(self, simulation_parameters: Optional[dict] = None) -> torch.Tensor:
+        # Get the simulation parameters as a (num_simulations X num_parameters) tensor to train on
+        # These are the parameters of the loaded simulations, unless some other simulation parameters are provided
+        # Remember that the simulation parameter arrays have num_dist_samples as their first axis
+        # This is there to allow posterior distributions of parameters to be sampled during simulations, and
+        # num_dist_samples refers to the number of posterior samples available
+        # However, when simulating from scratch (and running inference thereafter) there is no meaning to
+        # num_dist_samples, as all distribution samples of a simulation are identical. So during inference we just
+        # pick the first distribution sample
+        # The parameter schema of the simulator lays out the parameters as columns of the tensor, see ParameterSchema
+        if simulation_parameters is None:
+            simulation_parameters = self.simulator.simulation_parameters
+        return torch.from_numpy(get_parameter_schema(self.simulator_type).pack(simulation_parameters))
+
+    def get_simulation_parameters(self, parameters: np.ndarray) -> dict:
+        # Inverse of get_training_parameters: splits a (num_simulations X num_parameters) array of parameters into the
+        # dict of float64 simulation parameter arrays that simulators take. All simulation parameters are point values
+        # here, so a single distribution sample per simulation is enough
+        return get_parameter_schema(self.simulator_type).unpack(parameters)
+
+    def get_posterior_samples(self, observations: np.ndarray, num_samples: int = 5_000) -> np.ndarray:
+        # Check if array of observations is 2-D and has 5 dimensions (ratings go from 1 to 5)
+        observations = sklearn.utils.check_array(observations, ensure_min_features=5)
+        return self.sample_posterior_batch(torch.tensor(observations).type(torch.FloatTensor), num_samples)
+
+    def sample_posterior_batch(
+        self, observations: torch.Tensor, num_samples: int, max_sampling_batch_size: int = 100_000
+    ) -> np.ndarray:
+        # Draws num_samples posterior samples for every observation, for many observations at once instead of calling
+        # posterior.sample once per observation. Observations are processed in chunks of
+        # max_sampling_batch_size // num_samples, so that at most max_sampling_batch_size samples are held in memory
+        # at a time. For every chunk, the density estimator (flow) embeds all observations in a single forward pass of
+        # the embedding net (see embed_observations) and samples all of them together
+        # As posterior.sample does, samples outside the support of the prior are rejected, and only the observations
+        # that are still short of num_samples accepted samples are sampled again
+        # Returns an array of shape (num_samples X num_observations X num_parameters), as get_posterior_samples does
+        density_estimator = self.posterior.net
+        density_estimator.eval()
+        observations = observations.to(next(density_estimator.parameters()).device)
+        chunk_size = max(max_sampling_batch_size // num_samples, 1)
+        posterior_samples = []
+        with torch.no_grad():
+            for start in range(0, len(observations), chunk_size):
+                chunk = self.embed_observations(observations[start : start + chunk_size])
+                accepted_samples = [[] for _ in range(len(chunk))]  # type: List[List[torch.Tensor]]
+                num_accepted = np.zeros(len(chunk), dtype=int)
+                num_to_sample = num_samples
+                while np.any(num_accepted < num_samples):
+                    rows = np.where(num_accepted < num_samples)[0]
+                    # Samples have shape (len(rows) X num_to_sample X num_parameters)
+                    samples = self.sample_embedded_observations(num_to_sample, chunk[rows])
+                    is_accepted = within_support(self.parameter_prior, samples.reshape(-1, samples.shape[-1]))
+                    is_accepted = is_accepted.reshape(samples.shape[:2])
+                    for i, row in enumerate(rows):
+                        accepted_samples[row].append(samples[i, is_accepted[i]].cpu())
+                        num_accepted[row] += int(is_accepted[i].sum())
+                    # Only sample as many as are expected to be needed (with some margin) in the next round, given the
+                    # acceptance rate of this round
+                    acceptance_rate = max(float(is_accepted.float().mean()), 1e-3)
+                    num_missing = num_samples - np.min(num_accepted)
+                    num_to_sample = min(int(np.ceil(1.2 * num_missing / acceptance_rate)) + 1, num_samples)
+                posterior_samples.append(
+                    torch.stack([torch.cat(row_samples)[:num_samples] for row_samples in accepted_samples], dim=1)
+                )
+        return torch.cat(posterior_samples, dim=1).numpy().astype(np.float64)
+
+    def embed_observations(self, observations: torch.Tensor) -> torch.Tensor:
+        # Output of the embedding net of the density estimator for a batch of observations (already padded in the
+        # timeseries case). Embeddings are cached per observation, keyed by a hash of the observation, so that
+        # repeated queries for the same observations skip the embedding net. Only observations missing from the
+        # cache are embedded, in a single forward pass
+        density_estimator = self.posterior.net
+        keys = [hashlib.sha1(observation.cpu().numpy().tobytes()).hexdigest() for observation in observations]
+        missing_rows = [row for (row, key) in enumerate(keys) if key not in self.embedding_cache]
+        if missing_rows:
+            with torch.no_grad():
+                embeddings = density_estimator._embedding_net(observations[missing_rows])
+            for row, embedding in zip(missing_rows, embeddings):
+                self.embedding_cache[keys[row]] = embedding
+        return torch.stack([self.embedding_cache[key] for key in keys])
+
+    def sample_embedded_observations(self, num_samples: int, embedded_observations: torch.Tensor) -> torch.Tensor:
+        # Same as sampling the density estimator (nflows Flow.sample) with the observations as context, except that
+        # the observations have already been passed through the embedding net. Returns samples of shape
+        # (num_observations X num_samples X num_parameters)
+        density_estimator = self.posterior.net
+        noise = density_estimator._distribution.sample(num_samples, context=embedded_observations)
+        # Merge the observation and sample dimensions to apply the transform, and split them again afterwards
+        noise = noise.reshape(-1, *noise.shape[2:])
+        samples, _ = density_estimator._transform.inverse(
+            noise, context=torch.repeat_interleave(embedded_observations, num_samples, dim=0)
+        )
+        return samples.reshape(len(embedded_observations), num_samples, *samples.shape[1:])
 
 
 class TimeSeriesInference(HistogramInference):
-    def __init__(self, parameter_prior: torch.distributions.Distribution, device: str = "cpu"):
+    def __init__(self, parameter_prior: Optional[torch.distributions.Distribution] = None, device: str = "cpu"):
         super(TimeSeriesInference, self).__init__(parameter_prior, device)
 
     def infer_snpe_posterior(
@@ -293,7 +696,31 @@ class TimeSeriesInference(HistogramInference):
         learning_rate: float = 5e-4,
         hidden_features: int = 50,
         num_transforms: int = 5,
+        stream_simulations: bool = False,
+        num_checkpoints: Optional[int] = None,
+        checkpoint_spacing: str = "linear",
+        num_length_buckets: Optional[int] = None,
     ) -> None:
+        # With stream_simulations=True, timeseries are padded per minibatch during training instead of all being
+        # padded up front by simulation_transform (which is then not used). Memory then scales with batch_size and not
+        # with the number of simulations. Load the simulator with lazy=True to also read simulations from disk only
+        # when they are needed
+        # Resampling timeseries to num_checkpoints histograms, or padding them per length bucket, are only available
+        # while streaming simulations and switch streaming on (see infer_snpe_posterior_streaming)
+        if stream_simulations or num_checkpoints is not None or num_length_buckets is not None:
+            self.infer_snpe_posterior_streaming(
+                embedding_net_creator,
+                embedding_net_conf,
+                model,
+                batch_size,
+                learning_rate,
+                hidden_features,
+                num_transforms,
+                num_checkpoints=num_checkpoints,
+                checkpoint_spacing=checkpoint_spacing,
+                num_length_buckets=num_length_buckets,
+            )
+            return
         super(TimeSeriesInference, self).infer_snpe_posterior(
             embedding_net_creator,
             embedding_net_conf,
@@ -305,62 +732,156 @@ class TimeSeriesInference(HistogramInference):
             num_transforms,
         )
 
-    def get_posterior_samples(self, observations: np.ndarray, num_samples: int = 5_000) -> np.ndarray:
-        assert hasattr(
-            self, "simulator"
-        ), f"""
-        Simulator needs to be loaded before posterior samples can be obtained in the timeseries case.
-        Run <inference object>.load_simulator first
-        """
-        assert (
-            self.padded_simulation_length is not None
-        ), f"""
-        In the timeseries case, simulations are padded and padded_simulation_length should not be None.
-        Run inference again
-        """
-        # Concatenate the input observations with the simulator's array of simulations so that they can be passed
-        # together to the padding function. We will then pull out the padded observations from this joint array
-        concat_simulations = np.concatenate((self.simulator.simulations, observations), axis=0)
-        padded_concat_simulations = pad_timeseries_for_cnn(concat_simulations, device=self.device)
+    def infer_snpe_posterior_streaming(
+        self,
+        embedding_net_creator: Optional[Callable] = get_cnn_1d,
+        embedding_net_conf: Optional[Dict] = {},
+        model: str = "maf",
+        batch_size: int = 50,
+        learning_rate: float = 5e-4,
+        hidden_features: int = 50,
+        num_transforms: int = 5,
+        validation_fraction: float = 0.1,
+        stop_after_epochs: int = 20,
+        max_num_epochs: int = 2**31 - 1,
+        clip_max_norm: Optional[float] = 5.0,
+        num_standardization_simulations: int = 1_000,
+        num_checkpoints: Optional[int] = None,
+        checkpoint_spacing: str = "linear",
+        num_length_buckets: Optional[int] = None,
+    ) -> None:
+        # sbi's SNPE needs all simulations as a single in-memory tensor, so this runs the same (single round) training
+        # as SNPE.train, but pulls padded minibatches from a PaddedTimeseriesDataset. As in sbi, the loss is the
+        # negative log prob of the parameters under the density estimator, the optimizer is Adam and training stops
+        # once the validation log prob has not improved for stop_after_epochs epochs
+        # Padding every timeseries to the longest one makes the CNN spend most of its time on padding. Two options
+        # reduce that work:
+        # num_checkpoints: every timeseries is resampled to num_checkpoints histograms (linear or log spaced)
+        # num_length_buckets: minibatches are drawn from buckets of similar lengths and padded to their own longest
+        # timeseries. The embedding net then needs to accept any length, e.g, get_cnn_1d with pooled_length set
         assert (
-            self.padded_simulation_length == padded_concat_simulations.size()[-1]
-        ), f"""
-        During inference, simulations were padded to length {self.padded_simulation_length}. While getting posterior
-        samples, they were padded to {padded_concat_simulations.size()[-1]}. Cut observation length to the same length
-        as the maximum used during inference, i.e, {self.padded_simulation_length}
-        """
-        # Pull out the observations from the concatenated and padded array. They are the last few in that array
-        observations = padded_concat_simulations[-observations.shape[0] :, :, :]
-        if self.simulator_type == "single_rho":
-            num_parameters = 1
-        elif self.simulator_type == "double_rho":
-            num_parameters = 2
-        elif self.simulator_type == "single_herding":
-            num_parameters = 3
-        elif self.simulator_type == "double_herding":
-            num_parameters = 4
-        elif self.simulator_type in ("rating_scale", "marketplace"):
-            num_parameters = 8
+            num_checkpoints is None or num_length_buckets is None
+        ), "Timeseries can either be resampled to num_checkpoints or padded per length bucket, not both"
+        parameters = self.get_training_parameters()
+        dataset = PaddedTimeseriesDataset(
+            self.simulator.simulations,
+            parameters,
+            pad_per_batch=num_length_buckets is not None,
+            num_checkpoints=num_checkpoints,
+            checkpoint_spacing=checkpoint_spacing,
+        )
+        self.padded_simulation_length = dataset.padded_length
+        self.num_checkpoints = num_checkpoints
+        self.checkpoint_spacing = checkpoint_spacing
+        print(f"Streaming {len(dataset)} simulations, padded to length {self.padded_simulation_length} per minibatch")
+
+        num_training_examples = int((1 - validation_fraction) * len(dataset))
+        permuted_indices = torch.randperm(len(dataset))
+        train_indices, val_indices = (
+            permuted_indices[:num_training_examples],
+            permuted_indices[num_training_examples:],
+        )
+        # The dataset pads a whole minibatch of simulation ids at a time, so batching is done by the sampler
+        if num_length_buckets is not None:
+            train_sampler = LengthBucketBatchSampler(
+                dataset.lengths, train_indices.tolist(), min(batch_size, len(train_indices)), num_length_buckets
+            )
+            val_sampler = LengthBucketBatchSampler(
+                dataset.lengths,
+                val_indices.tolist(),
+                min(batch_size, len(val_indices)),
+                num_length_buckets,
+                drop_last=False,
+            )
         else:
-            raise ValueError(
-                f"""
-                simulator_type has to be one of single_rho, double_rho, single_herding, double_herding, rating_scale
-                or marketplace. Found {self.simulator_type} instead
-                """
+            train_sampler = torch.utils.data.BatchSampler(
+                torch.utils.data.SubsetRandomSampler(train_indices.tolist()),
+                batch_size=min(batch_size, len(train_indices)),
+                drop_last=True,
             )
-        posterior_samples = np.empty((num_samples, observations.size()[0], num_parameters), dtype=np.float64)
+            val_sampler = torch.utils.data.BatchSampler(
+                val_indices.tolist(), batch_size=min(batch_size, len(val_indices)), drop_last=True
+            )
+        train_loader = torch.utils.data.DataLoader(dataset, sampler=train_sampler, batch_size=None)
+        val_loader = torch.utils.data.DataLoader(dataset, sampler=val_sampler, batch_size=None)
 
-        for row in range(observations.size()[0]):
-            if self.device == "cuda":
-                posterior_samples[:, row, :] = (
-                    self.posterior.sample(
-                        (num_samples,), x=observations[row, :, :][None, :, :], show_progress_bars=False
-                    )
-                    .cpu()
-                    .numpy()
+        # sbi z-scores the parameters and simulations with statistics of the whole training set when building the
+        # density estimator. Here these statistics are estimated from a random subset of the training simulations
+        standardization_parameters, standardization_simulations = dataset[
+            train_indices[:num_standardization_simulations].tolist()
+        ]
+        # With length buckets, simulations have no fixed length and are z-scored per star rating
+        trainer = DensityEstimatorTrainer(
+            standardization_parameters,
+            standardization_simulations,
+            embedding_net_creator=embedding_net_creator,
+            embedding_net_conf=embedding_net_conf,
+            model=model,
+            learning_rate=learning_rate,
+            hidden_features=hidden_features,
+            num_transforms=num_transforms,
+            clip_max_norm=clip_max_norm,
+            standardize_per_rating=num_length_buckets is not None,
+            device=self.device,
+        )
+        epochs_since_last_improvement = 0
+        epoch = 0
+        while epoch < max_num_epochs and epochs_since_last_improvement < stop_after_epochs:
+            for parameters_batch, simulations_batch in train_loader:
+                trainer.training_step(parameters_batch, simulations_batch)
+            epoch += 1
+            validation_log_prob, improved = trainer.validate(val_loader)
+            epochs_since_last_improvement = 0 if improved else epochs_since_last_improvement + 1
+            print(f"\t Epoch {epoch}: validation log prob {validation_log_prob}", end="\r")
+
+        print(
+            f"\n Training converged after {epoch} epochs, best validation log prob {trainer.best_validation_log_prob}"
+        )
+        self.best_validation_log_prob = trainer.best_validation_log_prob
+        self.training_epochs = epoch
+        self.posterior = trainer.build_posterior(
+            self.parameter_prior, torch.Size([1, 5, self.padded_simulation_length])
+        )
+        self.embedding_cache = {}
+
+    def get_posterior_samples(
+        self, observations: np.ndarray, num_samples: int = 5_000, truncate_observations: bool = False
+    ) -> np.ndarray:
+        # Observations are prepared for the embedding net in the same way as the training simulations, using only the
+        # padded length (or number of checkpoints) stored during inference. The simulator doesn't need to be loaded
+        if self.num_checkpoints is not None:
+            # Timeseries were resampled to a fixed number of checkpoints during training, observations are resampled
+            # in the same way
+            observations = pad_timeseries_batch(
+                observations,
+                np.arange(len(observations)),
+                num_checkpoints=self.num_checkpoints,
+                checkpoint_spacing=self.checkpoint_spacing,
+            )
+        else:
+            assert (
+                self.padded_simulation_length is not None
+            ), f"""
+            In the timeseries case, simulations are padded and padded_simulation_length should not be None.
+            Run inference again
+            """
+            # Observations longer than the padded length used during inference can't be conditioned on as they are.
+            # They are only cut to that length (i.e, to their first reviews) if explicitly asked for
+            observation_lengths = np.array([len(observation) for observation in observations])
+            num_long_observations = np.sum(observation_lengths > self.padded_simulation_length)
+            assert (
+                num_long_observations == 0 or truncate_observations
+            ), f"""
+            {num_long_observations} observations are longer than the length of {self.padded_simulation_length} that
+            simulations were padded to during inference. Run inference with longer simulations, or pass
+            truncate_observations=True to condition on only the first {self.padded_simulation_length} histograms of
+            these observations
+            """
+            if num_long_observations > 0:
+                observations = timeseries_to_object_array(
+                    [observation[: self.padded_simulation_length] for observation in observations]
                 )
-            else:
-                posterior_samples[:, row, :] = self.posterior.sample(
-                    (num_samples,), x=observations[row, :, :][None, :, :], show_progress_bars=False
-                ).numpy()
-        return posterior_samples
+            observations = pad_timeseries_batch(
+                observations, np.arange(len(observations)), self.padded_simulation_length
+            )
+        return self.sample_posterior_batch(observations, num_samples)
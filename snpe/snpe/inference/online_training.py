@@ -0,0 +1,69 @@
+import time
+
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from snpe.simulations.simulator_class import BaseSimulator
+
+
+class ReplayBuffer:
+    # Bounded buffer of (parameters, simulation) training examples for online SNPE training, where simulations keep
+    # arriving from a pool of simulators while the density estimator trains. Examples are held in preallocated tensors
+    # of capacity rows. Once the buffer is full, every new example overwrites the oldest one, so memory stays bounded
+    # irrespective of the number of simulations produced over the whole run
+    def __init__(self, capacity: int, parameter_dim: int, simulation_shape: Tuple[int, ...]):
+        self.capacity = capacity
+        self.parameters = torch.empty((capacity, parameter_dim), dtype=torch.float32)
+        self.simulations = torch.empty((capacity, *simulation_shape), dtype=torch.float32)
+        self._position = 0
+        self._length = 0
+        # Total number of examples ever added to the buffer, including the ones that have been overwritten since
+        self.num_added = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def add(self, parameters: torch.Tensor, simulations: torch.Tensor) -> None:
+        assert len(parameters) == len(
+            simulations
+        ), f"Found {len(parameters)} sets of parameters for {len(simulations)} simulations"
+        # Only the latest capacity examples survive if more than that are added at once
+        parameters, simulations = parameters[-self.capacity :], simulations[-self.capacity :]
+        rows = (self._position + torch.arange(len(parameters))) % self.capacity
+        self.parameters[rows] = parameters
+        self.simulations[rows] = simulations
+        self._position = int((self._position + len(parameters)) % self.capacity)
+        self._length = min(self._length + len(parameters), self.capacity)
+        self.num_added += len(parameters)
+
+    def sample(self, batch_size: int, generator: Optional[torch.Generator] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        # Uniformly random minibatch (with replacement) of the examples currently in the buffer
+        rows = torch.randint(self._length, (batch_size,), generator=generator)
+        return self.parameters[rows], self.simulations[rows]
+
+
+def simulate_training_batch(
+    simulator: BaseSimulator,
+    batch_seed: Union[int, List[int]],
+    num_simulations: int,
+    compiled: bool = False,
+    vectorized: bool = False,
+) -> Tuple[dict, np.ndarray, float]:
+    # Task run by the simulation producers of online SNPE training: draws a fresh set of simulation parameters from the
+    # simulator's prior and simulates them, all within the producer process (the simulator's own joblib pool is not
+    # used). Every batch gets its own seed, so the batches of a run are independent of each other
+    # Returns the simulation parameters, the simulations and the time it took to simulate them
+    start = time.time()
+    simulator.seed = batch_seed
+    simulator.simulation_seed = batch_seed
+    simulator.prepare_simulations(num_simulations)
+    if vectorized:
+        simulations = simulator.simulate_review_histograms_batch(np.arange(num_simulations))
+    else:
+        simulate_product = (
+            simulator.simulate_review_histogram_compiled if compiled else simulator.simulate_review_histogram
+        )
+        simulations = [simulate_product(i) for i in range(num_simulations)]
+    return simulator.simulation_parameters, np.array(simulations), time.time() - start
@@ -0,0 +1,155 @@
+import numpy as np
+
+# numba is an optional dependency. If it is not installed, njit falls back to a no-op decorator so that the kernels
+# below still run (slowly) as plain Python/numpy code, with identical results in distribution
+# The kernels draw all their random variates from the np.random.Generator passed to them (which numba supports as an
+# argument), never from the global NumPy random state, so running them has no side effects in either case
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        # Support both the @njit and @njit(...) forms of the decorator
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+# Integer codes of the previous rating measures used for herding, as strings can't be passed around cheaply in
+# compiled code
+PREVIOUS_RATING_MEASURE_CODES = {"mean": 0, "mode": 1, "mode of latest": 2}
+
+
+@njit(cache=True)
+def dist_sample_index(rng: np.random.Generator, num_dist_samples: int) -> int:
+    # Index of a random distribution sample of a parameter. Point parameters have a single distribution sample, which
+    # is picked without drawing a random number, as in yield_simulation_param_per_visitor
+    if num_dist_samples == 1:
+        return 0
+    return rng.integers(0, num_dist_samples)
+
+
+@njit(cache=True)
+def rating_scale_review_kernel(
+    starting_timeseries: np.ndarray,
+    review_prior: np.ndarray,
+    tendency_to_rate: float,
+    rho: np.ndarray,
+    h_p: np.ndarray,
+    p_1: np.ndarray,
+    p_2: np.ndarray,
+    p_4: np.ndarray,
+    p_5: np.ndarray,
+    bias_5_star: np.ndarray,
+    one_star_lowest_limit: float,
+    five_star_highest_limit: float,
+    max_bias_5_star: float,
+    min_reviews_for_herding: int,
+    previous_rating_measure: int,
+    num_latest_reviews_for_herding: int,
+    use_h_u: bool,
+    num_simulated_reviews: int,
+    total_visitors: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    # Fuses the whole visitor journey of the RatingScaleSimulator into a single loop over the visitors of one product:
+    # Dirichlet draw of expected experiences -> actual experience -> mismatch -> rating scale thresholds ->
+    # decision to rate (double rho) -> herding -> 5 star bias. Every step mirrors the corresponding method of
+    # SingleRhoSimulator, DoubleRhoSimulator, HerdingSimulator and RatingScaleSimulator
+    # The simulation parameter arrays hold the distribution samples of this product only, i.e, rho is
+    # (num_dist_samples, 2) and all the others are (num_dist_samples,), where num_dist_samples is 1 for point parameters
+    # and can differ between parameters. As in yield_simulation_param_per_visitor, an independent distribution sample
+    # is picked for each parameter per visitor
+    num_starting = starting_timeseries.shape[0]
+    # Every visitor adds at most 1 review and the loop stops as soon as the desired number of reviews is reached,
+    # which bounds the length of the timeseries
+    max_new_reviews = max(num_simulated_reviews - int(np.sum(starting_timeseries[num_starting - 1])), 0) + 1
+    timeseries = np.empty((num_starting + max_new_reviews, 5), dtype=np.int32)
+    timeseries[:num_starting] = starting_timeseries
+    length = num_starting
+    initial_num_ratings = np.sum(timeseries[0])
+    expected_experience_dist = np.empty(5)
+
+    for visitor in range(total_visitors):
+        current_histogram = timeseries[length - 1]
+        # Dirichlet draw from the posterior of reviews through normalized gamma variates
+        dist_sum = 0.0
+        for i in range(5):
+            expected_experience_dist[i] = rng.gamma(review_prior[i] + current_histogram[i])
+            dist_sum += expected_experience_dist[i]
+        expected_experience = 0.0
+        for i in range(5):
+            expected_experience_dist[i] /= dist_sum
+            expected_experience += expected_experience_dist[i] * (i + 1)
+        # Actual experience is a categorical draw from the expected distribution of experiences
+        u = rng.random()
+        experience_index = 4
+        cumulative = 0.0
+        for i in range(5):
+            cumulative += expected_experience_dist[i]
+            if u < cumulative:
+                experience_index = i
+                break
+        delta = (experience_index + 1.0) - expected_experience
+
+        # Rating scale thresholds
+        limit_1 = one_star_lowest_limit * p_1[dist_sample_index(rng, p_1.shape[0])]
+        limit_2 = limit_1 * p_2[dist_sample_index(rng, p_2.shape[0])]
+        limit_5 = five_star_highest_limit * p_5[dist_sample_index(rng, p_5.shape[0])]
+        limit_4 = limit_5 * p_4[dist_sample_index(rng, p_4.shape[0])]
+        if delta <= limit_1:
+            rating_index = 0
+        elif delta <= limit_2:
+            rating_index = 1
+        elif delta <= limit_4:
+            rating_index = 2
+        elif delta <= limit_5:
+            rating_index = 3
+        else:
+            rating_index = 4
+
+        # Decision to rate with separate rhos for negative and positive mismatch. -1 denotes no rating
+        rho_index = dist_sample_index(rng, rho.shape[0])
+        if rng.random() <= tendency_to_rate:
+            decision_to_rate = True
+        elif delta < 0:
+            decision_to_rate = np.abs(delta) >= rho[rho_index, 0]
+        else:
+            decision_to_rate = np.abs(delta) >= rho[rho_index, 1]
+        if not decision_to_rate:
+            rating_index = -1
+
+        # Herding, once the minimum number of reviews has been accumulated
+        if rating_index >= 0 and np.sum(current_histogram) - initial_num_ratings >= min_reviews_for_herding:
+            herding_prob = h_p[dist_sample_index(rng, h_p.shape[0])]
+            if use_h_u:
+                herding_prob *= rng.random()
+            if rng.random() <= herding_prob:
+                if previous_rating_measure == 0:
+                    weighted_sum = 0.0
+                    for i in range(5):
+                        weighted_sum += i * current_histogram[i]
+                    previous_rating_index = weighted_sum / np.sum(current_histogram)
+                elif previous_rating_measure == 1:
+                    previous_rating_index = float(np.argmax(current_histogram))
+                else:
+                    previous_rating_index = float(
+                        np.argmax(current_histogram - timeseries[length - 1 - num_latest_reviews_for_herding])
+                    )
+                rating_index = int((rating_index + previous_rating_index) / 2)
+
+        # 5 star bias applies irrespective of the decision to rate
+        if rng.random() <= max_bias_5_star * bias_5_star[dist_sample_index(rng, bias_5_star.shape[0])]:
+            rating_index = 4
+
+        if rating_index >= 0:
+            timeseries[length] = timeseries[length - 1]
+            timeseries[length, rating_index] += 1
+            length += 1
+        if np.sum(timeseries[length - 1]) >= num_simulated_reviews:
+            break
+
+    return timeseries[:length].copy()
@@ -0,0 +1,108 @@
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from scipy.spatial.distance import cdist
+
+# hnswlib is an optional dependency, only needed for approximate consideration sets in very large catalogues
+try:
+    import hnswlib
+
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+
+CONSIDERATION_SET_MODES = ("exact", "matmul", "ann")
+
+
+class ConsiderationSetEngine:
+    # Hands out the consideration set of every visitor of a marketplace, i.e, the consideration_set_size products
+    # whose embeddings have the highest cosine similarity with the visitor's embedding, along with those similarities
+    # Visitor embeddings don't depend on the state of the marketplace, so apart from the "exact" mode they are drawn
+    # in blocks of visitors and the consideration sets of a whole block are computed together. All modes take their
+    # visitor embeddings from sample_visitor_embeddings, so they only differ in how consideration sets are computed:
+    #   exact: reference mode, one visitor at a time, cdist against all products followed by argpartition, i.e, the
+    #       computation of consideration sets of the original per-visitor simulation (but not its draw of visitors)
+    #   matmul: product embeddings are normalized once, and the cosine similarities of a whole block of visitors are
+    #       a single matrix multiply followed by a row-wise argpartition. Same consideration sets as the exact mode
+    #       for the same visitor embeddings (up to ties in cosine similarity)
+    #   ann: approximate top-k search in an HNSW index of the product embeddings (needs hnswlib), for catalogues with
+    #       100k+ products where even the block matrix multiply gets expensive
+    # sample_visitor_embeddings(n) needs to return n visitor embeddings as an array of shape (n, embedding_dim)
+    def __init__(
+        self,
+        product_embeddings: np.ndarray,
+        consideration_set_size: int,
+        sample_visitor_embeddings: Callable[[int], np.ndarray],
+        mode: str = "matmul",
+        block_size: Optional[int] = None,
+        max_block_elements: int = 2**24,
+        ann_ef: int = 100,
+        ann_m: int = 16,
+    ):
+        assert (
+            mode in CONSIDERATION_SET_MODES
+        ), f"Consideration set mode needs to be one of {CONSIDERATION_SET_MODES}, found {mode} instead"
+        assert consideration_set_size <= len(
+            product_embeddings
+        ), f"Consideration sets of size {consideration_set_size} need at least as many products"
+        self.product_embeddings = product_embeddings
+        self.consideration_set_size = consideration_set_size
+        self.sample_visitor_embeddings = sample_visitor_embeddings
+        self.mode = mode
+        if mode == "exact":
+            self.block_size = 1
+        elif block_size is None:
+            # Blocks are sized so that the (block_size X num_products) matrix of similarities stays bounded in memory
+            self.block_size = int(np.clip(max_block_elements // len(product_embeddings), 1, 4096))
+        else:
+            self.block_size = block_size
+        if mode in ("matmul", "ann"):
+            self.normalized_product_embeddings = normalize_embeddings(product_embeddings)
+        if mode == "ann":
+            assert (
+                HNSWLIB_AVAILABLE
+            ), "The ann consideration set mode needs hnswlib, install it with pip install hnswlib"
+            self.index = hnswlib.Index(space="ip", dim=product_embeddings.shape[1])
+            self.index.init_index(max_elements=len(product_embeddings), ef_construction=max(ann_ef, 100), M=ann_m)
+            self.index.add_items(self.normalized_product_embeddings, np.arange(len(product_embeddings)))
+            self.index.set_ef(max(ann_ef, consideration_set_size))
+            self.index.set_num_threads(1)
+        self._consideration_sets = np.empty((0, consideration_set_size), dtype=np.int64)
+        self._cos_sims = np.empty((0, consideration_set_size))
+        self._position = 0
+
+    def get_consideration_sets(self, visitor_embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Consideration sets of a block of visitors, and the cosine similarities of the products in them, both of
+        # shape (num_visitors, consideration_set_size)
+        k = self.consideration_set_size
+        if self.mode == "exact":
+            # cdist calculates the "cosine distance", i.e, 1 - cos_sim. So cos_sim = 1 - cdist
+            cos_sim = 1.0 - cdist(visitor_embeddings, self.product_embeddings, metric="cosine")
+        elif self.mode == "matmul":
+            cos_sim = normalize_embeddings(visitor_embeddings) @ self.normalized_product_embeddings.T
+        else:
+            # Inner products of normalized embeddings are cosine similarities, hnswlib returns 1 - inner product
+            consideration_sets, distances = self.index.knn_query(normalize_embeddings(visitor_embeddings), k=k)
+            return consideration_sets.astype(np.int64), 1.0 - distances.astype(np.float64)
+        # Faster way to pick the indexes of the top k elements in an array
+        # https://stackoverflow.com/questions/6910641/how-do-i-get-indices-of-n-maximum-values-in-a-numpy-array
+        consideration_sets = np.argpartition(cos_sim, -k, axis=1)[:, -k:]
+        return consideration_sets, np.take_along_axis(cos_sim, consideration_sets, axis=1)
+
+    def next_consideration_set(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Consideration set of the next visitor. A new block of visitors is drawn once the current one runs out
+        if self._position == len(self._consideration_sets):
+            self._consideration_sets, self._cos_sims = self.get_consideration_sets(
+                self.sample_visitor_embeddings(self.block_size)
+            )
+            self._position = 0
+        self._position += 1
+        return self._consideration_sets[self._position - 1], self._cos_sims[self._position - 1]
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    # Scale embeddings to unit L2 norm, so that their inner products are cosine similarities
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms > 0, norms, 1.0)
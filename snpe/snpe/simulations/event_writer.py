@@ -0,0 +1,148 @@
+import json
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+# pyarrow is an optional dependency, only needed to write visitor events as parquet files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+EVENT_FILE_FORMATS = ("npy", "parquet")
+
+# Columns recorded for every visitor of a marketplace. rating_index is -1 for visitors who didn't leave a rating, and
+# herded is True for visitors whose rating went through the herding procedure
+EVENT_COLUMN_DTYPES = {
+    "visitor_id": np.int64,
+    "consideration_set": np.int64,
+    "chosen_product": np.int64,
+    "rating_index": np.int8,
+    "herded": np.bool_,
+}
+
+
+class MarketplaceEventWriter:
+    # Streams the events of every visitor of a marketplace to disk while it is being simulated, so that diagnostics
+    # like the order of reviews, the consideration sets of visitors or the rate of herding can be calculated later
+    # without re-running simulations or keeping whole timeseries in memory
+    # Events are buffered in preallocated columns of chunk_size rows, and every full chunk is written out as columnar
+    # files, so memory use is bounded by the chunk size irrespective of the number of visitors:
+    #   npy: a directory chunk_<i> per chunk, with one .npy file per column that can be memory-mapped while reading
+    #   parquet: a file chunk_<i>.parquet per chunk (needs pyarrow)
+    # metadata.json is written on close, with the number of events and chunks
+    def __init__(
+        self,
+        dirname: Path,
+        consideration_set_size: int,
+        chunk_size: int = 100_000,
+        file_format: str = "npy",
+        metadata: Optional[Dict] = None,
+    ):
+        assert (
+            file_format in EVENT_FILE_FORMATS
+        ), f"File format of visitor events needs to be one of {EVENT_FILE_FORMATS}, found {file_format} instead"
+        if file_format == "parquet":
+            assert PYARROW_AVAILABLE, "Writing visitor events as parquet files needs pyarrow, install it with pip"
+        self.dirname = dirname
+        self.dirname.mkdir(parents=True, exist_ok=True)
+        self.consideration_set_size = consideration_set_size
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.metadata = {} if metadata is None else metadata
+        self._columns = {
+            key: np.empty(
+                (chunk_size, consideration_set_size) if key == "consideration_set" else chunk_size, dtype=dtype
+            )
+            for (key, dtype) in EVENT_COLUMN_DTYPES.items()
+        }
+        self._length = 0
+        self.num_events = 0
+        self.num_chunks = 0
+
+    def write(
+        self,
+        visitor_id: int,
+        consideration_set: np.ndarray,
+        chosen_product: int,
+        rating_index: Optional[int],
+        herded: bool,
+    ) -> None:
+        self._columns["visitor_id"][self._length] = visitor_id
+        self._columns["consideration_set"][self._length] = consideration_set
+        self._columns["chosen_product"][self._length] = chosen_product
+        self._columns["rating_index"][self._length] = -1 if rating_index is None else rating_index
+        self._columns["herded"][self._length] = herded
+        self._length += 1
+        self.num_events += 1
+        if self._length == self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._length == 0:
+            return
+        columns = {key: val[: self._length] for (key, val) in self._columns.items()}
+        if self.file_format == "npy":
+            chunk_dirname = self.dirname / f"chunk_{self.num_chunks:05d}"
+            chunk_dirname.mkdir(exist_ok=True)
+            for (key, val) in columns.items():
+                np.save(chunk_dirname / f"{key}.npy", val)
+        else:
+            arrays = {
+                key: pa.FixedSizeListArray.from_arrays(val.reshape(-1), self.consideration_set_size)
+                if key == "consideration_set"
+                else pa.array(val)
+                for (key, val) in columns.items()
+            }
+            pq.write_table(pa.table(arrays), self.dirname / f"chunk_{self.num_chunks:05d}.parquet")
+        self.num_chunks += 1
+        self._length = 0
+
+    def close(self) -> None:
+        self.flush()
+        with open(self.dirname / "metadata.json", "w") as f:
+            json.dump(
+                dict(
+                    self.metadata,
+                    file_format=self.file_format,
+                    consideration_set_size=self.consideration_set_size,
+                    num_events=self.num_events,
+                    num_chunks=self.num_chunks,
+                ),
+                f,
+                indent=4,
+            )
+
+
+def iter_marketplace_events(dirname: Path, columns: Optional[List[str]] = None) -> Iterator[Dict[str, np.ndarray]]:
+    # Yields the visitor events written by MarketplaceEventWriter one chunk at a time, as a dict of columns. Only the
+    # requested columns are read, and npy columns are memory-mapped
+    with open(dirname / "metadata.json", "r") as f:
+        metadata = json.load(f)
+    columns = list(EVENT_COLUMN_DTYPES) if columns is None else columns
+    for chunk in range(metadata["num_chunks"]):
+        if metadata["file_format"] == "npy":
+            yield {key: np.load(dirname / f"chunk_{chunk:05d}" / f"{key}.npy", mmap_mode="r") for key in columns}
+        else:
+            assert PYARROW_AVAILABLE, "Reading visitor events from parquet files needs pyarrow, install it with pip"
+            table = pq.read_table(dirname / f"chunk_{chunk:05d}.parquet", columns=columns)
+            yield {
+                key: np.stack(table[key].to_numpy(zero_copy_only=False))
+                if key == "consideration_set"
+                else table[key].to_numpy()
+                for key in columns
+            }
+
+
+def read_marketplace_events(dirname: Path, columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    # Reads the requested columns of all the visitor events of a marketplace into memory
+    chunks = list(iter_marketplace_events(dirname, columns))
+    if len(chunks) == 0:
+        return {}
+    return {key: np.concatenate([chunk[key] for chunk in chunks], axis=0) for key in chunks[0]}
@@ -0,0 +1,42 @@
+import bisect
+
+import numpy as np
+
+
+class ActualExperienceSampler:
+    # Draws the actual experiences [1, 5] of marketplace visitors with products, given the distribution of ratings
+    # predicted for every product from its embedding (pred_product_ratings, of shape (num_products, 5))
+    # The actual experience of a visitor used to be a Dirichlet draw with the predicted ratings as concentration
+    # parameters, followed by a single categorical draw from that Dirichlet sample. Marginalizing out the Dirichlet
+    # sample, this is exactly a categorical draw with probabilities pred_product_ratings / sum(pred_product_ratings)
+    # So the cumulative probabilities of every product are calculated once, and every draw only needs a uniform variate
+    # and a binary search. Uniform variates are drawn in blocks of block_size and handed out as needed
+    def __init__(self, pred_product_ratings: np.ndarray, rng: np.random.Generator, block_size: int = 4096):
+        assert (
+            pred_product_ratings.ndim == 2 and pred_product_ratings.shape[1] == 5
+        ), f"""
+        Expected predicted distributions of ratings of shape (num_products, 5), got {pred_product_ratings.shape} instead
+        """
+        assert np.all(
+            pred_product_ratings > 0
+        ), f"""
+        Found predicted distribution of ratings to have values <=0, check the embeddings -> ratings predictor
+        """
+        pred_product_ratings = np.asarray(pred_product_ratings, dtype=np.float64)
+        self.cumulative_probs = np.cumsum(pred_product_ratings / np.sum(pred_product_ratings, axis=1, keepdims=True), 1)
+        # Single draws bisect python lists, which avoids the overhead of numpy calls on arrays of just 5 elements
+        self._cumulative_probs_lists = self.cumulative_probs.tolist()
+        self.rng = rng
+        self.block_size = block_size
+        self._uniforms = np.empty(0)
+        self._position = 0
+
+    def draw(self, product: int) -> float:
+        # Actual experience of a single visitor with the product
+        if self._position == len(self._uniforms):
+            self._uniforms = self.rng.random(self.block_size)
+            self._position = 0
+        u = self._uniforms[self._position]
+        self._position += 1
+        # Guard against u landing above the last cumulative probability due to floating point errors in the cumsum
+        return min(bisect.bisect_right(self._cumulative_probs_lists[product], u), 4) + 1.0
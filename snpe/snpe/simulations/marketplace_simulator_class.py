@@ -1,34 +1,130 @@
 import multiprocessing as mp
+import os
+import time
 
-from collections import deque
-from multiprocessing import Manager, Queue
 from pathlib import Path
-from threading import Thread
-from typing import Deque, List, Optional
+from threading import Event, Thread
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
-import torch
 
 from joblib import Parallel, delayed
-from scipy.spatial.distance import cdist
 from snpe.embeddings import ARTIFACT_PATH
-from snpe.embeddings.embeddings_density_est_GMM import EmbeddingDensityGMM
+from snpe.embeddings.embeddings_density_est_GMM import EmbeddingDensityGMM, GMMSampler
 from snpe.embeddings.embeddings_to_ratings import EmbeddingRatingPredictor
+from snpe.utils.embedding_nets import NumpyRatingPredictor
 from snpe.utils.functions import check_existing_reviews, check_simulation_parameters
 from snpe.utils.statistics import review_histogram_means
-from snpe.utils.tqdm_utils import multi_progressbar
+from snpe.utils.tqdm_utils import SharedProgressCounters, shared_progress_monitor
+from threadpoolctl import threadpool_limits
 
+from .consideration_sets import ConsiderationSetEngine
+from .event_writer import MarketplaceEventWriter
+from .experience_sampler import ActualExperienceSampler
+from .parameter_schema import register_simulator
+from .review_log import MarketplaceReviewLog
+from .review_timeseries import ReviewTimeseries, timeseries_to_object_array
+from .shared_artifacts import (
+    create_shared_artifacts_dir,
+    load_shared_arrays,
+    load_shared_gmm,
+    load_shared_metadata,
+    remove_shared_artifacts_dir,
+    save_shared_arrays,
+    save_shared_gmm,
+    save_shared_metadata,
+)
+from .simulation_store import SimulationStore, concatenate_timeseries_store_arrays
 from .simulator_class import RatingScaleSimulator
+from .visitor_parameters import VisitorParameterSamples
 
 
+@register_simulator(
+    "marketplace",
+    RatingScaleSimulator.parameter_schema,
+    dict(
+        RatingScaleSimulator.placeholder_params,
+        num_products=1400,
+        num_total_marketplace_reviews=140_000,
+        consideration_set_size=5,
+    ),
+)
 class MarketplaceSimulator(RatingScaleSimulator):
     def __init__(self, params: dict):
         self.num_products = params["num_products"]
         self.num_total_marketplace_reviews = params["num_total_marketplace_reviews"]
         self.consideration_set_size = params["consideration_set_size"]
+        # How consideration sets are calculated, see ConsiderationSetEngine. "exact" is the reference mode with one
+        # cdist per visitor, "matmul" gives the same consideration sets for the same visitors with block matrix
+        # multiplies and "ann" uses an approximate nearest neighbour index for very large catalogues. Visitor
+        # embeddings are drawn from the block sampler of the user GMM in all modes
+        self.consideration_set_mode = params.get("consideration_set_mode", "matmul")
+        # In debug mode, the running average ratings of products used in visitor choices are checked against the ones
+        # calculated from the full review histograms of the products after every new review
+        self.debug = params.get("debug", False)
+        # How the reviews of products are held during marketplace simulations:
+        #   timeseries: a review timeseries per product, as in the other simulators
+        #   event_log: a single log of review events with a dense matrix of current histograms, for catalogues of 100k+
+        #       products. Timeseries simulations are then kept in an in-memory simulation store, and the timeseries
+        #       of products are only built when the store is indexed
+        self.review_storage = params.get("review_storage", "timeseries")
+        assert self.review_storage in (
+            "timeseries",
+            "event_log",
+        ), f"Review storage needs to be one of timeseries or event_log, found {self.review_storage} instead"
+        # Set only while marketplaces are being simulated in worker processes, see share_artifacts
+        self.shared_artifacts_dirname = None
+        # Number of BLAS/OpenMP threads every worker process is pinned to while simulating marketplaces, so that
+        # workers don't oversubscribe the CPUs. Set in simulate based on the number of workers
+        self.threads_per_worker = 1
         super(MarketplaceSimulator, self).__init__(params)
 
+    def __getstate__(self) -> dict:
+        # While marketplaces are being simulated, the large read-only artifacts needed by workers are in shared memory
+        # They are left out when the simulator is pickled to be sent to a worker, which attaches them on unpickling
+        state = self.__dict__.copy()
+        if state.get("shared_artifacts_dirname") is not None:
+            for key in (
+                "simulation_parameters",
+                "embedding_density_estimator",
+                "embedding_rating_predictor",
+                "rating_predictor_forward",
+                "visitor_embedding_sampler",
+                "marketplace_product_embeddings",
+                "marketplace_pred_product_ratings",
+            ):
+                state.pop(key, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if state.get("shared_artifacts_dirname") is not None:
+            self.attach_shared_artifacts(state["shared_artifacts_dirname"])
+
+    def share_artifacts(self, dirname: Path) -> None:
+        # Writes the simulation parameters and the fitted embedding density estimators to the shared memory directory
+        # The product embeddings and predicted ratings of all marketplaces are already there, see
+        # predict_marketplace_product_ratings. Workers don't need the embedding -> rating predictor at all
+        save_shared_arrays(dirname / "simulation_parameters", self.simulation_parameters)
+        save_shared_gmm(dirname / "product_model", self.embedding_density_estimator.product_model)
+        save_shared_gmm(dirname / "user_model", self.embedding_density_estimator.user_model)
+        save_shared_metadata(dirname, {"artifact_path": str(self.embedding_density_estimator.artifact_path)})
+
+    def attach_shared_artifacts(self, dirname: Path) -> None:
+        # Rebuilds the artifacts written by share_artifacts, with all their arrays memory-mapped from shared memory
+        metadata = load_shared_metadata(dirname)
+        self.simulation_parameters = load_shared_arrays(dirname / "simulation_parameters")
+        self.embedding_density_estimator = EmbeddingDensityGMM.from_models(
+            load_shared_gmm(dirname / "product_model"),
+            load_shared_gmm(dirname / "user_model"),
+            Path(metadata["artifact_path"]),
+        )
+        self.visitor_embedding_sampler = GMMSampler(self.embedding_density_estimator.user_model)
+        marketplace_products = load_shared_arrays(dirname / "marketplace_products")
+        self.marketplace_product_embeddings = marketplace_products["product_embeddings"]
+        self.marketplace_pred_product_ratings = marketplace_products["pred_product_ratings"]
+
     def load_embedding_density_estimators(self, artifact_path: Path) -> None:
         self.embedding_density_estimator = EmbeddingDensityGMM(artifact_path=artifact_path)
         self.embedding_density_estimator.load()
@@ -43,11 +139,16 @@ class MarketplaceSimulator(RatingScaleSimulator):
             embedding generator produces embeddings of shape {visitor_embedding.shape}. They need to have the
             same shape to be able to calculate cosine similarities between them.
             """
+        # Visitor embeddings are drawn in huge numbers during marketplace simulations, so they come from a sampler that
+        # caches the Cholesky factors of the user GMM and draws embeddings in blocks
+        self.visitor_embedding_sampler = GMMSampler(self.embedding_density_estimator.user_model)
 
     def load_embedding_rating_predictor(self, artifact_path: Path) -> None:
         self.embedding_rating_predictor = EmbeddingRatingPredictor(artifact_path=artifact_path)
         self.embedding_rating_predictor.load()
         print(f"Loaded embedding -> rating predictor model: \n {self.embedding_rating_predictor.model}")
+        # Ratings of products are predicted with a NumPy export of the model, see predict_ratings_from_embeddings
+        self.rating_predictor_forward = NumpyRatingPredictor.from_model(self.embedding_rating_predictor.model)
 
     def simulate_review_histogram(
         self,
@@ -62,6 +163,27 @@ class MarketplaceSimulator(RatingScaleSimulator):
             """
         )
 
+    def simulate_review_histogram_compiled(
+        self,
+        simulation_id: int,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+    ) -> np.ndarray:
+        raise NotImplementedError(
+            f"""
+            For {self.__class__.__name__}, cannot simulate product review histograms separately.
+            Run simulate_marketplace instead
+            """
+        )
+
+    def simulate_sharded(self, dirname: Path, num_simulations: int, **kwargs) -> None:
+        raise NotImplementedError(
+            f"""
+            Sharded simulation runs are not available for {self.__class__.__name__}.
+            Run simulate instead
+            """
+        )
+
     def simulate(
         self,
         num_simulations: int,
@@ -70,6 +192,9 @@ class MarketplaceSimulator(RatingScaleSimulator):
         existing_reviews: Optional[List[np.ndarray]] = None,
         product_embeddings: Optional[np.ndarray] = None,
         embeddings_artifact_path: Path = ARTIFACT_PATH,
+        num_workers: Optional[int] = None,
+        events_dirname: Optional[Path] = None,
+        events_file_format: str = "npy",
         **kwargs,
     ) -> None:
         assert (
@@ -79,10 +204,29 @@ class MarketplaceSimulator(RatingScaleSimulator):
             """
         # num_simulations = number of marketplaces to be simulated
         # Total number of simulations = total number of marketplaces x num products per marketplace
-        if num_simulations != mp.cpu_count():
-            # If the number of marketplaces being simulated is not the same as the number of CPUs available,
-            # warn the user about that
-            input(f"{num_simulations} marketplaces to be simulated on {mp.cpu_count()} CPUs. Press Enter to continue..")
+        # If events_dirname is given, the events of every visitor of marketplace i are also written to
+        # events_dirname / marketplace_<i> while it is being simulated (see MarketplaceEventWriter)
+        # Marketplaces are simulated in a pool of num_workers processes (all CPUs by default). Each marketplace is a
+        # separate task, handed to whichever worker becomes free first, so the number of marketplaces doesn't need
+        # to match the number of workers. Visitors within a marketplace depend on each other's reviews, so a single
+        # marketplace can't be split further across workers
+        if num_workers is None:
+            num_workers = mp.cpu_count()
+        num_workers = min(num_workers, num_simulations)
+        # Workers are pinned to an equal share of the CPUs for their BLAS/OpenMP thread pools
+        self.threads_per_worker = max(1, mp.cpu_count() // num_workers)
+        if num_simulations % num_workers != 0:
+            print(
+                f"""
+                {num_simulations} marketplaces to be simulated on {num_workers} workers. Some workers will be idle
+                while the last {num_simulations % num_workers} marketplaces are being simulated
+                """
+            )
+        # Draw new entropy for this run unless a root seed was given. Simulation parameters come from the start of the
+        # run's stream, while each marketplace gets a stream of its own, keyed by its marketplace_id
+        if self.seed is None:
+            self.simulation_seed = np.random.SeedSequence().entropy
+        self.rng = np.random.default_rng(np.random.SeedSequence(self.simulation_seed))
         if existing_reviews is not None:
             assert (
                 simulation_parameters is not None
@@ -111,7 +255,7 @@ class MarketplaceSimulator(RatingScaleSimulator):
             {dummy_parameters.keys()} as simulation parameters instead
             """
         else:
-            simulation_parameters = self.generate_simulation_parameters(num_simulations * self.num_products)
+            simulation_parameters = self.generate_simulation_parameters(num_simulations * self.num_products, self.rng)
         # Run shape checks on the input dict of simulation parameters
         # If succesful, this returns the number of distribution samples per parameter which we save in the model
         # object's params dict
@@ -121,9 +265,9 @@ class MarketplaceSimulator(RatingScaleSimulator):
         self.simulation_parameters = simulation_parameters
         self.load_embedding_density_estimators(artifact_path=embeddings_artifact_path)
         self.load_embedding_rating_predictor(artifact_path=embeddings_artifact_path)
-        # Change the random_state of the embedding density estimators to None
+        # Change the random_state of the embedding density estimators from the fixed one used during fitting
         # This is needed to get distinct embeddings during sampling, otherwise all marketplaces and users end up
-        # being the same
+        # being the same. Each marketplace then re-seeds them from its own stream in simulate_marketplace
         self.embedding_density_estimator.product_model.set_params(**{"random_state": None})
         self.embedding_density_estimator.user_model.set_params(**{"random_state": None})
         # If product embeddings have been provided, check their validity
@@ -138,31 +282,109 @@ class MarketplaceSimulator(RatingScaleSimulator):
             Product embeddings have {product_embeddings.shape[1]} elements while visitor embedding generator produces
             embeddings with {visitor_embedding.shape[1]} elements. Please check the input product embeddings
             """
-        # Now set up the multi-progressbar in a separate Manager and queue that can be accessed by
-        # all the processes
-        manager = Manager()
-        queue = manager.Queue()
-        progproc = Thread(
-            target=multi_progressbar, args=([self.num_total_marketplace_reviews for _ in range(mp.cpu_count())], queue)
-        )
-        progproc.start()
-        simulations = Parallel(n_jobs=mp.cpu_count())(
-            delayed(self.simulate_marketplace)(i, queue, existing_reviews, product_embeddings)
-            for i in range(num_simulations)
+        # Workers publish the number of reviews in their marketplaces to progress counters in shared memory, and a
+        # monitor thread renders them. Workers also attach the large read-only artifacts from the same shared memory
+        # directory, instead of receiving a pickled copy of them with every marketplace. This is not needed when
+        # marketplaces are simulated in this process itself, except for the product embeddings and predicted ratings
+        # of all marketplaces, which are always kept there
+        shared_dirname = create_shared_artifacts_dir()
+        progress = SharedProgressCounters(shared_dirname / "progress.bin", num_simulations, create=True)
+        stop_monitor = Event()
+        monitor = Thread(
+            target=shared_progress_monitor,
+            args=(progress, num_simulations * self.num_total_marketplace_reviews, stop_monitor),
+            kwargs={"desc": "Marketplace reviews"},
         )
-        self.simulations = np.array(simulations)
+        monitor.start()
+        # batch_size=1 and pre_dispatch="n_jobs" make joblib dispatch a new marketplace only when a worker frees up,
+        # instead of queueing batches of marketplaces on workers upfront
+        start = time.time()
+        try:
+            self.predict_marketplace_product_ratings(
+                shared_dirname / "marketplace_products", num_simulations, product_embeddings
+            )
+            if num_workers > 1:
+                self.share_artifacts(shared_dirname)
+                self.shared_artifacts_dirname = shared_dirname
+            results = Parallel(n_jobs=num_workers, batch_size=1, pre_dispatch="n_jobs")(
+                delayed(self.simulate_marketplace_timed)(
+                    i, progress, existing_reviews, events_dirname, events_file_format
+                )
+                for i in range(num_simulations)
+            )
+        finally:
+            stop_monitor.set()
+            monitor.join()
+            self.shared_artifacts_dirname = None
+            self.marketplace_product_embeddings = None
+            self.marketplace_pred_product_ratings = None
+            remove_shared_artifacts_dir(shared_dirname)
+        wall_time = time.time() - start
+        if self.review_storage == "event_log" and self.simulation_type == "timeseries":
+            # The review logs of all marketplaces go straight into the layout of a simulation store
+            self.simulations = SimulationStore.from_arrays(
+                concatenate_timeseries_store_arrays([review_log.to_store_arrays() for (review_log, *_) in results]),
+                dict(
+                    self.get_store_metadata(),
+                    simulations_shape=[num_simulations, self.num_products],
+                    num_simulations=num_simulations * self.num_products,
+                ),
+            )
+        else:
+            self.simulations = np.array([simulation for (simulation, *_) in results])
+        self.worker_utilisation = self.get_worker_utilisation(results, wall_time)
+        print(f"Simulated {num_simulations} marketplaces in {wall_time:.1f}s on {num_workers} workers")
+        for (worker, report) in self.worker_utilisation.items():
+            print(
+                f"\t Worker {worker}: {report['num_marketplaces']} marketplaces, busy for {report['busy_time']:.1f}s, "
+                + f"utilisation {100 * report['utilisation']:.1f} percent"
+            )
+
+    def simulate_marketplace_timed(
+        self,
+        marketplace_id: int,
+        progress: SharedProgressCounters,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+        events_dirname: Optional[Path] = None,
+        events_file_format: str = "npy",
+    ) -> Tuple[Union[np.ndarray, MarketplaceReviewLog], int, float]:
+        # Runs simulate_marketplace and also returns the id of the worker process that ran it and the time it took
+        # The BLAS/OpenMP thread pools of the worker are pinned to its share of the CPUs while the marketplace runs
+        start = time.time()
+        with threadpool_limits(limits=self.threads_per_worker):
+            simulation = self.simulate_marketplace(
+                marketplace_id, progress, existing_reviews, events_dirname, events_file_format
+            )
+        return simulation, os.getpid(), time.time() - start
+
+    @staticmethod
+    def get_worker_utilisation(
+        results: List[Tuple[Union[np.ndarray, MarketplaceReviewLog], int, float]], wall_time: float
+    ) -> Dict[int, Dict]:
+        # Number of marketplaces simulated by every worker process, the time it spent simulating them, and the
+        # fraction of the wall time of the whole run it was busy for
+        utilisation = {}
+        for (_, worker, busy_time) in results:
+            report = utilisation.setdefault(worker, {"num_marketplaces": 0, "busy_time": 0.0})
+            report["num_marketplaces"] += 1
+            report["busy_time"] += busy_time
+        for report in utilisation.values():
+            report["utilisation"] = report["busy_time"] / wall_time
+        return utilisation
 
     def multinomial_choice(
-        self, consideration_set: np.ndarray, cos_sim: np.ndarray, simulated_reviews: List[Deque]
+        self,
+        consideration_set: np.ndarray,
+        consideration_set_cos_sim: np.ndarray,
+        avg_ratings: np.ndarray,
     ) -> int:
         # Pick a cosine similarity vs avg. rating adjuster for the visitor
         # This adjuster will be used to calculate a "score" for the products in the consideration set
         # The scores will be transformed to probabilities of choice using the logistic/softmax formula
         # Then a single multinomial choice of product will be made using these choice probabilities
-        adj = np.random.random()
-        consideration_set_cos_sim = cos_sim[consideration_set]
-        consideration_set_reviews = np.array([simulated_reviews[prod][-1] for prod in consideration_set])
-        consideration_set_avg_ratings = review_histogram_means(consideration_set_reviews)
+        adj = self.rng.random()
+        # avg_ratings holds the running average rating of every product in the marketplace
+        consideration_set_avg_ratings = avg_ratings[consideration_set]
         # Adjusting both cosine similarities and avg ratings to be on the same scale - 0 to 1
         consideration_set_cos_sim = (consideration_set_cos_sim + 1.0) / 2.0
         consideration_set_avg_ratings /= 5.0
@@ -173,45 +395,121 @@ class MarketplaceSimulator(RatingScaleSimulator):
         exps = np.exp(scores - np.max(scores))
         choice_p = exps / np.sum(exps)
         # Finally pick a product according to these choice probabilities
-        choice_index = np.where(np.random.multinomial(1, choice_p))[0][0]
+        choice_index = np.where(self.rng.multinomial(1, choice_p))[0][0]
         return consideration_set[choice_index]
 
-    def simulate_visitor_choice(self, product_embeddings: np.ndarray, simulated_reviews: List[Deque]) -> int:
-        visitor_embedding, _ = self.embedding_density_estimator.user_model.sample()
-        # cdist calculates the "cosine distance", i.e, 1 - cos_sim. So cos_sim = 1 - cdist
-        cos_sim = 1.0 - cdist(product_embeddings, visitor_embedding.reshape(1, -1), metric="cosine")
-        cos_sim = cos_sim.flatten()  # can flatten as only 1 visitor was compared to all products
-        # Faster way to pick the indexes of the top k elements in an array
-        # https://stackoverflow.com/questions/6910641/how-do-i-get-indices-of-n-maximum-values-in-a-numpy-array
-        consideration_set = np.argpartition(cos_sim, -self.consideration_set_size)[-self.consideration_set_size :]
-        chosen_product = self.multinomial_choice(consideration_set, cos_sim, simulated_reviews)
-        return chosen_product
+    def sample_visitor_embeddings(self, num_visitors: int) -> np.ndarray:
+        return self.visitor_embedding_sampler.draw(num_visitors)
+
+    def simulate_visitor_choice(
+        self, consideration_set_engine: ConsiderationSetEngine, avg_ratings: np.ndarray
+    ) -> Tuple[int, np.ndarray]:
+        # Returns the product chosen by the visitor, along with the visitor's consideration set
+        consideration_set, consideration_set_cos_sim = consideration_set_engine.next_consideration_set()
+        chosen_product = self.multinomial_choice(consideration_set, consideration_set_cos_sim, avg_ratings)
+        return chosen_product, consideration_set
 
     def predict_ratings_from_embeddings(self, product_embeddings: np.ndarray) -> np.ndarray:
-        # Set the neural network in eval mode
-        self.embedding_rating_predictor.model.eval()
-        # Convert the embeddings to torch tensor to be used for predictions
-        product_embeddings = torch.from_numpy(product_embeddings).type(torch.FloatTensor)
-        with torch.no_grad():
-            pred_ratings = self.embedding_rating_predictor.model(product_embeddings).detach().numpy()
-        return pred_ratings
+        # Forward pass of the embedding -> rating predictor in NumPy, which gives the same predictions as the torch
+        # model in eval mode (up to float32 rounding)
+        return self.rating_predictor_forward(product_embeddings)
+
+    def get_marketplace_random_states(
+        self, marketplace_id: int
+    ) -> Tuple[np.random.Generator, np.random.RandomState, np.random.RandomState]:
+        # Random stream of a marketplace, along with the legacy RandomStates of the product and user embedding density
+        # estimators seeded from the start of that stream
+        rng = self.get_simulation_rng(marketplace_id)
+        product_random_state = np.random.RandomState(rng.integers(2**32))
+        user_random_state = np.random.RandomState(rng.integers(2**32))
+        return rng, product_random_state, user_random_state
+
+    def predict_marketplace_product_ratings(
+        self, dirname: Path, num_simulations: int, product_embeddings: Optional[np.ndarray] = None
+    ) -> None:
+        # Samples the product embeddings of every marketplace from that marketplace's own stream, and predicts the
+        # ratings of the products of all marketplaces in one batched call, instead of one call per marketplace inside
+        # workers. Both are written to dirname and memory-mapped from there, so they are never held twice in memory
+        # Provided product embeddings are shared by all marketplaces, so they are kept (and predicted) only once
+        dirname.mkdir(parents=True, exist_ok=True)
+        if product_embeddings is not None:
+            save_shared_arrays(dirname, {"product_embeddings": product_embeddings[None, :, :]})
+        else:
+            embedding_dim = self.embedding_density_estimator.product_model.means_.shape[1]
+            sampled_embeddings = np.lib.format.open_memmap(
+                dirname / "product_embeddings.npy",
+                mode="w+",
+                dtype=self.embedding_density_estimator.product_model.means_.dtype,
+                shape=(num_simulations, self.num_products, embedding_dim),
+            )
+            for marketplace_id in range(num_simulations):
+                _, product_random_state, _ = self.get_marketplace_random_states(marketplace_id)
+                self.embedding_density_estimator.product_model.set_params(**{"random_state": product_random_state})
+                sampled_embeddings[marketplace_id], _ = self.embedding_density_estimator.product_model.sample(
+                    n_samples=self.num_products
+                )
+            sampled_embeddings.flush()
+            del sampled_embeddings
+        self.marketplace_product_embeddings = load_shared_arrays(dirname)["product_embeddings"]
+        pred_product_ratings = self.predict_ratings_from_embeddings(
+            self.marketplace_product_embeddings.reshape(-1, self.marketplace_product_embeddings.shape[2])
+        )
+        save_shared_arrays(
+            dirname,
+            {"pred_product_ratings": pred_product_ratings.reshape(len(self.marketplace_product_embeddings), -1, 5)},
+        )
+        self.marketplace_pred_product_ratings = load_shared_arrays(dirname)["pred_product_ratings"]
+
+    def get_marketplace_products(self, marketplace_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Product embeddings and predicted ratings of a marketplace. There is a single set of products if product
+        # embeddings were provided to simulate, otherwise one per marketplace
+        index = marketplace_id if len(self.marketplace_product_embeddings) > 1 else 0
+        return self.marketplace_product_embeddings[index], self.marketplace_pred_product_ratings[index]
 
     def simulate_marketplace(
         self,
         marketplace_id: int,
-        queue: Queue,
+        progress: SharedProgressCounters,
         existing_reviews: Optional[List[np.ndarray]] = None,
-        product_embeddings: Optional[np.ndarray] = None,
-    ) -> np.ndarray:
+        events_dirname: Optional[Path] = None,
+        events_file_format: str = "npy",
+    ) -> Union[np.ndarray, MarketplaceReviewLog]:
         total_visitors = self.num_total_marketplace_reviews * 30
+        progress.start(marketplace_id)
+        # All random draws of this marketplace come from its own stream, including the samples from the embedding
+        # density estimators, which need a legacy RandomState seeded from that stream. Its product embeddings have
+        # already been sampled with the product RandomState, see predict_marketplace_product_ratings
+        self.rng, product_random_state, user_random_state = self.get_marketplace_random_states(marketplace_id)
+        self.embedding_density_estimator.product_model.set_params(**{"random_state": product_random_state})
+        self.embedding_density_estimator.user_model.set_params(**{"random_state": user_random_state})
+        self.visitor_embedding_sampler.reset(self.rng)
         # Each product gets 5 reviews, 1 for each star to start off. This is necessary to prevent the
         # "cold start" problem when avg. rating needs to be calculated for products that have not accumulated
         # ratings yet
-        simulated_reviews = [deque([np.ones(5)], maxlen=total_visitors) for product in range(self.num_products)]
-        if product_embeddings is None:
-            # Sample the product embeddings if they are already not provided
-            product_embeddings, _ = self.embedding_density_estimator.product_model.sample(n_samples=self.num_products)
-        pred_product_ratings = self.predict_ratings_from_embeddings(product_embeddings.copy())
+        if self.review_storage == "event_log":
+            # Visitor journeys read the reviews of products through views of the review log
+            review_log = MarketplaceReviewLog(
+                self.num_products,
+                num_latest_reviews=(
+                    self.num_latest_reviews_for_herding if self.previous_rating_measure == "mode of latest" else None
+                ),
+            )
+            simulated_reviews = [review_log.product(product) for product in range(self.num_products)]
+        else:
+            review_log = None
+            simulated_reviews = [ReviewTimeseries() for product in range(self.num_products)]
+        product_embeddings, pred_product_ratings = self.get_marketplace_products(marketplace_id)
+        # The predicted ratings of products are checked and turned into cumulative probabilities of actual experiences
+        # once per marketplace, instead of once per visitor
+        self.experience_sampler = ActualExperienceSampler(pred_product_ratings, self.rng)
+        # Visitor embeddings, and so the consideration sets of visitors, don't depend on the reviews accumulated in the
+        # marketplace. They are drawn and calculated in blocks of visitors (except in the exact mode)
+        consideration_set_engine = ConsiderationSetEngine(
+            product_embeddings,
+            self.consideration_set_size,
+            self.sample_visitor_embeddings,
+            mode=self.consideration_set_mode,
+        )
         # Maintain a counter of total ratings on the platform - this total ignores the 1st 5 reviews
         # added to all products by default
         current_total_marketplace_reviews = 0
@@ -220,76 +518,106 @@ class MarketplaceSimulator(RatingScaleSimulator):
             for product in range(self.num_products):
                 product_reviews = existing_reviews[product]
                 for review in product_reviews:
-                    # We use the same manner of appending existing review histograms to simulated_reviews as if
-                    # those histograms were actually produced during simulations. This ensures that the same dtype is
-                    # appended to the deque always and keeps the size of the deque as small as possible
-                    current_histogram = simulated_reviews[product][-1].copy()
-                    rating_index = np.where(review - current_histogram)[0][0]
-                    current_histogram[rating_index] += 1
-                    simulated_reviews[product].append(current_histogram)
-                    if len(simulated_reviews[product]) > 1:
-                        assert (
-                            np.sum(simulated_reviews[product][-1]) - np.sum(simulated_reviews[product][-2])
-                        ) == 1, f"""
-                        Please check the histograms provided in the array of existing reviews. These should be in the form
-                        of cumulative histograms and should only add 1 rating at a time. \n
-                        This is not true for product: {product}
-                        """
+                    # Each existing histogram is checked to add exactly 1 rating to the latest one before being appended
+                    # Existing reviews are logged at timestep -1, i.e, before the first visitor of the simulation
+                    if review_log is not None:
+                        review_log.append_histogram(-1, product, review)
+                    else:
+                        simulated_reviews[product].append_histogram(review)
                     current_total_marketplace_reviews += 1
                     total_visitors -= 1
-                    # Since we are following the total number of marketplace ratings (=existing reviews + new reviews),
-                    # we put progress on the multi-progressbar as if a new rating was accumulated
-                    queue.put(f"update{marketplace_id}")
+            # Since we are following the total number of marketplace ratings (=existing reviews + new reviews),
+            # existing reviews count towards progress as if they were new ratings
+            progress.update(marketplace_id, current_total_marketplace_reviews)
+
+        # Live (num_products, 5) matrix of review counts, along with the sum of ratings and the average rating of every
+        # product. These are updated in O(1) whenever a new review lands, so that visitor choices don't need to
+        # recalculate average ratings from the review histograms of the products in their consideration sets
+        # The review log already keeps such a matrix of review counts
+        if review_log is not None:
+            review_counts = review_log.counts
+        else:
+            review_counts = np.array([timeseries[-1] for timeseries in simulated_reviews], dtype=np.int64)
+        rating_sums = review_counts @ np.arange(1, 6)
+        avg_ratings = review_histogram_means(review_counts, debug=self.debug)
+
+        if events_dirname is not None:
+            event_writer = MarketplaceEventWriter(
+                events_dirname / f"marketplace_{marketplace_id:05d}",
+                self.consideration_set_size,
+                file_format=events_file_format,
+                metadata={"marketplace_id": marketplace_id, "num_products": self.num_products},
+            )
+        else:
+            event_writer = None
+
+        if self.visitor_parameter_block_size is not None:
+            # Parameters of visitors are pre-drawn per product, only for products that get visitors
+            self.visitor_parameter_samples = VisitorParameterSamples(
+                self.simulation_parameters,
+                marketplace_id * self.num_products,
+                self.num_products,
+                self.rng,
+                block_size=self.visitor_parameter_block_size,
+            )
 
         for visitor in range(total_visitors):
-            chosen_product = self.simulate_visitor_choice(product_embeddings, simulated_reviews)
+            chosen_product, consideration_set = self.simulate_visitor_choice(consideration_set_engine, avg_ratings)
             # The chosen_product and marketplace_id together determine the parameters (rho, h_p)
             # that will be used in the rating decision
             # In previous versions, we could pass simulation_id directly to pick the right parameters
             # Now we need to calculate the right simulation_id based on the product and marketplace
             # as in the marketplace simulation, parameters run from 0 to num_marketplaces X num_products
             simulation_id = (marketplace_id * self.num_products) + chosen_product
+            if self.visitor_parameter_samples is not None:
+                self.visitor_parameter_samples.next_visitor(simulation_id)
             rating_index = self.simulate_visitor_journey(
                 simulated_reviews=simulated_reviews[chosen_product],
                 simulation_id=simulation_id,
                 use_h_u=False,
-                product_final_ratings=pred_product_ratings[chosen_product, :],
+                product=chosen_product,
             )
+            if event_writer is not None:
+                event_writer.write(visitor, consideration_set, chosen_product, rating_index, self.visitor_herded)
             if rating_index is not None:
-                current_histogram = simulated_reviews[chosen_product][-1].copy()
-                current_histogram[rating_index] += 1
-                simulated_reviews[chosen_product].append(current_histogram)
+                if review_log is not None:
+                    # This also updates review_counts, which is the count matrix of the review log
+                    review_log.append(visitor, chosen_product, rating_index)
+                else:
+                    simulated_reviews[chosen_product].append_rating(rating_index)
+                    review_counts[chosen_product, rating_index] += 1
+                rating_sums[chosen_product] += rating_index + 1
+                avg_ratings[chosen_product] = rating_sums[chosen_product] / np.sum(review_counts[chosen_product])
+                if self.debug:
+                    assert np.array_equal(
+                        avg_ratings,
+                        review_histogram_means(
+                            np.array([timeseries[-1] for timeseries in simulated_reviews]), debug=True
+                        ),
+                    ), "Running average ratings of products diverged from their review histograms"
                 current_total_marketplace_reviews += 1
-                # Also put progress on the multi-progressbar if a new rating was accumulated
-                queue.put(f"update{marketplace_id}")
+                # Also publish progress if a new rating was accumulated (throttled, so this is mostly a no-op)
+                progress.update(marketplace_id, current_total_marketplace_reviews)
             if current_total_marketplace_reviews >= self.num_total_marketplace_reviews:
                 break
-
-        # simulated_reviews = np.array([np.array(timeseries) for timeseries in simulated_reviews])
+        progress.update(marketplace_id, current_total_marketplace_reviews, force=True)
+        self.visitor_parameter_samples = None
+        if event_writer is not None:
+            event_writer.close()
 
         # Return final histogram or timeseries of review histograms for all products based on simulation_type
+        # With the event log, final histograms come straight from its count matrix, and the whole log is returned
+        # instead of the timeseries, so that they never have to be built
+        if review_log is not None:
+            if self.simulation_type == "histogram":
+                return review_log.counts.astype(np.int32)
+            return review_log
         if self.simulation_type == "histogram":
-            return np.array([np.array(timeseries[-1]) for timeseries in simulated_reviews])
+            return np.array([timeseries[-1] for timeseries in simulated_reviews])
         else:
-            return np.array([np.array(timeseries) for timeseries in simulated_reviews], dtype=object)
+            return timeseries_to_object_array([timeseries.to_array() for timeseries in simulated_reviews])
 
     def get_actual_experience(self, expected_experience_dist: np.ndarray, **kwargs) -> int:
-        # During marketplace simulations, we need the product's predicted final ratings to get the user's actual
-        # experiences
-        pred_product_ratings = kwargs.pop("product_final_ratings")
-        assert pred_product_ratings.shape == (
-            5,
-        ), f"""
-        Expected a predicted distribution of ratings of shape (5,), got {pred_product_ratings.shape} instead
-        """
-        assert np.all(
-            pred_product_ratings > 0
-        ), f"""
-        Found predicted distribution of ratings to have values <=0, check the embeddings -> ratings predictor
-        """
-        # Make a Dirichlet draw from this predicted_distribution of ratings
-        actual_experience_dist = np.random.dirichlet(pred_product_ratings)
-        # Then do a multinomial draw to get the actual experience
-        actual_experience = np.where(np.random.multinomial(1, actual_experience_dist))[0][0] + 1.0
-
-        return actual_experience
+        # During marketplace simulations, the user's actual experience comes from the product's predicted final
+        # ratings, through the sampler set up for the marketplace in simulate_marketplace
+        return self.experience_sampler.draw(kwargs.pop("product"))
@@ -0,0 +1,144 @@
+from typing import Dict, List, Optional, Sequence, Type
+
+import numpy as np
+import sbi.utils
+import torch
+
+
+class ParameterField:
+    # A single entry of the dict of simulation parameters of a simulator. Parameter arrays have shape
+    # (num_dist_samples X num_simulations) for scalar parameters (dim=None), and
+    # (num_dist_samples X num_simulations X dim) for vector parameters, with num_dist_samples = 1 for point parameters.
+    # low and high are the bounds of the uniform prior that the simulator draws the parameter from
+    def __init__(
+        self,
+        key: str,
+        low: Sequence[float],
+        high: Sequence[float],
+        dim: Optional[int] = None,
+        names: Optional[Sequence[str]] = None,
+    ):
+        self.key = key
+        self.dim = dim
+        self.width = 1 if dim is None else dim
+        self.low = np.broadcast_to(np.asarray(low, dtype=np.float32), (self.width,))
+        self.high = np.broadcast_to(np.asarray(high, dtype=np.float32), (self.width,))
+        if names is None:
+            names = [key] if dim is None else [f"{key}_{i}" for i in range(dim)]
+        assert (
+            len(names) == self.width
+        ), f"Parameter {key} has {self.width} columns, but {len(names)} names were provided for them"
+        self.names = list(names)
+
+
+class ParameterSchema:
+    # Layout of the simulation parameters of a simulator class, which maps the dict of simulation parameter arrays
+    # that simulators use to the (num_simulations X num_parameters) matrix of parameters that inference trains on, and
+    # back. Columns of the matrix follow the order of the fields, so every parameter occupies a fixed slice of columns
+    #   pack: copies one distribution sample of every parameter straight into a preallocated float32 matrix
+    #   unpack: copies the columns of a matrix into the contiguous float64 parameter arrays that simulators expect
+    def __init__(self, fields: List[ParameterField]):
+        self.fields = fields
+        self.slices = {}  # type: Dict[str, slice]
+        start = 0
+        for field in fields:
+            self.slices[field.key] = slice(start, start + field.width)
+            start += field.width
+        self.num_parameters = start
+
+    def extend(self, fields: List[ParameterField]) -> "ParameterSchema":
+        # Schema of a simulator that adds parameters on top of those of its parent simulator
+        return ParameterSchema(self.fields + fields)
+
+    @property
+    def keys(self) -> List[str]:
+        return [field.key for field in self.fields]
+
+    @property
+    def names(self) -> List[str]:
+        return [name for field in self.fields for name in field.names]
+
+    @property
+    def low(self) -> np.ndarray:
+        return np.concatenate([field.low for field in self.fields])
+
+    @property
+    def high(self) -> np.ndarray:
+        return np.concatenate([field.high for field in self.fields])
+
+    def get_prior(self, device: str = "cpu") -> sbi.utils.BoxUniform:
+        # Uniform prior over the bounds of all parameters, in the order of the columns of the parameter matrix
+        return sbi.utils.BoxUniform(
+            low=torch.from_numpy(self.low).type(torch.FloatTensor),
+            high=torch.from_numpy(self.high).type(torch.FloatTensor),
+            device=device,
+        )
+
+    def pack(self, simulation_parameters: Dict[str, np.ndarray], dist_sample: int = 0) -> np.ndarray:
+        assert set(simulation_parameters) == set(
+            self.keys
+        ), f"Expected simulation parameters {self.keys}, found {list(simulation_parameters)} instead"
+        num_simulations = simulation_parameters[self.keys[0]].shape[1]
+        parameters = np.empty((num_simulations, self.num_parameters), dtype=np.float32)
+        for field in self.fields:
+            # Point parameters have a single distribution sample, which stands for all of them
+            val = simulation_parameters[field.key]
+            val = val[dist_sample if val.shape[0] > 1 else 0]
+            parameters[:, self.slices[field.key]] = val[:, None] if field.dim is None else val
+        return parameters
+
+    def unpack(self, parameters: np.ndarray) -> Dict[str, np.ndarray]:
+        # Parameter arrays for simulators, with a single distribution sample per simulation. Simulators are given float64
+        # arrays, as they were before the schema, so that scalar parameters read from them are Python floats
+        assert (
+            parameters.ndim == 2 and parameters.shape[1] == self.num_parameters
+        ), f"Expected parameters of shape (num_simulations X {self.num_parameters}), found {parameters.shape} instead"
+        return {
+            field.key: np.ascontiguousarray(
+                (
+                    parameters[None, :, self.slices[field.key].start]
+                    if field.dim is None
+                    else parameters[None, :, self.slices[field.key]]
+                ),
+                dtype=np.float64,
+            )
+            for field in self.fields
+        }
+
+
+# Simulator classes by the simulator_type that inference refers to them with. Simulators register themselves with
+# the register_simulator decorator, along with the schema of their parameters and placeholder values of the params
+# that they need to be initialized with (on top of review_prior, tendency_to_rate and simulation_type). Placeholder
+# params are only used to create a simulator before loading a saved one, which overrides them
+SIMULATOR_REGISTRY = {}  # type: Dict[str, Type]
+
+
+def register_simulator(
+    simulator_type: str, parameter_schema: ParameterSchema, placeholder_params: Optional[dict] = None
+):
+    def decorator(cls: Type) -> Type:
+        cls.simulator_type = simulator_type
+        cls.parameter_schema = parameter_schema
+        cls.placeholder_params = {} if placeholder_params is None else placeholder_params
+        SIMULATOR_REGISTRY[simulator_type] = cls
+        return cls
+
+    return decorator
+
+
+def get_registered_simulator(simulator_type: str) -> Type:
+    if simulator_type not in SIMULATOR_REGISTRY:
+        raise ValueError(
+            f"""
+            simulator_type has to be one of {", ".join(SIMULATOR_REGISTRY)}. Found {simulator_type} instead
+            """
+        )
+    return SIMULATOR_REGISTRY[simulator_type]
+
+
+def get_parameter_schema(simulator_type: str) -> ParameterSchema:
+    return get_registered_simulator(simulator_type).parameter_schema
+
+
+def get_parameter_prior(simulator_type: str, device: str = "cpu") -> sbi.utils.BoxUniform:
+    return get_parameter_schema(simulator_type).get_prior(device)
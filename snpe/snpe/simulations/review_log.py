@@ -0,0 +1,173 @@
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from .review_timeseries import ReviewTimeseries, timeseries_to_object_array
+
+
+class MarketplaceReviewLog:
+    # Review state of all the products of a marketplace, for catalogues that are too large to keep a review timeseries
+    # per product (each of which preallocates a buffer of histograms)
+    # Reviews are kept as an append-only log of (timestep, product, rating_index) events, stored in 3 flat arrays whose
+    # capacity is doubled whenever they fill up. The current histograms of all products are held in a dense
+    # (num_products, 5) count matrix, so reading the latest histogram of a product is O(1). The timeseries of review
+    # histograms of a product is only built from the log on request
+    # Herding with the mode of the latest reviews needs the histogram from a few reviews back, so when
+    # num_latest_reviews is given, the latest num_latest_reviews rating indices of every product are also kept in a
+    # (num_products, num_latest_reviews) ring buffer
+    def __init__(
+        self,
+        num_products: int,
+        initial_histograms: Optional[np.ndarray] = None,
+        num_latest_reviews: Optional[int] = None,
+        capacity: int = 1024,
+    ):
+        self.num_products = num_products
+        # Products start off with 5 reviews, one for each rating, unless some other initial histograms are provided
+        if initial_histograms is None:
+            initial_histograms = np.ones((num_products, 5), dtype=np.int64)
+        assert initial_histograms.shape == (
+            num_products,
+            5,
+        ), f"Expected initial histograms of shape {(num_products, 5)}, got {initial_histograms.shape} instead"
+        self.initial_histograms = np.array(initial_histograms, dtype=np.int64)
+        self.counts = self.initial_histograms.copy()
+        self._timesteps = np.empty(capacity, dtype=np.int64)
+        self._products = np.empty(capacity, dtype=np.int64)
+        self._rating_indices = np.empty(capacity, dtype=np.uint8)
+        self._length = 0
+        self.num_latest_reviews = num_latest_reviews
+        if num_latest_reviews is not None:
+            self._latest_rating_indices = np.zeros((num_products, num_latest_reviews), dtype=np.uint8)
+            self._num_product_reviews = np.zeros(num_products, dtype=np.int64)
+
+    def __len__(self) -> int:
+        # Number of review events in the log
+        return self._length
+
+    @property
+    def timesteps(self) -> np.ndarray:
+        return self._timesteps[: self._length]
+
+    @property
+    def products(self) -> np.ndarray:
+        return self._products[: self._length]
+
+    @property
+    def rating_indices(self) -> np.ndarray:
+        return self._rating_indices[: self._length]
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._timesteps)
+        for key in ("_timesteps", "_products", "_rating_indices"):
+            new_array = np.empty(capacity, dtype=getattr(self, key).dtype)
+            new_array[: self._length] = getattr(self, key)[: self._length]
+            setattr(self, key, new_array)
+
+    def append(self, timestep: int, product: int, rating_index: int) -> None:
+        if self._length == len(self._timesteps):
+            self._grow()
+        self._timesteps[self._length] = timestep
+        self._products[self._length] = product
+        self._rating_indices[self._length] = rating_index
+        self._length += 1
+        self.counts[product, rating_index] += 1
+        if self.num_latest_reviews is not None:
+            self._latest_rating_indices[
+                product, self._num_product_reviews[product] % self.num_latest_reviews
+            ] = rating_index
+            self._num_product_reviews[product] += 1
+
+    def append_histogram(self, timestep: int, product: int, histogram: np.ndarray) -> None:
+        # Adds a full cumulative histogram of a product to the log, as used while unravelling existing reviews. It
+        # needs to add exactly 1 rating to the latest histogram of the product
+        difference = histogram - self.counts[product]
+        assert np.sum(difference) == 1 and np.all(
+            difference >= 0
+        ), f"""
+        Please check the histograms provided in the array of existing reviews. These should be in the form
+        of cumulative histograms and should only add 1 rating at a time. Found {histogram} after
+        {self.counts[product]}
+        """
+        self.append(timestep, product, int(np.argmax(difference)))
+
+    def latest_histogram_difference(self, product: int, num_reviews: int) -> np.ndarray:
+        # Histogram of the latest num_reviews reviews of the product, from the ring buffer of latest rating indices
+        assert (
+            self.num_latest_reviews is not None and num_reviews <= self.num_latest_reviews
+        ), f"Only the latest {self.num_latest_reviews} reviews of products are kept, {num_reviews} requested"
+        num_product_reviews = self._num_product_reviews[product]
+        assert num_reviews <= num_product_reviews, f"Product has only {num_product_reviews} reviews in the log"
+        positions = (num_product_reviews - 1 - np.arange(num_reviews)) % self.num_latest_reviews
+        return np.bincount(self._latest_rating_indices[product, positions], minlength=5)
+
+    def product(self, product: int) -> "ProductReviews":
+        return ProductReviews(self, product)
+
+    def timeseries(self, product: int) -> np.ndarray:
+        # Builds the timeseries of review histograms of a single product from the log
+        rating_indices = self.rating_indices[self.products == product]
+        return ReviewTimeseries.from_rating_indices(
+            self.initial_histograms[product][None, :], rating_indices
+        ).to_array()
+
+    def to_store_arrays(self) -> Dict[str, np.ndarray]:
+        # Timeseries of all products in the layout of a simulation store (see simulation_store.py), i.e, their initial
+        # histograms, the rating indices of all products one after the other (in the order they were left) and the
+        # offsets of every product's rating indices. None of the timeseries need to be built for this
+        order = np.argsort(self.products, kind="stable")
+        num_product_reviews = np.bincount(self.products, minlength=self.num_products)
+        return {
+            "initial_histograms": self.initial_histograms.astype(np.int32),
+            "rating_indices": self.rating_indices[order],
+            "offsets": np.concatenate(([0], np.cumsum(num_product_reviews))).astype(np.int64),
+        }
+
+    def to_object_array(self) -> np.ndarray:
+        # Timeseries of review histograms of all products, in the same form as the other marketplace simulations
+        arrays = self.to_store_arrays()
+        return timeseries_to_object_array(
+            [
+                ReviewTimeseries.from_rating_indices(
+                    arrays["initial_histograms"][product][None, :],
+                    arrays["rating_indices"][arrays["offsets"][product] : arrays["offsets"][product + 1]],
+                ).to_array()
+                for product in range(self.num_products)
+            ]
+        )
+
+
+class ProductReviews:
+    # Read-only view of the reviews of a single product in a MarketplaceReviewLog, with the same interface as the
+    # ReviewTimeseries that visitor journeys read from: [-1] is the latest histogram, [0] the initial one, and [-k-1]
+    # the one from k reviews back. Histograms from further back than the ring buffer of latest reviews are rebuilt
+    # from the log, which is slow
+    def __init__(self, review_log: MarketplaceReviewLog, product: int):
+        self.review_log = review_log
+        self.product = product
+
+    @property
+    def num_reviews(self) -> int:
+        return int(
+            np.sum(self.review_log.counts[self.product]) - np.sum(self.review_log.initial_histograms[self.product])
+        )
+
+    def __len__(self) -> int:
+        return self.num_reviews + 1
+
+    def __getitem__(self, index: Union[int, np.integer]) -> np.ndarray:
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError(f"Index out of range for review timeseries of length {length}")
+        if index == length - 1:
+            return self.review_log.counts[self.product]
+        if index == 0:
+            return self.review_log.initial_histograms[self.product]
+        num_reviews_back = length - 1 - index
+        if self.review_log.num_latest_reviews is not None and num_reviews_back <= self.review_log.num_latest_reviews:
+            return self.review_log.counts[self.product] - self.review_log.latest_histogram_difference(
+                self.product, num_reviews_back
+            )
+        return self.review_log.timeseries(self.product)[index]
@@ -0,0 +1,94 @@
+from typing import List, Optional
+
+import numpy as np
+
+
+class ReviewTimeseries:
+    # Compact container for the cumulative timeseries of review histograms of a single product
+    # Histograms are stored as rows of a preallocated int32 buffer of shape (capacity, 5). The capacity is doubled
+    # whenever the buffer fills up, so appending a review is amortized O(1) and no new array is allocated per review
+    # Indexing (including negative indices like [-1] and [-k-1]) and len() behave as they did with the deque of
+    # histograms that the simulators used before
+    def __init__(self, initial_histogram: Optional[np.ndarray] = None, capacity: int = 64):
+        self._buffer = np.empty((max(int(capacity), 1), 5), dtype=np.int32)
+        # Products start off with 5 reviews, one for each rating, unless some other initial histogram is provided
+        if initial_histogram is None:
+            self._buffer[0, :] = 1
+        else:
+            assert initial_histogram.shape == (
+                5,
+            ), f"Expected initial histogram of shape (5,), got {initial_histogram.shape} instead"
+            self._buffer[0, :] = initial_histogram
+        self._length = 1
+
+    @classmethod
+    def from_rating_indices(cls, initial_timeseries: np.ndarray, rating_indices: np.ndarray) -> "ReviewTimeseries":
+        # Builds the timeseries in one shot from the starting histograms and the indices [0, 4] of all the ratings
+        # that were subsequently left, in the order they were left. Cumulative histograms are built through cumsum
+        timeseries = cls(initial_timeseries[0], capacity=len(initial_timeseries) + len(rating_indices))
+        num_initial = len(initial_timeseries)
+        timeseries._buffer[:num_initial, :] = initial_timeseries
+        new_reviews = np.zeros((len(rating_indices), 5), dtype=np.int32)
+        new_reviews[np.arange(len(rating_indices)), rating_indices] = 1
+        timeseries._buffer[num_initial : num_initial + len(rating_indices), :] = initial_timeseries[-1] + np.cumsum(
+            new_reviews, axis=0, dtype=np.int32
+        )
+        timeseries._length = num_initial + len(rating_indices)
+        return timeseries
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError(f"Index out of range for review timeseries of length {self._length}")
+        return self._buffer[index]
+
+    def __array__(self, dtype: Optional[np.dtype] = None, copy: Optional[bool] = None) -> np.ndarray:
+        return self.to_array() if dtype is None else self.to_array().astype(dtype)
+
+    def _grow(self) -> None:
+        new_buffer = np.empty((2 * self._buffer.shape[0], 5), dtype=np.int32)
+        new_buffer[: self._length, :] = self._buffer[: self._length, :]
+        self._buffer = new_buffer
+
+    def append_rating(self, rating_index: int) -> None:
+        # Adds a single new rating to the timeseries, i.e, a new histogram = latest histogram + 1 at rating_index
+        if self._length == self._buffer.shape[0]:
+            self._grow()
+        self._buffer[self._length, :] = self._buffer[self._length - 1, :]
+        self._buffer[self._length, rating_index] += 1
+        self._length += 1
+
+    def append_histogram(self, histogram: np.ndarray) -> None:
+        # Adds a full cumulative histogram to the timeseries, as used while unravelling existing reviews. It needs to
+        # add exactly 1 rating to the latest histogram in the timeseries
+        difference = histogram - self._buffer[self._length - 1, :]
+        assert np.sum(difference) == 1 and np.all(
+            difference >= 0
+        ), f"""
+        Please check the histograms provided in the array of existing reviews. These should be in the form
+        of cumulative histograms and should only add 1 rating at a time. Found {histogram} after
+        {self._buffer[self._length - 1, :]}
+        """
+        self.append_rating(int(np.argmax(difference)))
+
+    @property
+    def num_reviews(self) -> int:
+        # Number of reviews accumulated on top of the initial histogram
+        return int(np.sum(self._buffer[self._length - 1, :]) - np.sum(self._buffer[0, :]))
+
+    def to_array(self) -> np.ndarray:
+        return self._buffer[: self._length, :].copy()
+
+
+def timeseries_to_object_array(timeseries: List[np.ndarray]) -> np.ndarray:
+    # Packs ragged review timeseries into a 1-D array of dtype object, with one timeseries per entry. Filling a
+    # preallocated object array avoids numpy trying (and failing, or silently stacking) to build a 3-D array
+    # when all the timeseries happen to have the same length
+    object_array = np.empty(len(timeseries), dtype=object)
+    for i, product_timeseries in enumerate(timeseries):
+        object_array[i] = product_timeseries
+    return object_array
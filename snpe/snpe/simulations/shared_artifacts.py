@@ -0,0 +1,64 @@
+import json
+import shutil
+import tempfile
+
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from sklearn.mixture import GaussianMixture
+
+# POSIX shared memory is mounted as a tmpfs at /dev/shm on Linux. Files written there never touch the disk, and
+# memory-mapping them from several processes maps the same physical pages into all of them
+SHARED_MEMORY_PATH = Path("/dev/shm")
+
+# Fitted attributes of a GaussianMixture that are needed to sample from it
+GMM_FITTED_ATTRIBUTES = ("weights_", "means_", "covariances_", "precisions_cholesky_")
+
+
+# Large read-only artifacts (simulation parameters, fitted density estimators, predicted product ratings) that every
+# worker process of a simulation needs are written once to a directory of .npy files, preferably in shared memory.
+# Workers then memory-map these files instead of receiving a pickled copy of the artifacts with every task, so that
+# startup time and the memory used by workers don't grow with the number of workers
+def create_shared_artifacts_dir() -> Path:
+    # Falls back to the default temporary directory (memory-mapped files on disk) if there is no shared memory mount
+    shared_memory_path = SHARED_MEMORY_PATH if SHARED_MEMORY_PATH.is_dir() else None
+    return Path(tempfile.mkdtemp(prefix="snpe_shared_artifacts_", dir=shared_memory_path))
+
+
+def remove_shared_artifacts_dir(dirname: Path) -> None:
+    shutil.rmtree(dirname, ignore_errors=True)
+
+
+def save_shared_arrays(dirname: Path, arrays: Dict[str, np.ndarray]) -> None:
+    dirname.mkdir(parents=True, exist_ok=True)
+    for (key, val) in arrays.items():
+        np.save(dirname / f"{key}.npy", np.ascontiguousarray(val))
+
+
+def load_shared_arrays(dirname: Path, mmap_mode: Optional[str] = "r") -> Dict[str, np.ndarray]:
+    return {path.stem: np.load(path, mmap_mode=mmap_mode) for path in sorted(dirname.glob("*.npy"))}
+
+
+def save_shared_metadata(dirname: Path, metadata: Dict[str, Any]) -> None:
+    with open(dirname / "metadata.json", "w") as f:
+        json.dump(metadata, f, indent=4)
+
+
+def load_shared_metadata(dirname: Path) -> Dict[str, Any]:
+    with open(dirname / "metadata.json", "r") as f:
+        return json.load(f)
+
+
+def save_shared_gmm(dirname: Path, gmm: GaussianMixture) -> None:
+    save_shared_arrays(dirname, {key: getattr(gmm, key) for key in GMM_FITTED_ATTRIBUTES})
+    save_shared_metadata(dirname, {"n_components": gmm.n_components, "covariance_type": gmm.covariance_type})
+
+
+def load_shared_gmm(dirname: Path) -> GaussianMixture:
+    # Rebuilds a fitted GaussianMixture whose parameters are memory-mapped from the shared files
+    gmm = GaussianMixture(**load_shared_metadata(dirname))
+    for (key, val) in load_shared_arrays(dirname).items():
+        setattr(gmm, key, val)
+    return gmm
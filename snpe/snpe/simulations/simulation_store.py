@@ -0,0 +1,207 @@
+import json
+import os
+import shutil
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from .review_timeseries import ReviewTimeseries, timeseries_to_object_array
+
+
+# On-disk columnar store of simulations, used instead of pickling the whole simulator
+# A store is a directory of plain .npy files that can be memory-mapped, plus a json file of metadata:
+#   metadata.json: simulator settings (simulation_type, review_prior, params etc.) and the shape of the simulations
+#   histograms.npy: (num_simulations, 5) final review histograms, only for simulation_type=histogram
+#   initial_histograms.npy, rating_indices.npy, offsets.npy: ragged review timeseries, only for simulation_type=timeseries
+#   parameters/<name>.npy: one file per simulation parameter, with the same shape as in simulation_parameters
+# Every timeseries adds exactly one rating per step, so it is fully described by its first histogram and the index
+# [0, 4] of every subsequent rating. These rating indices are stored flat (uint8) for all simulations, and
+# offsets[i]:offsets[i + 1] is the range of ratings that belongs to simulation i. Timeseries are rebuilt with cumsum
+# only when they are read, which keeps the store ~20x smaller than the int32 histograms themselves
+def write_simulation_store(
+    dirname: Path,
+    simulations: Union[np.ndarray, "SimulationStore"],
+    simulation_parameters: Dict[str, np.ndarray],
+    metadata: Dict[str, Any],
+) -> None:
+    simulation_type = metadata["simulation_type"]
+    if isinstance(simulations, SimulationStore):
+        # Simulations that are already held in the layout of a store (for eg. an in-memory store) are written as is
+        simulations_shape = simulations.metadata["simulations_shape"]
+        arrays = simulations.get_arrays()
+    elif simulation_type == "histogram":
+        # Simulations of several marketplaces come in with shape (num_marketplaces, num_products, ...), they are
+        # stored flattened and the leading shape is saved so that they can be reshaped on loading
+        simulations_shape = list(simulations.shape[:-1])
+        arrays = {"histograms": np.asarray(simulations).reshape(-1, 5).astype(np.int32)}
+    else:
+        if simulations.dtype != object:
+            # Timeseries of equal lengths may have been stacked into a single numeric array
+            simulations = timeseries_to_object_array(list(simulations))
+        simulations_shape = list(simulations.shape)
+        arrays = get_timeseries_store_arrays(simulations.reshape(-1))
+    num_simulations = int(np.prod(simulations_shape))
+    metadata = dict(metadata, simulations_shape=simulations_shape, num_simulations=num_simulations)
+    write_store_arrays(dirname, arrays, simulation_parameters, metadata)
+
+
+def get_timeseries_store_arrays(simulations: np.ndarray) -> Dict[str, np.ndarray]:
+    # Initial histograms, flat rating indices and offsets of a 1-D object array of review timeseries
+    lengths = np.array([len(timeseries) for timeseries in simulations], dtype=np.int64)
+    assert np.all(lengths >= 1), "Found empty review timeseries, every timeseries needs at least 1 histogram"
+    flat_timeseries = np.concatenate(list(simulations), axis=0).astype(np.int32)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    # Differences between consecutive histograms, dropping the ones that straddle two timeseries
+    is_series_start = np.zeros(len(flat_timeseries), dtype=bool)
+    is_series_start[starts] = True
+    differences = np.diff(flat_timeseries, axis=0)[~is_series_start[1:]]
+    assert np.all(np.sum(differences, axis=1) == 1) and np.all(
+        differences >= 0
+    ), """
+    Review timeseries need to be cumulative histograms that add exactly 1 rating at a time to be stored
+    """
+    return {
+        "initial_histograms": flat_timeseries[starts],
+        "rating_indices": np.argmax(differences, axis=1).astype(np.uint8),
+        "offsets": np.concatenate(([0], np.cumsum(lengths - 1))).astype(np.int64),
+    }
+
+
+def concatenate_timeseries_store_arrays(arrays: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    # Joins the store arrays of several sets of timeseries (for eg. of several marketplaces) into those of a single
+    # set, with the timeseries in the same order. Offsets of every set are shifted by the ratings of the sets before it
+    rating_offsets = np.cumsum([0] + [len(array["rating_indices"]) for array in arrays])
+    return {
+        "initial_histograms": np.concatenate([array["initial_histograms"] for array in arrays], axis=0),
+        "rating_indices": np.concatenate([array["rating_indices"] for array in arrays]),
+        "offsets": np.concatenate(
+            [array["offsets"][:-1] + rating_offsets[i] for (i, array) in enumerate(arrays)] + [rating_offsets[-1:]]
+        ).astype(np.int64),
+    }
+
+
+def metadata_to_json(obj: Any) -> Any:
+    # Converts the values in the metadata of a store (mostly simulator params) that json can't serialize itself.
+    # NumPy scalars and arrays are stored as their values, anything else (like paths) as its string representation
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return str(obj)
+
+
+def write_store_arrays(
+    dirname: Path, arrays: Dict[str, np.ndarray], simulation_parameters: Dict[str, np.ndarray], metadata: Dict[str, Any]
+) -> None:
+    # Write everything to a temporary directory first and move it in place at the end, so that a crash while writing
+    # never leaves a partially written store behind
+    tmp_dirname = dirname.with_name(dirname.name + ".tmp")
+    if tmp_dirname.exists():
+        shutil.rmtree(tmp_dirname)
+    (tmp_dirname / "parameters").mkdir(parents=True)
+    for (key, val) in arrays.items():
+        np.save(tmp_dirname / f"{key}.npy", val)
+    for (key, val) in simulation_parameters.items():
+        np.save(tmp_dirname / "parameters" / f"{key}.npy", np.asarray(val))
+    with open(tmp_dirname / "metadata.json", "w") as f:
+        json.dump(metadata, f, indent=4, default=metadata_to_json)
+
+    if dirname.exists():
+        shutil.rmtree(dirname)
+    os.replace(tmp_dirname, dirname)
+
+
+class SimulationStore:
+    # Read-only, lazily loaded view of a simulation store written by write_simulation_store
+    # Opening a store only reads its metadata and memory-maps the arrays, so it takes milliseconds irrespective of
+    # the number of simulations. Indexing with an int returns the review timeseries (or histogram) of that simulation,
+    # indexing with a slice or an array of ints returns those simulations only, in the same form as
+    # simulator.simulations (object array of timeseries, or 2-D array of histograms)
+    def __init__(self, dirname: Optional[Path], mmap_mode: Optional[str] = "r"):
+        self.dirname = dirname
+        self.mmap_mode = mmap_mode
+        with open(dirname / "metadata.json", "r") as f:
+            self.metadata = json.load(f)
+        self.simulation_type = self.metadata["simulation_type"]
+        if self.simulation_type == "histogram":
+            self.histograms = np.load(dirname / "histograms.npy", mmap_mode=mmap_mode)
+        else:
+            self.initial_histograms = np.load(dirname / "initial_histograms.npy", mmap_mode=mmap_mode)
+            self.rating_indices = np.load(dirname / "rating_indices.npy", mmap_mode=mmap_mode)
+            self.offsets = np.load(dirname / "offsets.npy", mmap_mode=mmap_mode)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> "SimulationStore":
+        # In-memory store, for simulations that are produced directly in the layout of a store (for eg. from the
+        # review logs of marketplace simulations) and only turned into timeseries when they are indexed
+        # metadata needs to have the simulation_type, simulations_shape and num_simulations
+        store = cls.__new__(cls)
+        store.dirname = None
+        store.mmap_mode = None
+        store.metadata = metadata
+        store.simulation_type = metadata["simulation_type"]
+        for (key, val) in arrays.items():
+            setattr(store, key, val)
+        return store
+
+    def get_arrays(self) -> Dict[str, np.ndarray]:
+        if self.simulation_type == "histogram":
+            return {"histograms": np.asarray(self.histograms)}
+        return {
+            "initial_histograms": np.asarray(self.initial_histograms),
+            "rating_indices": np.asarray(self.rating_indices),
+            "offsets": np.asarray(self.offsets),
+        }
+
+    @property
+    def simulation_parameters(self) -> Dict[str, np.ndarray]:
+        assert self.dirname is not None, "Simulation parameters are not kept in in-memory simulation stores"
+        return {
+            path.stem: np.load(path, mmap_mode=self.mmap_mode)
+            for path in sorted((self.dirname / "parameters").glob("*.npy"))
+        }
+
+    @property
+    def lengths(self) -> np.ndarray:
+        # Number of histograms in every review timeseries
+        return np.diff(self.offsets) + 1
+
+    def __len__(self) -> int:
+        return self.metadata["num_simulations"]
+
+    def get_timeseries(self, simulation_id: int) -> np.ndarray:
+        return ReviewTimeseries.from_rating_indices(
+            np.asarray(self.initial_histograms[simulation_id])[None, :],
+            np.asarray(self.rating_indices[self.offsets[simulation_id] : self.offsets[simulation_id + 1]]),
+        ).to_array()
+
+    def __getitem__(self, index: Union[int, slice, np.ndarray]) -> np.ndarray:
+        if self.simulation_type == "histogram":
+            return np.asarray(self.histograms[index])
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if index < 0 or index >= len(self):
+                raise IndexError(f"Index {index} out of range for simulation store with {len(self)} simulations")
+            return self.get_timeseries(index)
+        simulation_ids = np.arange(len(self))[index]
+        return timeseries_to_object_array([self.get_timeseries(i) for i in simulation_ids])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype: Optional[np.dtype] = None, copy: Optional[bool] = None) -> np.ndarray:
+        return self.to_array(reshape=False)
+
+    def to_array(self, reshape: bool = True) -> np.ndarray:
+        # Loads all the simulations into memory, in the shape they had before being stored if reshape=True
+        simulations = self[:]
+        if reshape:
+            if self.simulation_type == "histogram":
+                simulations = simulations.reshape(tuple(self.metadata["simulations_shape"]) + (5,))
+            else:
+                simulations = simulations.reshape(tuple(self.metadata["simulations_shape"]))
+        return simulations
@@ -1,17 +1,28 @@
+import json
 import multiprocessing as mp
 import pickle
 
-from collections import deque
 from pathlib import Path
-from typing import Deque, List, Optional, Union
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 
 from joblib import Parallel, delayed
-from snpe.utils.functions import check_existing_reviews, check_simulation_parameters
+from snpe.utils.functions import (
+    atomic_json_dump,
+    atomic_pickle_dump,
+    check_existing_reviews,
+    check_simulation_parameters,
+)
 from snpe.utils.tqdm_utils import tqdm_joblib
 from tqdm import tqdm
 
+from .compiled_kernels import PREVIOUS_RATING_MEASURE_CODES, rating_scale_review_kernel
+from .parameter_schema import ParameterField, ParameterSchema, register_simulator
+from .review_timeseries import ReviewTimeseries, timeseries_to_object_array
+from .simulation_store import SimulationStore, write_simulation_store
+from .visitor_parameters import VisitorParameterSamples
+
 
 class BaseSimulator:
     def __init__(self, params: dict):
@@ -28,19 +39,39 @@ class BaseSimulator:
             "histogram",
             "timeseries",
         ], f"Can only simulate review histogram or timeseries, got simulation_type={self.simulation_type}"
+        # Optional root seed of the simulator. Every simulation (product, or marketplace in the marketplace simulator)
+        # gets its own random stream spawned from the root seed of the run, so that any single simulation can be
+        # regenerated on its own. Without a root seed, fresh entropy is drawn for every run and stored instead
+        self.seed = params.pop("seed", None)
+        self.simulation_seed = np.random.SeedSequence(self.seed).entropy
+        self.rng = np.random.default_rng(np.random.SeedSequence(self.simulation_seed))
         self.params = params
+        # Optional block size for pre-drawing the simulation parameters of visitors, see VisitorParameterSamples. Meant
+        # for simulations from distributional parameters (such as posterior predictive simulations), where otherwise
+        # every visitor draws its own distribution sample of every parameter. Leave as None to draw per visitor
+        self.visitor_parameter_block_size = params.get("visitor_parameter_block_size", None)
+        # Set only while the visitors of a product (or marketplace) are being simulated with pre-drawn parameters
+        self.visitor_parameter_samples = None
 
     @classmethod
-    def generate_simulation_parameters(cls, num_simulations: int) -> dict:
+    def generate_simulation_parameters(cls, num_simulations: int, rng: Optional[np.random.Generator] = None) -> dict:
         raise NotImplementedError
 
+    def get_simulation_rng(self, *spawn_key: int) -> np.random.Generator:
+        # Random stream of a single simulation. SeedSequence(root, spawn_key=(i,)) is exactly the i-th child that
+        # SeedSequence(root).spawn would produce, so streams are independent across simulation ids and can be rebuilt
+        # for one id without spawning all the others
+        return np.random.default_rng(np.random.SeedSequence(self.simulation_seed, spawn_key=spawn_key))
+
     def convolve_prior_with_existing_reviews(self, simulated_reviews: np.ndarray) -> np.ndarray:
         assert (
             self.review_prior.shape == simulated_reviews.shape
         ), "Prior and simulated distributions of reviews should have the same shape"
         return self.review_prior + simulated_reviews
 
-    def simulate_visitor_journey(self, simulated_reviews: Deque, simulation_id: int, **kwargs) -> Union[int, None]:
+    def simulate_visitor_journey(
+        self, simulated_reviews: ReviewTimeseries, simulation_id: int, **kwargs
+    ) -> Union[int, None]:
         raise NotImplementedError
 
     def simulate_review_histogram(
@@ -57,14 +88,53 @@ class BaseSimulator:
     def decision_to_leave_review(self, delta: float, simulation_id: int) -> bool:
         raise NotImplementedError
 
+    def simulate_review_histograms_batch(
+        self,
+        simulation_ids: np.ndarray,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+    ) -> List[np.ndarray]:
+        raise NotImplementedError
+
+    def simulate_review_histogram_compiled(
+        self,
+        simulation_id: int,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+    ) -> np.ndarray:
+        raise NotImplementedError(
+            f"""
+            The compiled simulation engine is not available for {self.__class__.__name__}.
+            Run simulate with compiled=False instead
+            """
+        )
+
     def simulate(
         self,
         num_simulations: int,
         num_reviews_per_simulation: Optional[np.ndarray] = None,
         simulation_parameters: Optional[dict] = None,
         existing_reviews: Optional[List[np.ndarray]] = None,
+        batch_size: Optional[int] = None,
+        compiled: bool = False,
         **kwargs,
     ) -> None:
+        num_simulations, existing_reviews = self.prepare_simulations(
+            num_simulations, num_reviews_per_simulation, simulation_parameters, existing_reviews
+        )
+        self.simulations = self.run_simulations(
+            np.arange(num_simulations), num_reviews_per_simulation, existing_reviews, batch_size, compiled
+        )
+
+    def prepare_simulations(
+        self,
+        num_simulations: int,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        simulation_parameters: Optional[dict] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+    ) -> Tuple[int, Optional[List[np.ndarray]]]:
+        # Runs all the checks on the inputs of a simulation run and sets up the seed and simulation parameters of the
+        # run. Returns the final number of simulations and the checked existing reviews
         if existing_reviews is not None:
             assert (
                 simulation_parameters is not None
@@ -85,6 +155,12 @@ class BaseSimulator:
             # provided num_simulations will then be ignored
             num_simulations = len(existing_reviews)
 
+        # Draw new entropy for this run unless a root seed was given, and reset the simulator's own generator
+        # (which is used for the simulation parameters) to the start of the run's stream
+        if self.seed is None:
+            self.simulation_seed = np.random.SeedSequence().entropy
+        self.rng = np.random.default_rng(np.random.SeedSequence(self.simulation_seed))
+
         if num_reviews_per_simulation is not None:
             assert (
                 len(num_reviews_per_simulation) == num_simulations
@@ -104,62 +180,273 @@ class BaseSimulator:
             {dummy_parameters.keys()} as simulation parameters instead
             """
         else:
-            simulation_parameters = self.generate_simulation_parameters(num_simulations)
+            simulation_parameters = self.generate_simulation_parameters(num_simulations, self.rng)
         # Run shape checks on the input dict of simulation parameters
         # Store the number of distribution samples per parameter if the checks succeed
         self.params["num_dist_samples"] = check_simulation_parameters(simulation_parameters, num_simulations)
         self.simulation_parameters = simulation_parameters
 
-        with tqdm_joblib(tqdm(desc="Simulations", total=num_simulations)) as progress_bar:
-            simulations = Parallel(n_jobs=mp.cpu_count())(
-                delayed(self.simulate_review_histogram)(i, num_reviews_per_simulation, existing_reviews)
-                for i in range(num_simulations)
+        return num_simulations, existing_reviews
+
+    def run_simulations(
+        self,
+        simulation_ids: np.ndarray,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+        batch_size: Optional[int] = None,
+        compiled: bool = False,
+    ) -> np.ndarray:
+        # Runs the simulations of the given simulation ids in parallel and returns them in the same order
+        assert not (
+            compiled and batch_size is not None
+        ), "The compiled and batched simulation engines can't be combined, set either compiled=True or batch_size"
+        if batch_size is None:
+            # The compiled engine runs every product's visitor journey in a single fused (numba) kernel
+            simulate_product = self.simulate_review_histogram_compiled if compiled else self.simulate_review_histogram
+            with tqdm_joblib(tqdm(desc="Simulations", total=len(simulation_ids))) as progress_bar:
+                simulations = Parallel(n_jobs=mp.cpu_count())(
+                    delayed(simulate_product)(i, num_reviews_per_simulation, existing_reviews) for i in simulation_ids
+                )
+        else:
+            # Vectorized engine: each joblib task advances a whole batch of products together, one visitor step
+            # at a time for all of them. The batches are then flattened back into one simulation per product
+            batches = np.array_split(simulation_ids, int(np.ceil(len(simulation_ids) / batch_size)))
+            with tqdm_joblib(tqdm(desc="Simulation batches", total=len(batches))) as progress_bar:
+                batched_simulations = Parallel(n_jobs=mp.cpu_count())(
+                    delayed(self.simulate_review_histograms_batch)(
+                        simulation_ids, num_reviews_per_simulation, existing_reviews
+                    )
+                    for simulation_ids in batches
+                )
+            simulations = [simulation for batch in batched_simulations for simulation in batch]
+        if self.simulation_type == "histogram":
+            return np.array(simulations)
+        else:
+            return timeseries_to_object_array(simulations)
+
+    def simulate_sharded(
+        self,
+        dirname: Path,
+        num_simulations: int,
+        shard_size: int = 10_000,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        simulation_parameters: Optional[dict] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+        batch_size: Optional[int] = None,
+        compiled: bool = False,
+    ) -> None:
+        # Resumable version of simulate for long runs. Simulations are done in shards of shard_size simulation ids,
+        # and each completed shard (simulation parameters + simulations) is written to the run directory as soon as
+        # it finishes. A manifest keeps track of the completed shards. If the run directory already has a manifest,
+        # the run is resumed: its saved seed, parameters and review counts are reused and completed shards are skipped
+        # A resumed run has to be called with the same num_simulations, shard_size, batch_size and compiled as the
+        # original one, as batched streams are keyed per batch. Simulation parameters and review counts can be left as
+        # None when resuming, otherwise they need to match the saved ones too
+        # Existing reviews are not saved with the run, so they need to be supplied again when resuming
+        # Only one shard is held in memory at a time. Load the finished run with load_simulator(dirname)
+        run_dirname = dirname / f"{self.__class__.__name__}_{self.simulation_type}_run"
+        manifest_path = run_dirname / "manifest.json"
+        if manifest_path.exists():
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            with open(run_dirname / "run.pkl", "rb") as f:
+                run_dict = pickle.load(f)
+            if existing_reviews is not None:
+                # As in prepare_simulations, the number of simulations comes from the existing reviews
+                existing_reviews = check_existing_reviews(existing_reviews)
+                num_simulations = len(existing_reviews)
+            resume_args = {
+                "num_simulations": num_simulations,
+                "shard_size": shard_size,
+                "batch_size": batch_size,
+                "compiled": compiled,
+            }
+            for (key, val) in resume_args.items():
+                # Manifests of runs started before batch_size and compiled were recorded can't be checked for those
+                assert (
+                    manifest.get(key, val) == val
+                ), f"""
+                Simulation run in {run_dirname} was started with {key}={manifest[key]}, but {key}={val} was provided
+                to resume it. Resume the run with the same {key}, or start a new run in another directory
+                """
+            assert num_reviews_per_simulation is None or np.array_equal(
+                num_reviews_per_simulation, run_dict["num_reviews_per_simulation"]
+            ), f"Review counts provided to resume the run in {run_dirname} don't match the ones it was started with"
+            assert simulation_parameters is None or (
+                set(simulation_parameters) == set(run_dict["simulation_parameters"])
+                and all(
+                    np.array_equal(val, run_dict["simulation_parameters"][key])
+                    for (key, val) in simulation_parameters.items()
+                )
+            ), f"Simulation parameters provided to resume the run in {run_dirname} don't match the ones it started with"
+            num_reviews_per_simulation = run_dict.pop("num_reviews_per_simulation")
+            for key in run_dict:
+                setattr(self, key, run_dict[key])
+            print(
+                f"""
+                Resuming simulation run in {run_dirname}, {len(manifest["completed_shards"])} out of
+                {manifest["num_shards"]} shards already completed
+                """
+            )
+        else:
+            num_simulations, existing_reviews = self.prepare_simulations(
+                num_simulations, num_reviews_per_simulation, simulation_parameters, existing_reviews
+            )
+            run_dirname.mkdir(parents=True, exist_ok=True)
+            run_dict = {
+                "simulation_type": self.simulation_type,
+                "simulation_parameters": self.simulation_parameters,
+                "simulation_seed": self.simulation_seed,
+                "tendency_to_rate": self.tendency_to_rate,
+                "review_prior": self.review_prior,
+                "params": self.params,
+                "num_reviews_per_simulation": num_reviews_per_simulation,
+            }
+            atomic_pickle_dump(run_dict, run_dirname / "run.pkl")
+            manifest = {
+                "simulator": self.__class__.__name__,
+                "simulation_type": self.simulation_type,
+                "num_simulations": int(num_simulations),
+                "shard_size": int(shard_size),
+                "num_shards": int(np.ceil(num_simulations / shard_size)),
+                "batch_size": None if batch_size is None else int(batch_size),
+                "compiled": bool(compiled),
+                "completed_shards": [],
+            }
+            atomic_json_dump(manifest, manifest_path)
+
+        for shard in range(manifest["num_shards"]):
+            if shard in manifest["completed_shards"]:
+                continue
+            simulation_ids = np.arange(shard * shard_size, min((shard + 1) * shard_size, num_simulations))
+            simulations = self.run_simulations(
+                simulation_ids, num_reviews_per_simulation, existing_reviews, batch_size, compiled
             )
-        self.simulations = np.array(simulations)
+            # Every shard is a simulation store of its own, written atomically
+            write_simulation_store(
+                run_dirname / f"shard_{shard:05d}",
+                simulations,
+                {key: val[:, simulation_ids] for (key, val) in self.simulation_parameters.items()},
+                dict(self.get_store_metadata(), first_simulation_id=int(simulation_ids[0])),
+            )
+            # The manifest is only updated once the shard store is completely written
+            manifest["completed_shards"].append(shard)
+            atomic_json_dump(manifest, manifest_path)
 
     # Helper function to sample the distribution of parameters to yield a set of simulation parameters for
     # every visitor. Our simulations are at the product level, thus the simulation ids run from 0 to n-1 if we are
     # simulation n products. Each of these n products has a distribution of simulation parameters (which is the inferred
     # set of posterior distributions if we are trying to simulate new data after performing inference from observed products)
+    # Point parameters are stored with a single distribution sample, so they are looked up without drawing from rng
+    # With pre-drawn visitor parameters, the parameters of the current visitor are read from the pre-drawn blocks
     def yield_simulation_param_per_visitor(self, simulation_id: int, param_to_yield: str) -> Union[float, np.ndarray]:
-        return self.simulation_parameters[param_to_yield][
-            np.random.randint(self.params["num_dist_samples"]), simulation_id
-        ]
+        if self.visitor_parameter_samples is not None:
+            return self.visitor_parameter_samples.get(simulation_id, param_to_yield)
+        param = self.simulation_parameters[param_to_yield]
+        if param.shape[0] == 1:
+            return param[0, simulation_id]
+        return param[self.rng.integers(param.shape[0]), simulation_id]
 
-    def save_simulations(self, dirname: Path) -> None:
-        simulation_dict = {
+    # Vectorized counterpart of yield_simulation_param_per_visitor, used by the batched simulation engine. Draws
+    # one independent distribution sample per entry of simulation_ids, i.e, one per visitor of each active product
+    def yield_simulation_param_per_visitor_batch(self, simulation_ids: np.ndarray, param_to_yield: str) -> np.ndarray:
+        param = self.simulation_parameters[param_to_yield]
+        if param.shape[0] == 1:
+            return param[0, simulation_ids]
+        return param[self.rng.integers(param.shape[0], size=len(simulation_ids)), simulation_ids]
+
+    def get_store_metadata(self) -> dict:
+        # Simulator settings saved alongside the simulations in a simulation store
+        return {
+            "simulator": self.__class__.__name__,
             "simulation_type": self.simulation_type,
-            "simulation_parameters": self.simulation_parameters,
-            "simulations": self.simulations,
+            "simulation_seed": self.simulation_seed,
             "tendency_to_rate": self.tendency_to_rate,
             "review_prior": self.review_prior,
             "params": self.params,
         }
-        with open(dirname / f"{self.__class__.__name__}_{self.simulation_type}.pkl", "wb") as f:
-            pickle.dump(simulation_dict, f)
 
-    def load_simulator(self, dirname: Path) -> None:
-        with open(dirname / f"{self.__class__.__name__}_{self.simulation_type}.pkl", "rb") as f:
-            simulation_dict = pickle.load(f)
-        for key in simulation_dict:
-            setattr(self, key, simulation_dict[key])
+    def save_simulations(self, dirname: Path) -> None:
+        # Simulations are saved as a columnar store of .npy files (see simulation_store.py) instead of a single pickle,
+        # so that they can be memory-mapped and read lazily when loading
+        write_simulation_store(
+            dirname / f"{self.__class__.__name__}_{self.simulation_type}",
+            self.simulations,
+            self.simulation_parameters,
+            self.get_store_metadata(),
+        )
+
+    def load_simulator(self, dirname: Path, lazy: bool = False) -> None:
+        # Simulations are either saved as a simulation store (save_simulations), as a sharded run directory
+        # (simulate_sharded) or, for older runs, as a single pickle
+        # With lazy=True, simulations and simulation parameters of a store are memory-mapped instead of being read
+        # into memory. Timeseries simulations are then a SimulationStore that rebuilds timeseries as they are indexed
+        store_dirname = dirname / f"{self.__class__.__name__}_{self.simulation_type}"
+        run_dirname = dirname / f"{self.__class__.__name__}_{self.simulation_type}_run"
+        if (store_dirname / "metadata.json").exists():
+            self.load_simulation_store(store_dirname, lazy)
+        elif (run_dirname / "manifest.json").exists():
+            self.load_sharded_simulations(run_dirname)
+        else:
+            with open(dirname / f"{self.__class__.__name__}_{self.simulation_type}.pkl", "rb") as f:
+                simulation_dict = pickle.load(f)
+            for key in simulation_dict:
+                setattr(self, key, simulation_dict[key])
+
+    def load_simulation_store(self, store_dirname: Path, lazy: bool = False) -> None:
+        store = SimulationStore(store_dirname)
+        self.simulation_type = store.metadata["simulation_type"]
+        self.simulation_seed = store.metadata["simulation_seed"]
+        self.tendency_to_rate = store.metadata["tendency_to_rate"]
+        self.review_prior = np.array(store.metadata["review_prior"])
+        self.params = store.metadata["params"]
+        if lazy:
+            self.simulation_parameters = store.simulation_parameters
+            if self.simulation_type == "histogram":
+                self.simulations = store.histograms.reshape(tuple(store.metadata["simulations_shape"]) + (5,))
+            else:
+                self.simulations = store
+        else:
+            self.simulation_parameters = {key: np.array(val) for (key, val) in store.simulation_parameters.items()}
+            self.simulations = store.to_array()
+
+    def load_sharded_simulations(self, run_dirname: Path) -> None:
+        # Shards are always read into memory, the simulations of a sharded run are not memory-mapped
+        with open(run_dirname / "manifest.json", "r") as f:
+            manifest = json.load(f)
+        assert (
+            len(manifest["completed_shards"]) == manifest["num_shards"]
+        ), f"""
+        Only {len(manifest["completed_shards"])} out of {manifest["num_shards"]} shards completed in the simulation run
+        in {run_dirname}. Run simulate_sharded with the same dirname again to finish the run
+        """
+        with open(run_dirname / "run.pkl", "rb") as f:
+            run_dict = pickle.load(f)
+        run_dict.pop("num_reviews_per_simulation")
+        for key in run_dict:
+            setattr(self, key, run_dict[key])
+        simulations = [
+            SimulationStore(run_dirname / f"shard_{shard:05d}").to_array() for shard in range(manifest["num_shards"])
+        ]
+        self.simulations = np.concatenate(simulations, axis=0)
 
 
+@register_simulator("single_rho", ParameterSchema([ParameterField("rho", low=0.0, high=4.0)]))
 class SingleRhoSimulator(BaseSimulator):
     def __init__(self, params: dict):
         super(SingleRhoSimulator, self).__init__(params)
 
     @classmethod
-    def generate_simulation_parameters(cls, num_simulations: int) -> dict:
+    def generate_simulation_parameters(cls, num_simulations: int, rng: Optional[np.random.Generator] = None) -> dict:
+        # Parameters are drawn from the supplied generator, or from a freshly seeded one if none is given
+        rng = np.random.default_rng() if rng is None else rng
         # This is the basic simulation parameter generator and should be used when simulations are being done
         # to train SNPE model. If supplying already inferred posterior for simulations, this method should not be used
         # NOTE: The simulation models expect a distribution over simulation parameters for every simulation id.
-        # This method hacks the distribution requirement by creating distribution samples that are the same value
         # Of course, the parameters are uniformly distributed across simulations, but there is no variance in the
-        # distributions "per simulation"
-        # That is why the num_dist_samples is only 10 here (just any small number would do) as all the values (per
-        # simulation id) are exactly equal
-        simulation_parameters = {"rho": np.tile((np.random.random(size=num_simulations) * 4)[None, :], (10, 1))}
+        # distributions "per simulation". So these are point parameters, stored once with num_dist_samples = 1
+        # instead of as copies of the same value
+        simulation_parameters = {"rho": (rng.random(size=num_simulations) * 4)[None, :]}
         return simulation_parameters
 
     def get_actual_experience(self, expected_experience_dist: np.ndarray, **kwargs) -> int:
@@ -167,16 +454,18 @@ class SingleRhoSimulator(BaseSimulator):
         # involved process of getting the actual experience (through product embeddings) can be used
         # For the general single rho simulator, actual experience is just a draw from the expected
         # distribution of experiences
-        return np.where(np.random.multinomial(1, expected_experience_dist))[0][0] + 1.0
+        return np.where(self.rng.multinomial(1, expected_experience_dist))[0][0] + 1.0
 
-    def simulate_visitor_journey(self, simulated_reviews: Deque, simulation_id: int, **kwargs) -> Union[int, None]:
+    def simulate_visitor_journey(
+        self, simulated_reviews: ReviewTimeseries, simulation_id: int, **kwargs
+    ) -> Union[int, None]:
         # Convolve the current simulated review distribution with the prior to get the posterior of reviews
         review_posterior = self.convolve_prior_with_existing_reviews(simulated_reviews[-1])
 
         # Just make a single draw from the posterior Dirichlet dist of reviews to get the distribution
         # of the product experiences that the user expects
         # Thus the expected experience is built out of the current distribution of reviews the user can see
-        expected_experience_dist = np.random.dirichlet(review_posterior)
+        expected_experience_dist = self.rng.dirichlet(review_posterior)
         # Also get the mean "experience" that the user expects
         expected_experience = np.sum(expected_experience_dist * np.arange(1, 6))
         # Get the user's actual experience
@@ -229,7 +518,7 @@ class SingleRhoSimulator(BaseSimulator):
         rho = self.yield_simulation_param_per_visitor(simulation_id, "rho")
         # Return the review only if mismatch is higher than rho
         # Tendency to rate governs baseline probability of returning review
-        if np.random.random() <= self.tendency_to_rate:
+        if self.rng.random() <= self.tendency_to_rate:
             return True
         elif np.abs(delta) >= rho:
             return True
@@ -242,72 +531,173 @@ class SingleRhoSimulator(BaseSimulator):
         num_reviews_per_simulation: Optional[np.ndarray] = None,
         existing_reviews: Optional[List[np.ndarray]] = None,
     ) -> np.ndarray:
+        # All random draws of this product come from its own stream
+        self.rng = self.get_simulation_rng(simulation_id)
         if num_reviews_per_simulation is None:
-            num_simulated_reviews = np.random.randint(low=20, high=5001)
+            num_simulated_reviews = self.rng.integers(low=20, high=5001)
         else:
             num_simulated_reviews = int(num_reviews_per_simulation[simulation_id])
 
         total_visitors = num_simulated_reviews * 30
         # Give the product 5 reviews to start with, one for each rating. This is only so that the review timeseries
         # looks similar to that produced by the more complex marketplace simulations
-        simulated_reviews = deque([np.ones(5)], maxlen=total_visitors)
-        # If existing reviews have been supplied, unravel them into the simulated reviews deque
+        simulated_reviews = ReviewTimeseries(capacity=num_simulated_reviews)
+        # If existing reviews have been supplied, unravel them into the simulated review timeseries
         if existing_reviews is not None:
             product_reviews = existing_reviews[simulation_id]
             for review in product_reviews:
-                # We use the same manner of appending existing review histograms to simulated_reviews as if
-                # those histograms were actually produced during simulations. This ensures that the same dtype is
-                # appended to the deque always and keeps the size of the deque as small as possible
-                current_histogram = simulated_reviews[-1].copy()
-                rating_index = np.where(review - current_histogram)[0][0]
-                current_histogram[rating_index] += 1
-                simulated_reviews.append(current_histogram)
-                if len(simulated_reviews) > 1:
-                    assert (
-                        np.sum(simulated_reviews[-1]) - np.sum(simulated_reviews[-2])
-                    ) == 1, """
-                    Please check the histograms provided in the array of existing reviews. These should be in the form
-                    of cumulative histograms and should only add 1 rating at a time
-                    """
+                # Each existing histogram is checked to add exactly 1 rating to the latest one before being appended
+                simulated_reviews.append_histogram(review)
                 total_visitors -= 1
 
+        if self.visitor_parameter_block_size is not None:
+            self.visitor_parameter_samples = VisitorParameterSamples(
+                self.simulation_parameters,
+                simulation_id,
+                1,
+                self.rng,
+                block_size=min(self.visitor_parameter_block_size, max(total_visitors, 1)),
+            )
         for visitor in range(total_visitors):
+            if self.visitor_parameter_samples is not None:
+                self.visitor_parameter_samples.next_visitor(simulation_id)
             rating_index = self.simulate_visitor_journey(simulated_reviews, simulation_id)
             if rating_index is not None:
-                current_histogram = simulated_reviews[-1].copy()
-                current_histogram[rating_index] += 1
-                simulated_reviews.append(current_histogram)
+                simulated_reviews.append_rating(rating_index)
             if np.sum(simulated_reviews[-1]) >= num_simulated_reviews:
                 break
-
-        simulated_reviews_array = np.array(simulated_reviews)
+        self.visitor_parameter_samples = None
 
         # Return histogram or timeseries of review histograms based on simulation_type
         if self.simulation_type == "histogram":
-            return simulated_reviews_array[-1, :]
+            return simulated_reviews[-1].copy()
+        else:
+            return simulated_reviews.to_array()
+
+    # The methods below make up the vectorized (batched) simulation engine. Instead of stepping through the visitors
+    # of one product at a time, a whole batch of products is advanced together: their current review histograms are
+    # held in a single (num_products, 5) array and every visitor step draws the Dirichlet, categorical and uniform
+    # variates for all still active products at once. Each method mirrors its per-visitor counterpart above, so that
+    # the batched engine produces simulations with the same distribution as simulate_review_histogram
+    def get_actual_experience_batch(self, expected_experience_dists: np.ndarray, **kwargs) -> np.ndarray:
+        # Categorical draw for every row via inverse CDF sampling, equivalent to the per-visitor multinomial draw
+        cumulative_dists = np.cumsum(expected_experience_dists, axis=1)
+        u = self.rng.random(size=(expected_experience_dists.shape[0], 1)) * cumulative_dists[:, -1:]
+        # Guard against u landing exactly at the upper edge due to floating point errors in the cumsum
+        return np.minimum(np.sum(cumulative_dists < u, axis=1), 4) + 1.0
+
+    def rating_calculator_batch(self, delta: np.ndarray, simulation_ids: np.ndarray) -> np.ndarray:
+        # Same fixed cutoffs as rating_calculator. searchsorted with side="left" counts the cutoffs strictly below
+        # delta, which reproduces the (lower, upper] intervals used there
+        return np.searchsorted(np.array([-1.5, -0.5, 0.5, 1.5]), delta, side="left")
+
+    def decision_to_leave_review_batch(self, delta: np.ndarray, simulation_ids: np.ndarray) -> np.ndarray:
+        rho = self.yield_simulation_param_per_visitor_batch(simulation_ids, "rho")
+        return (self.rng.random(size=len(delta)) <= self.tendency_to_rate) | (np.abs(delta) >= rho)
+
+    def simulate_visitor_journey_batch(
+        self, review_histograms: np.ndarray, simulation_ids: np.ndarray, **kwargs
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # Dirichlet draws for all products at once through normalized gamma variates
+        expected_experience_dists = self.rng.standard_gamma(self.review_prior[None, :] + review_histograms)
+        expected_experience_dists /= np.sum(expected_experience_dists, axis=1, keepdims=True)
+        expected_experiences = np.sum(expected_experience_dists * np.arange(1, 6)[None, :], axis=1)
+        experiences = self.get_actual_experience_batch(expected_experience_dists, **kwargs)
+        delta = experiences - expected_experiences
+        rating_indices = self.rating_calculator_batch(delta, simulation_ids)
+        decisions_to_rate = self.decision_to_leave_review_batch(delta, simulation_ids)
+        # Unlike the per-visitor method, the rating index is always returned, along with the boolean mask of
+        # visitors that actually decided to leave it
+        return rating_indices, decisions_to_rate
+
+    def simulate_review_histograms_batch(
+        self,
+        simulation_ids: np.ndarray,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+    ) -> List[np.ndarray]:
+        # The products of a batch share random draws, so the batch gets a stream of its own, keyed by its first
+        # simulation id and size. Batched runs are reproducible for a given batch_size, but a single product can only
+        # be regenerated on its own through the per-product engines
+        self.rng = self.get_simulation_rng(int(simulation_ids[0]), len(simulation_ids))
+        num_products = len(simulation_ids)
+        if num_reviews_per_simulation is None:
+            num_simulated_reviews = self.rng.integers(low=20, high=5001, size=num_products)
         else:
-            return simulated_reviews_array
+            num_simulated_reviews = np.array(num_reviews_per_simulation)[simulation_ids].astype("int")
+        total_visitors = num_simulated_reviews * 30
+
+        # Every product starts off with 5 reviews, one for each rating, as in simulate_review_histogram. Existing
+        # reviews, if supplied, form the beginning of the timeseries and use up 1 visitor each
+        starting_timeseries = []
+        for i, simulation_id in enumerate(simulation_ids):
+            if existing_reviews is not None:
+                product_reviews = np.vstack((np.ones((1, 5)), existing_reviews[simulation_id])).astype(np.int32)
+                assert np.all(
+                    np.sum(np.diff(product_reviews, axis=0), axis=1) == 1
+                ), """
+                Please check the histograms provided in the array of existing reviews. These should be in the form
+                of cumulative histograms and should only add 1 rating at a time
+                """
+                total_visitors[i] -= len(product_reviews) - 1
+            else:
+                product_reviews = np.ones((1, 5), dtype=np.int32)
+            starting_timeseries.append(product_reviews)
+        review_histograms = np.array([product_reviews[-1] for product_reviews in starting_timeseries])
+
+        # Accepted reviews are logged per visitor step as (product index, rating index) pairs. Every product accepts
+        # at most 1 review per step, so a stable sort of the log by product keeps each product's reviews in order
+        review_log_products = []  # type: List[np.ndarray]
+        review_log_ratings = []  # type: List[np.ndarray]
+        active = np.arange(num_products)
+        visitor = 0
+        while len(active) > 0:
+            active = active[visitor < total_visitors[active]]
+            if len(active) == 0:
+                break
+            rating_indices, decisions_to_rate = self.simulate_visitor_journey_batch(
+                review_histograms[active], simulation_ids[active]
+            )
+            rated = active[decisions_to_rate]
+            review_histograms[rated, rating_indices[decisions_to_rate]] += 1
+            review_log_products.append(rated)
+            review_log_ratings.append(rating_indices[decisions_to_rate])
+            # Products drop out of the batch once they reach their number of reviews
+            active = active[np.sum(review_histograms[active], axis=1) < num_simulated_reviews[active]]
+            visitor += 1
+
+        if self.simulation_type == "histogram":
+            return list(review_histograms)
+
+        # Rebuild the cumulative timeseries of review histograms of each product from the log of accepted reviews
+        review_log_products = np.concatenate(review_log_products) if review_log_products else np.array([], dtype=int)
+        review_log_ratings = np.concatenate(review_log_ratings) if review_log_ratings else np.array([], dtype=int)
+        order = np.argsort(review_log_products, kind="stable")
+        review_log_products, review_log_ratings = review_log_products[order], review_log_ratings[order]
+        splits = np.searchsorted(review_log_products, np.arange(1, num_products))
+        return [
+            ReviewTimeseries.from_rating_indices(product_reviews, ratings).to_array()
+            for product_reviews, ratings in zip(starting_timeseries, np.split(review_log_ratings, splits))
+        ]
 
 
+@register_simulator("double_rho", ParameterSchema([ParameterField("rho", low=0.0, high=4.0, dim=2)]))
 class DoubleRhoSimulator(SingleRhoSimulator):
     def __init__(self, params: dict):
         super(DoubleRhoSimulator, self).__init__(params)
 
     @classmethod
-    def generate_simulation_parameters(cls, num_simulations: int) -> dict:
+    def generate_simulation_parameters(cls, num_simulations: int, rng: Optional[np.random.Generator] = None) -> dict:
+        # Parameters are drawn from the supplied generator, or from a freshly seeded one if none is given
+        rng = np.random.default_rng() if rng is None else rng
         # This is the basic simulation parameter generator and should be used when simulations are being done
         # to train SNPE model. If supplying already inferred posterior for simulations, this method should not be used
         # NOTE: The simulation models expect a distribution over simulation parameters for every simulation id.
-        # This method hacks the distribution requirement by creating distribution samples that are the same value
         # Of course, the parameters are uniformly distributed across simulations, but there is no variance in the
-        # distributions "per simulation"
-        # That is why the num_dist_samples is only 10 here (just any small number would do) as all the values (per
-        # simulation id) are exactly equal
-        rho_array = np.vstack(
-            (np.random.random(size=num_simulations) * 4, np.random.random(size=num_simulations) * 4)
-        ).T
-        rho_array = np.tile(rho_array[None, :, :], (10, 1, 1))
-        simulation_parameters = {"rho": rho_array}
+        # distributions "per simulation". So these are point parameters, stored once with num_dist_samples = 1
+        # instead of as copies of the same value
+        rho_array = np.vstack((rng.random(size=num_simulations) * 4, rng.random(size=num_simulations) * 4)).T
+        simulation_parameters = {"rho": rho_array[None, :, :]}
         return simulation_parameters
 
     def decision_to_leave_review(self, delta: float, simulation_id: int) -> bool:
@@ -319,7 +709,7 @@ class DoubleRhoSimulator(SingleRhoSimulator):
         assert isinstance(rho, np.ndarray), f"Expected np.ndarray type for rho, found {type(rho)} instead"
         assert rho.shape == (2,), f"Expecting shape (2,) for rho, got {rho.shape} instead"
         # Tendency to rate governs baseline probability of returning review
-        if np.random.random() <= self.tendency_to_rate:
+        if self.rng.random() <= self.tendency_to_rate:
             return True
         elif delta < 0 and np.abs(delta) >= rho[0]:
             return True
@@ -328,7 +718,19 @@ class DoubleRhoSimulator(SingleRhoSimulator):
         else:
             return False
 
+    def decision_to_leave_review_batch(self, delta: np.ndarray, simulation_ids: np.ndarray) -> np.ndarray:
+        rho = self.yield_simulation_param_per_visitor_batch(simulation_ids, "rho")
+        assert rho.shape == (len(delta), 2), f"Expecting shape {(len(delta), 2)} for rho, got {rho.shape} instead"
+        # rho[:, 0] is for negative mismatch, and rho[:, 1] for positive mismatch
+        rho = np.where(delta < 0, rho[:, 0], rho[:, 1])
+        return (self.rng.random(size=len(delta)) <= self.tendency_to_rate) | (np.abs(delta) >= rho)
 
+
+@register_simulator(
+    "single_herding",
+    DoubleRhoSimulator.parameter_schema.extend([ParameterField("h_p", low=0.0, high=1.0)]),
+    {"previous_rating_measure": "mean", "min_reviews_for_herding": 5},
+)
 class HerdingSimulator(DoubleRhoSimulator):
     def __init__(self, params: dict):
         self.previous_rating_measure = params["previous_rating_measure"]
@@ -358,18 +760,21 @@ class HerdingSimulator(DoubleRhoSimulator):
         super(HerdingSimulator, self).__init__(params)
 
     @classmethod
-    def generate_simulation_parameters(cls, num_simulations: int) -> dict:
+    def generate_simulation_parameters(cls, num_simulations: int, rng: Optional[np.random.Generator] = None) -> dict:
+        # Parameters are drawn from the supplied generator, or from a freshly seeded one if none is given
+        rng = np.random.default_rng() if rng is None else rng
         # This method gets the rho parameters by calling the parameter generating classmethod of the DoubleRhoSimulator
         # Then it just adds the herding parameter on top
-        simulation_parameters = DoubleRhoSimulator.generate_simulation_parameters(num_simulations)
-        simulation_parameters["h_p"] = np.tile(
-            np.random.random(size=num_simulations)[None, :], (simulation_parameters["rho"].shape[0], 1)
-        )
+        simulation_parameters = DoubleRhoSimulator.generate_simulation_parameters(num_simulations, rng)
+        simulation_parameters["h_p"] = rng.random(size=num_simulations)[None, :]
         return simulation_parameters
 
     def simulate_visitor_journey(
-        self, simulated_reviews: Deque, simulation_id: int, use_h_u: bool = False, **kwargs
+        self, simulated_reviews: ReviewTimeseries, simulation_id: int, use_h_u: bool = False, **kwargs
     ) -> Union[int, None]:
+        # Whether this visitor's rating went through the herding procedure, recorded for diagnostics (for eg. in the
+        # visitor events of marketplace simulations)
+        self.visitor_herded = False
         # Run the visitor journey the same way at first
         rating_index = super(HerdingSimulator, self).simulate_visitor_journey(
             simulated_reviews, simulation_id, **kwargs
@@ -379,34 +784,44 @@ class HerdingSimulator(DoubleRhoSimulator):
         # Don't initiate the herding procedure till at least the minimum number of reviews have come
         # Also since we add 5 reviews right at the beginning (timeseries begins with np.ones(5)), we have to
         # subtract those from the total count to see if we have enough reviews to start herding
-        if (rating_index is not None) and (
-            np.sum(simulated_reviews[-1]) - np.sum(simulated_reviews[0]) >= self.min_reviews_for_herding
-        ):
+        if (rating_index is not None) and (simulated_reviews.num_reviews >= self.min_reviews_for_herding):
             herded_rating_index = self.herding(rating_index, simulated_reviews, simulation_id, use_h_u)
             return herded_rating_index
         # Otherwise just return the original rating index (which is = None in this case)
         else:
             return rating_index
 
-    def choose_herding_parameter(self, rating_index: int, simulated_reviews: Deque, simulation_id: int) -> float:
+    def simulate_visitor_journey_batch(
+        self, review_histograms: np.ndarray, simulation_ids: np.ndarray, **kwargs
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # Herding depends on the timeseries of reviews of each product, which the batched engine does not keep
+        # while simulating. So the batched engine is only available for the single and double rho simulators
+        raise NotImplementedError(
+            f"""
+            The batched simulation engine is not available for {self.__class__.__name__}.
+            Run simulate with batch_size=None instead
+            """
+        )
+
+    def choose_herding_parameter(
+        self, rating_index: int, simulated_reviews: ReviewTimeseries, simulation_id: int
+    ) -> float:
         h_p = self.yield_simulation_param_per_visitor(simulation_id, "h_p")
         assert isinstance(h_p, float), f"Expecting a scalar value for the herding parameter, got {h_p} instead"
         return h_p
 
-    def herding(self, rating_index: int, simulated_reviews: Deque, simulation_id: int, use_h_u: bool = False) -> int:
+    def herding(
+        self, rating_index: int, simulated_reviews: ReviewTimeseries, simulation_id: int, use_h_u: bool = False
+    ) -> int:
         assert (
-            np.sum(simulated_reviews[-1]) - np.sum(simulated_reviews[0]) >= self.min_reviews_for_herding
+            simulated_reviews.num_reviews >= self.min_reviews_for_herding
         ), f"""
         Minimum {self.min_reviews_for_herding} reviews need to have been obtained for herding to happen,
-        found only {np.sum(simulated_reviews[-1]) - np.sum(simulated_reviews[0])} instead
+        found only {simulated_reviews.num_reviews} instead
         """
-        # Check that the whole timeseries of simulated_reviews has been supplied
-        if len(simulated_reviews) == 1:
-            np.testing.assert_array_equal(simulated_reviews[0], np.ones(5))
-        else:
-            np.testing.assert_array_equal(
-                np.array([review.shape[0] for review in simulated_reviews]), 5 * np.ones(len(simulated_reviews))
-            )
+        # Check that the whole timeseries of simulated_reviews has been supplied. The review timeseries container
+        # always stores 5-D histograms, so only its starting histogram needs to be checked
+        np.testing.assert_array_equal(simulated_reviews[0], np.ones(5))
         # Pull out the herding parameter which will be used in this simulation
         # This step is trivial when using a single herding h_p, but becomes important when using 2
         h_p = self.choose_herding_parameter(rating_index, simulated_reviews, simulation_id)
@@ -414,22 +829,21 @@ class HerdingSimulator(DoubleRhoSimulator):
         if use_h_u:
             # The final herding probability is the product of h_p and h_u
             # So this user will herd with p=h_p*h_u and not with 1-p
-            h_u = np.random.random()
+            h_u = self.rng.random()
             herding_prob = h_p * h_u
         else:
             # Otherwise there is only the product-specific herding probability h_p
             herding_prob = h_p
         # Simulate the herding process
-        if np.random.random() <= herding_prob:
+        if self.rng.random() <= herding_prob:
             # Herding happening
+            self.visitor_herded = True
             if self.previous_rating_measure == "mean":
                 # Mean calculation from review histogram - using the indices (0-4) instead of actual ratings (1-5)
-                previous_rating_index = (
-                    np.sum(np.array(simulated_reviews[-1]) * np.arange(5)) / np.array(simulated_reviews[-1]).sum()
-                )
+                previous_rating_index = np.sum(simulated_reviews[-1] * np.arange(5)) / simulated_reviews[-1].sum()
             elif self.previous_rating_measure == "mode":
                 # WARNING: If the histogram has more than 1 mode, argmax will ONLY RETURN THE FIRST ONE
-                previous_rating_index = np.argmax(np.array(simulated_reviews[-1]))
+                previous_rating_index = np.argmax(simulated_reviews[-1])
             elif self.previous_rating_measure == "mode of latest":
                 # Get the histogram of latest num_latest_reviews_for_herding, and pick the mode
                 # WARNING: If the histogram has more than 1 mode, argmax will ONLY RETURN THE FIRST ONE
@@ -452,6 +866,11 @@ class HerdingSimulator(DoubleRhoSimulator):
             return rating_index
 
 
+@register_simulator(
+    "double_herding",
+    DoubleRhoSimulator.parameter_schema.extend([ParameterField("h_p", low=0.0, high=1.0, dim=2)]),
+    dict(HerdingSimulator.placeholder_params, herding_differentiating_measure="mean"),
+)
 class DoubleHerdingSimulator(HerdingSimulator):
     # Simulates herding with 2 product-specific herding parameters (h_p): one is used when the visitor's intended rating
     # is above a metric of existing ratings (mean or mode) and the other when it is below
@@ -467,15 +886,16 @@ class DoubleHerdingSimulator(HerdingSimulator):
         super(DoubleHerdingSimulator, self).__init__(params)
 
     @classmethod
-    def generate_simulation_parameters(cls, num_simulations) -> dict:
+    def generate_simulation_parameters(cls, num_simulations: int, rng: Optional[np.random.Generator] = None) -> dict:
+        # Parameters are drawn from the supplied generator, or from a freshly seeded one if none is given
+        rng = np.random.default_rng() if rng is None else rng
         # Same strategy as in the HerdingSimulator
-        simulation_parameters = DoubleRhoSimulator.generate_simulation_parameters(num_simulations)
-        h_p_array = np.vstack((np.random.random(size=num_simulations), np.random.random(size=num_simulations))).T
-        h_p_array = np.tile(h_p_array[None, :, :], (simulation_parameters["rho"].shape[0], 1, 1))
-        simulation_parameters["h_p"] = h_p_array
+        simulation_parameters = DoubleRhoSimulator.generate_simulation_parameters(num_simulations, rng)
+        h_p_array = np.vstack((rng.random(size=num_simulations), rng.random(size=num_simulations))).T
+        simulation_parameters["h_p"] = h_p_array[None, :, :]
         return simulation_parameters
 
-    def choose_herding_parameter(self, rating_index, simulated_reviews: Deque, simulation_id: int) -> float:
+    def choose_herding_parameter(self, rating_index, simulated_reviews: ReviewTimeseries, simulation_id: int) -> float:
         # Pull out the (2 valued) h_p corresponding to this simulation id
         h_p = self.yield_simulation_param_per_visitor(simulation_id, "h_p")
         # Confirm that h_p is 2-dimensional array
@@ -484,10 +904,10 @@ class DoubleHerdingSimulator(HerdingSimulator):
         # Pick which h_p to use based on the rating_index that the visitor picked
         # If it is greater than the mean/mode of existing ratings, pick h_p[1], else pick h_p[0]
         if self.herding_differentiating_measure == "mean":
-            metric = np.sum(np.array(simulated_reviews[-1]) * np.arange(5)) / np.array(simulated_reviews[-1]).sum()
+            metric = np.sum(simulated_reviews[-1] * np.arange(5)) / simulated_reviews[-1].sum()
         elif self.herding_differentiating_measure == "mode":
             # WARNING: If the histogram has more than 1 mode, argmax will ONLY RETURN THE FIRST ONE
-            metric = np.argmax(np.array(simulated_reviews[-1]))
+            metric = np.argmax(simulated_reviews[-1])
         else:
             raise ValueError(
                 f"""
@@ -502,6 +922,24 @@ class DoubleHerdingSimulator(HerdingSimulator):
             return h_p[1]
 
 
+@register_simulator(
+    "rating_scale",
+    HerdingSimulator.parameter_schema.extend(
+        [
+            ParameterField("p_1", low=0.5, high=1.0),
+            ParameterField("p_2", low=0.25, high=0.75),
+            ParameterField("p_4", low=0.25, high=0.75),
+            ParameterField("p_5", low=0.5, high=1.0),
+            ParameterField("bias_5_star", low=0.0, high=1.0),
+        ]
+    ),
+    dict(
+        HerdingSimulator.placeholder_params,
+        one_star_lowest_limit=-1.5,
+        five_star_highest_limit=1.5,
+        max_bias_5_star=0.5,
+    ),
+)
 class RatingScaleSimulator(HerdingSimulator):
     def __init__(self, params: dict):
         # The highest value that limits 5 star ratings
@@ -539,12 +977,14 @@ class RatingScaleSimulator(HerdingSimulator):
         super(RatingScaleSimulator, self).__init__(params)
 
     @classmethod
-    def generate_simulation_parameters(cls, num_simulations) -> dict:
+    def generate_simulation_parameters(cls, num_simulations: int, rng: Optional[np.random.Generator] = None) -> dict:
+        # Parameters are drawn from the supplied generator, or from a freshly seeded one if none is given
+        rng = np.random.default_rng() if rng is None else rng
         # This generates the rho and h_p herding parameters from the classmethod of the double herding simulator
         # Then we will add the p values that define the rating scales on top
         # These p values determine how we will split up the space from one_star_lowest_limit to five_star_lowest_limit
         # over the scale on which delta values are compared and star ratings are determined
-        simulation_parameters = HerdingSimulator.generate_simulation_parameters(num_simulations)
+        simulation_parameters = HerdingSimulator.generate_simulation_parameters(num_simulations, rng)
         # p_5 determines the actual limit to which delta is compared to get 5 star ratings
         # That limit = five_star_highest_limit * p_5
         # So if p_5 = 1 (highest value), limit = five_star_highest_limit
@@ -553,8 +993,8 @@ class RatingScaleSimulator(HerdingSimulator):
         # That limit = five_star_highest_limit * p_5 * p_4
         # So 3 star ratings come from 0 to five_star_highest_limit * p_5 * p_4
         # And 4 star ratings come from five_star_highest_limit * p_5 * p_4 to five_star_highest_limit * p_5
-        p_5 = 0.5 * np.random.random(size=num_simulations) + 0.5
-        p_4 = 0.5 * np.random.random(size=num_simulations) + 0.25
+        p_5 = 0.5 * rng.random(size=num_simulations) + 0.5
+        p_4 = 0.5 * rng.random(size=num_simulations) + 0.25
         # p_1 determines the actual limit to which delta is compared to get 1 star ratings
         # That limit = one_star_lowest_limit * p_1
         # So if p_1 = 1 (highest value), limit = one_star_lowest_limit
@@ -563,16 +1003,16 @@ class RatingScaleSimulator(HerdingSimulator):
         # That limit = one_star_lowest_limit * p_1 * p_2
         # So 3 star ratings come from one_star_lowest_limit * p_1 * p_2 to 0
         # And 2 star ratings come from one_star_lowest_limit * p_1 to one_star_lowest_limit * p_1 * p_2
-        p_1 = 0.5 * np.random.random(size=num_simulations) + 0.5
-        p_2 = 0.5 * np.random.random(size=num_simulations) + 0.25
+        p_1 = 0.5 * rng.random(size=num_simulations) + 0.5
+        p_2 = 0.5 * rng.random(size=num_simulations) + 0.25
         # A final bias parameter that encodes bias towards 5 star ratings
         # A user leaves a 5 star rating on the product (irrespective of experience) with this probability
-        bias_5_star = np.random.random(size=num_simulations)
-        simulation_parameters["p_5"] = np.tile(p_5[None, :], (simulation_parameters["rho"].shape[0], 1))
-        simulation_parameters["p_4"] = np.tile(p_4[None, :], (simulation_parameters["rho"].shape[0], 1))
-        simulation_parameters["p_2"] = np.tile(p_2[None, :], (simulation_parameters["rho"].shape[0], 1))
-        simulation_parameters["p_1"] = np.tile(p_1[None, :], (simulation_parameters["rho"].shape[0], 1))
-        simulation_parameters["bias_5_star"] = np.tile(bias_5_star[None, :], (simulation_parameters["rho"].shape[0], 1))
+        bias_5_star = rng.random(size=num_simulations)
+        simulation_parameters["p_5"] = p_5[None, :]
+        simulation_parameters["p_4"] = p_4[None, :]
+        simulation_parameters["p_2"] = p_2[None, :]
+        simulation_parameters["p_1"] = p_1[None, :]
+        simulation_parameters["bias_5_star"] = bias_5_star[None, :]
         return simulation_parameters
 
     def rating_calculator(self, delta: float, simulation_id: int) -> int:
@@ -593,7 +1033,7 @@ class RatingScaleSimulator(HerdingSimulator):
             return 4
 
     def simulate_visitor_journey(
-        self, simulated_reviews: Deque, simulation_id: int, use_h_u: bool = False, **kwargs
+        self, simulated_reviews: ReviewTimeseries, simulation_id: int, use_h_u: bool = False, **kwargs
     ) -> Union[int, None]:
         # Run the visitor journey the same way at first
         rating_index = super(RatingScaleSimulator, self).simulate_visitor_journey(
@@ -602,7 +1042,58 @@ class RatingScaleSimulator(HerdingSimulator):
 
         # A user simply returns a 5 star rating with probability = bias_5_star
         bias_5_star = self.yield_simulation_param_per_visitor(simulation_id, "bias_5_star")
-        if np.random.random() <= self.max_bias_5_star * bias_5_star:
+        if self.rng.random() <= self.max_bias_5_star * bias_5_star:
             return 4
         else:
             return rating_index
+
+    def simulate_review_histogram_compiled(
+        self,
+        simulation_id: int,
+        num_reviews_per_simulation: Optional[np.ndarray] = None,
+        existing_reviews: Optional[List[np.ndarray]] = None,
+    ) -> np.ndarray:
+        # Same simulation as simulate_review_histogram, but the full visitor journey runs inside the fused kernel
+        # from compiled_kernels. The kernel is jitted with numba if it is installed and runs as plain Python otherwise
+        self.rng = self.get_simulation_rng(simulation_id)
+        if num_reviews_per_simulation is None:
+            num_simulated_reviews = self.rng.integers(low=20, high=5001)
+        else:
+            num_simulated_reviews = int(num_reviews_per_simulation[simulation_id])
+        total_visitors = num_simulated_reviews * 30
+
+        starting_timeseries = ReviewTimeseries(capacity=1)
+        if existing_reviews is not None:
+            for review in existing_reviews[simulation_id]:
+                starting_timeseries.append_histogram(review)
+                total_visitors -= 1
+
+        simulated_reviews = rating_scale_review_kernel(
+            starting_timeseries.to_array(),
+            np.asarray(self.review_prior, dtype=np.float64),
+            float(self.tendency_to_rate),
+            np.ascontiguousarray(self.simulation_parameters["rho"][:, simulation_id, :], dtype=np.float64),
+            np.ascontiguousarray(self.simulation_parameters["h_p"][:, simulation_id], dtype=np.float64),
+            np.ascontiguousarray(self.simulation_parameters["p_1"][:, simulation_id], dtype=np.float64),
+            np.ascontiguousarray(self.simulation_parameters["p_2"][:, simulation_id], dtype=np.float64),
+            np.ascontiguousarray(self.simulation_parameters["p_4"][:, simulation_id], dtype=np.float64),
+            np.ascontiguousarray(self.simulation_parameters["p_5"][:, simulation_id], dtype=np.float64),
+            np.ascontiguousarray(self.simulation_parameters["bias_5_star"][:, simulation_id], dtype=np.float64),
+            float(self.one_star_lowest_limit),
+            float(self.five_star_highest_limit),
+            float(self.max_bias_5_star),
+            int(self.min_reviews_for_herding),
+            PREVIOUS_RATING_MEASURE_CODES[self.previous_rating_measure],
+            int(getattr(self, "num_latest_reviews_for_herding", 0)),
+            False,
+            num_simulated_reviews,
+            total_visitors,
+            # All random draws of the kernel come from this product's own stream, as in simulate_review_histogram
+            self.rng,
+        )
+
+        # Return histogram or timeseries of review histograms based on simulation_type
+        if self.simulation_type == "histogram":
+            return simulated_reviews[-1, :]
+        else:
+            return simulated_reviews
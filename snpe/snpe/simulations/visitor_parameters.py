@@ -0,0 +1,69 @@
+from typing import Dict, Union
+
+import numpy as np
+
+
+class VisitorParameterSamples:
+    # Pre-drawn simulation parameters of the visitors of a set of products (simulation ids first_simulation_id to
+    # first_simulation_id + num_products - 1), for simulations from distributional parameters such as inferred
+    # posteriors. Instead of drawing a random distribution sample per parameter for every visitor, the distribution
+    # sample indices of a block of visitors of a product are drawn in one go, and the parameter values they pick are
+    # gathered into contiguous (block length, param dims) arrays, one per parameter. Every visitor then only reads the
+    # next entry of its product's block, and a new block is drawn once a product runs out of it
+    # As with per-visitor draws, every parameter gets its own independent distribution sample per visitor. Point
+    # parameters (with a single distribution sample) are not drawn at all and are read straight from their values
+    # Blocks are allocated per product (in a dict keyed by row) when it gets its first visitor. The first block of a
+    # product holds min_block_size visitors and every new block doubles in length, up to block_size. Memory then
+    # follows the number of visitors of every product (at most twice that) instead of being block_size visitors for
+    # every product in the catalogue, which is what matters for marketplaces with large catalogues
+    def __init__(
+        self,
+        simulation_parameters: Dict[str, np.ndarray],
+        first_simulation_id: int,
+        num_products: int,
+        rng: np.random.Generator,
+        block_size: int = 1024,
+        min_block_size: int = 16,
+    ):
+        self.simulation_parameters = simulation_parameters
+        self.first_simulation_id = first_simulation_id
+        self.block_size = block_size
+        self.min_block_size = min(min_block_size, block_size)
+        self.rng = rng
+        simulation_ids = slice(first_simulation_id, first_simulation_id + num_products)
+        self.point_values = {
+            key: val[0, simulation_ids] for (key, val) in simulation_parameters.items() if val.shape[0] == 1
+        }
+        self.distributional_keys = [key for (key, val) in simulation_parameters.items() if val.shape[0] > 1]
+        # Current block of every product that has had visitors, by row
+        self.blocks = {}  # type: Dict[int, Dict[str, np.ndarray]]
+        # Position of the current visitor in the block of every product. Products start without a block, so that
+        # their first block is drawn when they get their first visitor
+        self.positions = np.zeros(num_products, dtype=np.int64)
+        self.block_lengths = np.zeros(num_products, dtype=np.int64)
+
+    def draw_block(self, row: int) -> None:
+        simulation_id = self.first_simulation_id + row
+        block_length = min(max(2 * self.block_lengths[row], self.min_block_size), self.block_size)
+        block = {}
+        for key in self.distributional_keys:
+            param = self.simulation_parameters[key]
+            block[key] = param[self.rng.integers(param.shape[0], size=block_length), simulation_id]
+        self.blocks[row] = block
+        self.block_lengths[row] = block_length
+
+    def next_visitor(self, simulation_id: int) -> None:
+        # Moves on to the parameters of the next visitor of the product with this simulation id
+        row = simulation_id - self.first_simulation_id
+        if self.positions[row] >= self.block_lengths[row] - 1:
+            self.draw_block(row)
+            self.positions[row] = 0
+        else:
+            self.positions[row] += 1
+
+    def get(self, simulation_id: int, param_to_yield: str) -> Union[float, np.ndarray]:
+        # Parameter value of the current visitor of the product with this simulation id
+        row = simulation_id - self.first_simulation_id
+        if param_to_yield in self.point_values:
+            return self.point_values[param_to_yield][row]
+        return self.blocks[row][param_to_yield][self.positions[row]]
@@ -0,0 +1,29 @@
+import pickle
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from sklearn.mixture import GaussianMixture
+from snpe.utils.embedding_nets import RatingPredictorModel
+
+EMBEDDING_DIM = 16
+
+
+@pytest.fixture(scope="session")
+def marketplace_artifact_path(tmp_path_factory) -> Path:
+    # Small stand-ins for the artifacts of marketplace simulations: the embedding density estimators of products and
+    # users, and an untrained embedding -> rating predictor, pickled the same way as their load methods expect
+    # Both check for the output of starspace training, which is otherwise unused
+    artifact_path = tmp_path_factory.mktemp("marketplace_artifacts")
+    (artifact_path / "productspace").touch()
+    rng = np.random.default_rng(0)
+    product_model = GaussianMixture(3, random_state=42).fit(rng.normal(size=(500, EMBEDDING_DIM)))
+    user_model = GaussianMixture(3, random_state=42).fit(rng.normal(size=(800, EMBEDDING_DIM)))
+    with open(artifact_path / "EmbeddingDensityGMM.pkl", "wb") as f:
+        pickle.dump({"artifact_path": artifact_path, "product_model": product_model, "user_model": user_model}, f)
+    rating_predictor_model = RatingPredictorModel(prod_embedding_dim=EMBEDDING_DIM)
+    with open(artifact_path / "EmbeddingRatingPredictor.pkl", "wb") as f:
+        pickle.dump({"artifact_path": artifact_path, "model": rating_predictor_model}, f)
+    return artifact_path
@@ -0,0 +1,56 @@
+from typing import Callable, Tuple
+
+import numpy as np
+import pytest
+
+from snpe.simulations.consideration_sets import HNSWLIB_AVAILABLE, ConsiderationSetEngine
+
+NUM_PRODUCTS = 500
+NUM_VISITORS = 300
+EMBEDDING_DIM = 16
+CONSIDERATION_SET_SIZE = 5
+
+
+def visitor_embedding_sampler(visitor_embeddings: np.ndarray) -> Callable[[int], np.ndarray]:
+    # Hands out the same sequence of visitor embeddings, whatever the number of visitors asked for at a time
+    position = 0
+
+    def sample_visitor_embeddings(num_visitors: int) -> np.ndarray:
+        nonlocal position
+        position += num_visitors
+        return visitor_embeddings[position - num_visitors : position]
+
+    return sample_visitor_embeddings
+
+
+def consideration_sets(mode: str, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(7)
+    product_embeddings = rng.normal(size=(NUM_PRODUCTS, EMBEDDING_DIM))
+    visitor_embeddings = rng.normal(size=(NUM_VISITORS, EMBEDDING_DIM))
+    engine = ConsiderationSetEngine(
+        product_embeddings,
+        CONSIDERATION_SET_SIZE,
+        visitor_embedding_sampler(visitor_embeddings),
+        mode=mode,
+        **kwargs,
+    )
+    sets, cos_sims = zip(*[engine.next_consideration_set() for _ in range(NUM_VISITORS)])
+    # Products within a consideration set are in no particular order
+    order = np.argsort(np.array(sets), axis=1)
+    return np.take_along_axis(np.array(sets), order, axis=1), np.take_along_axis(np.array(cos_sims), order, axis=1)
+
+
+def test_matmul_matches_exact_consideration_sets():
+    exact_sets, exact_cos_sims = consideration_sets("exact")
+    # Blocks that don't divide the number of visitors check that visitors line up across blocks
+    matmul_sets, matmul_cos_sims = consideration_sets("matmul", block_size=64)
+    assert np.array_equal(exact_sets, matmul_sets)
+    assert np.allclose(exact_cos_sims, matmul_cos_sims)
+
+
+@pytest.mark.skipif(not HNSWLIB_AVAILABLE, reason="hnswlib is not installed")
+def test_ann_mostly_matches_exact_consideration_sets():
+    exact_sets, _ = consideration_sets("exact")
+    ann_sets, _ = consideration_sets("ann", block_size=64)
+    recall = np.mean([len(np.intersect1d(exact, ann)) for (exact, ann) in zip(exact_sets, ann_sets)])
+    assert recall / CONSIDERATION_SET_SIZE > 0.9
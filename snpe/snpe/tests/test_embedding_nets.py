@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+import torch
+
+from snpe.utils.embedding_nets import NumpyRatingPredictor, RatingPredictorModel, fc_rating_predictor
+
+EMBEDDING_DIM = 16
+
+
+@pytest.mark.parametrize("num_dense_layers", [3, 4])
+@pytest.mark.parametrize("predict_fractions", [False, True])
+def test_numpy_rating_predictor_matches_torch_model(predict_fractions, num_dense_layers):
+    torch.manual_seed(7)
+    model = RatingPredictorModel(predict_fractions=predict_fractions, prod_embedding_dim=EMBEDDING_DIM)
+    model.net = fc_rating_predictor(EMBEDDING_DIM, num_dense_layers=num_dense_layers, logsoftmax=predict_fractions)
+    model.eval()
+    predictor = NumpyRatingPredictor.from_model(model)
+    # Embeddings with a large spread, so that the LeakyReLUs see both signs and exp/logsoftmax see large outputs
+    embeddings = 5 * np.random.default_rng(7).normal(size=(1_000, EMBEDDING_DIM))
+    with torch.no_grad():
+        torch_pred = model(torch.from_numpy(embeddings).float()).numpy()
+    # Batches that don't divide the number of embeddings check that batches line up
+    for batch_size in (64, 333, 65536):
+        pred = predictor(embeddings, batch_size=batch_size)
+        assert pred.shape == (1_000, 5) and pred.dtype == np.float32
+        assert np.allclose(pred, torch_pred, rtol=1e-4, atol=1e-5)
+    if predict_fractions:
+        assert np.allclose(np.sum(np.exp(pred), axis=1), 1.0, atol=1e-5)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from snpe.simulations.event_writer import (
+    PYARROW_AVAILABLE,
+    MarketplaceEventWriter,
+    iter_marketplace_events,
+    read_marketplace_events,
+)
+
+FILE_FORMATS = [
+    "npy",
+    pytest.param("parquet", marks=pytest.mark.skipif(not PYARROW_AVAILABLE, reason="pyarrow is not installed")),
+]
+NUM_EVENTS = 10
+
+
+@pytest.mark.parametrize("file_format", FILE_FORMATS)
+def test_events_are_written_in_chunks(tmp_path, file_format):
+    writer = MarketplaceEventWriter(tmp_path, 3, chunk_size=4, file_format=file_format)
+    for visitor in range(NUM_EVENTS):
+        rating_index = None if visitor % 2 else visitor % 5
+        writer.write(visitor, np.arange(3) + visitor, visitor + 1, rating_index, visitor % 3 == 0)
+    writer.close()
+    # 2 full chunks, and the last 2 events flushed on close
+    assert writer.num_chunks == 3
+    assert [len(chunk["visitor_id"]) for chunk in iter_marketplace_events(tmp_path, ["visitor_id"])] == [4, 4, 2]
+    events = read_marketplace_events(tmp_path)
+    assert np.array_equal(events["visitor_id"], np.arange(NUM_EVENTS))
+    assert np.array_equal(events["consideration_set"], np.arange(3)[None, :] + np.arange(NUM_EVENTS)[:, None])
+    assert np.array_equal(events["chosen_product"], np.arange(1, NUM_EVENTS + 1))
+    assert np.array_equal(events["rating_index"], [0, -1, 2, -1, 4, -1, 1, -1, 3, -1])
+    assert np.array_equal(events["herded"], np.arange(NUM_EVENTS) % 3 == 0)
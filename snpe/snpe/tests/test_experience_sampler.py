@@ -0,0 +1,52 @@
+import numpy as np
+
+from scipy.stats import chi2_contingency, chisquare
+from snpe.simulations.experience_sampler import ActualExperienceSampler
+from snpe.simulations.marketplace_simulator_class import MarketplaceSimulator
+
+NUM_DRAWS = 20_000
+SIGNIFICANCE = 0.001
+PRED_PRODUCT_RATINGS = np.array([[1.0, 1.0, 1.0, 1.0, 1.0], [0.2, 0.3, 1.0, 4.0, 9.0], [5.0, 0.5, 0.5, 0.5, 0.1]])
+
+
+def experience_counts(experiences: np.ndarray) -> np.ndarray:
+    return np.bincount(np.asarray(experiences, dtype=int) - 1, minlength=5)
+
+
+def test_draws_follow_product_probabilities():
+    sampler = ActualExperienceSampler(PRED_PRODUCT_RATINGS, np.random.default_rng(7))
+    for (product, pred_ratings) in enumerate(PRED_PRODUCT_RATINGS):
+        counts = experience_counts([sampler.draw(product) for _ in range(NUM_DRAWS)])
+        expected_counts = NUM_DRAWS * pred_ratings / np.sum(pred_ratings)
+        assert chisquare(counts, expected_counts).pvalue > SIGNIFICANCE
+
+
+def test_draws_are_reproducible():
+    samplers = [ActualExperienceSampler(PRED_PRODUCT_RATINGS, np.random.default_rng(7)) for _ in range(2)]
+    products = np.random.default_rng(0).integers(len(PRED_PRODUCT_RATINGS), size=10_000)
+    draws = [[sampler.draw(product) for product in products] for sampler in samplers]
+    assert draws[0] == draws[1]
+
+
+def test_marketplace_experience_matches_baseline():
+    # The baseline drew a Dirichlet sample with the predicted ratings as concentration parameters, followed by a
+    # categorical draw from it, for every visitor
+    rng = np.random.default_rng(7)
+    simulator = MarketplaceSimulator(
+        dict(
+            MarketplaceSimulator.placeholder_params,
+            review_prior=np.ones(5),
+            tendency_to_rate=0.05,
+            simulation_type="histogram",
+            seed=7,
+        )
+    )
+    simulator.experience_sampler = ActualExperienceSampler(PRED_PRODUCT_RATINGS, simulator.rng)
+    for (product, pred_ratings) in enumerate(PRED_PRODUCT_RATINGS):
+        baseline_counts = experience_counts(
+            [np.where(rng.multinomial(1, rng.dirichlet(pred_ratings)))[0][0] + 1.0 for _ in range(NUM_DRAWS)]
+        )
+        counts = experience_counts(
+            [simulator.get_actual_experience(np.ones(5) / 5, product=product) for _ in range(NUM_DRAWS)]
+        )
+        assert chi2_contingency(np.vstack((baseline_counts, counts)))[1] > SIGNIFICANCE
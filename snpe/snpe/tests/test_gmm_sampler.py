@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from scipy import stats
+from sklearn.mixture import GaussianMixture
+from snpe.embeddings.embeddings_density_est_GMM import GMMSampler
+
+NUM_SAMPLES = 20_000
+NUM_FEATURES = 3
+
+
+def fitted_gmm(covariance_type: str) -> GaussianMixture:
+    rng = np.random.default_rng(0)
+    data = np.vstack(
+        (
+            rng.normal(-2.0, 0.5, size=(500, NUM_FEATURES)),
+            rng.multivariate_normal([2.0, 0.0, 1.0], [[1.0, 0.6, 0.0], [0.6, 1.0, 0.3], [0.0, 0.3, 0.5]], size=1_000),
+        )
+    )
+    return GaussianMixture(n_components=2, covariance_type=covariance_type, random_state=0).fit(data)
+
+
+@pytest.mark.parametrize("covariance_type", ["full", "tied", "diag", "spherical"])
+def test_block_samples_follow_the_gmm(covariance_type):
+    gmm = fitted_gmm(covariance_type)
+    sampler = GMMSampler(gmm, block_size=1_000)
+    sampler.reset(np.random.default_rng(7))
+    samples = sampler.draw(NUM_SAMPLES)
+    gmm_samples, _ = gmm.sample(NUM_SAMPLES)
+    assert samples.shape == (NUM_SAMPLES, NUM_FEATURES)
+    for feature in range(NUM_FEATURES):
+        p_value = stats.ks_2samp(samples[:, feature], gmm_samples[:, feature]).pvalue
+        assert p_value > 0.001 / NUM_FEATURES, f"Samples of feature {feature} differ, KS p-value {p_value}"
+    # Correlations between features come from the covariances of the components
+    assert np.allclose(np.cov(samples.T), np.cov(gmm_samples.T), atol=0.1)
+
+
+def test_draws_hand_out_blocks_in_order():
+    gmm = fitted_gmm("full")
+    sampler = GMMSampler(gmm, block_size=64)
+    sampler.reset(np.random.default_rng(7))
+    # Draws of varying sizes, some spanning several blocks
+    draws = np.concatenate([sampler.draw(n_samples) for n_samples in (1, 10, 100, 1, 200)])
+    sampler.reset(np.random.default_rng(7))
+    blocks = np.concatenate([sampler.sample(64) for _ in range(int(np.ceil(len(draws) / 64)))])
+    assert np.array_equal(draws, blocks[: len(draws)])
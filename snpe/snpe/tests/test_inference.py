@@ -0,0 +1,226 @@
+import numpy as np
+import pytest
+import torch
+
+from sbi.utils import BoxUniform
+from scipy import stats
+from snpe.inference.density_estimator_training import DensityEstimatorTrainer
+from snpe.inference.inference_class import HistogramInference, TimeSeriesInference
+from snpe.simulations.parameter_schema import get_parameter_prior, get_parameter_schema
+from snpe.simulations.review_timeseries import timeseries_to_object_array
+from snpe.simulations.simulator_class import DoubleRhoSimulator, HerdingSimulator
+
+PADDED_LENGTH = 4
+
+
+def cumulative_timeseries(num_reviews: int) -> np.ndarray:
+    ratings = np.zeros((num_reviews, 5), dtype=int)
+    ratings[np.arange(num_reviews), np.arange(num_reviews) % 5] = 1
+    return np.vstack((np.ones((1, 5), dtype=int), 1 + np.cumsum(ratings, axis=0)))
+
+
+@pytest.fixture
+def inferrer(monkeypatch):
+    inferrer = TimeSeriesInference(None)
+    inferrer.padded_simulation_length = PADDED_LENGTH
+    # Sampling is skipped, the prepared observations are returned instead
+    monkeypatch.setattr(inferrer, "sample_posterior_batch", lambda observations, num_samples: observations)
+    return inferrer
+
+
+def test_observations_longer_than_padded_length_fail(inferrer):
+    observations = timeseries_to_object_array([cumulative_timeseries(2), cumulative_timeseries(PADDED_LENGTH + 2)])
+    with pytest.raises(AssertionError):
+        inferrer.get_posterior_samples(observations)
+
+
+def test_observations_are_truncated_only_on_request(inferrer):
+    observations = timeseries_to_object_array([cumulative_timeseries(2), cumulative_timeseries(PADDED_LENGTH + 2)])
+    truncated = timeseries_to_object_array([cumulative_timeseries(2), cumulative_timeseries(PADDED_LENGTH - 1)])
+    prepared = inferrer.get_posterior_samples(observations, truncate_observations=True)
+    expected = inferrer.get_posterior_samples(truncated)
+    assert np.array_equal(np.asarray(prepared), np.asarray(expected))
+
+
+ONLINE_TRAINING_KWARGS = {
+    "num_producers": 1,
+    "simulation_batch_size": 5,
+    "vectorized": True,
+    "num_validation_simulations": 10,
+    "min_replay_buffer_size": 10,
+    "validation_interval": 5,
+    "max_num_training_steps": 10,
+    "hidden_features": 10,
+    "num_transforms": 1,
+}
+
+
+def online_simulator() -> DoubleRhoSimulator:
+    return DoubleRhoSimulator(
+        {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": "histogram", "seed": 7}
+    )
+
+
+def test_online_training_with_too_few_simulations_fails():
+    inferrer = HistogramInference()
+    with pytest.raises(AssertionError):
+        inferrer.infer_snpe_posterior_online(online_simulator(), max_num_simulations=15, **ONLINE_TRAINING_KWARGS)
+
+
+def test_online_training_stops_at_max_num_simulations():
+    inferrer = HistogramInference()
+    inferrer.infer_snpe_posterior_online(online_simulator(), max_num_simulations=30, **ONLINE_TRAINING_KWARGS)
+    assert inferrer.training_steps == ONLINE_TRAINING_KWARGS["max_num_training_steps"]
+    # Producers stop after max_num_simulations, although training may finish before all of them are received
+    assert 20 <= inferrer.online_training_summary["num_simulations"][-1] <= 30
+    posterior_samples = inferrer.get_posterior_samples(np.array([[10, 2, 5, 20, 40]]), num_samples=5)
+    assert posterior_samples.shape == (5, 1, 2)
+
+
+def test_trainer_keeps_the_best_density_estimator():
+    parameters, simulations = torch.rand(20, 2), torch.rand(20, 5)
+    trainer = DensityEstimatorTrainer(parameters, simulations, hidden_features=10, num_transforms=1)
+    validation_log_prob, improved = trainer.validate(
+        [(parameters[:10], simulations[:10]), (parameters[10:], simulations[10:])]
+    )
+    assert improved and trainer.best_validation_log_prob == validation_log_prob
+    best_state_dict = {key: val.clone() for (key, val) in trainer.density_estimator.state_dict().items()}
+    # A huge learning rate makes the density estimator worse, which must not replace the best one
+    for param_group in trainer.optimizer.param_groups:
+        param_group["lr"] = 10.0
+    for _ in range(5):
+        trainer.training_step(parameters, simulations)
+    _, improved = trainer.validate([(parameters, simulations)])
+    assert not improved
+    posterior = trainer.build_posterior(get_parameter_prior("double_rho"), torch.Size([1, 5]))
+    for (key, val) in posterior.net.state_dict().items():
+        assert torch.equal(val, best_state_dict[key])
+
+
+def test_streaming_training_builds_a_posterior():
+    simulator = DoubleRhoSimulator(
+        {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": "timeseries", "seed": 7}
+    )
+    simulator.simulate(num_simulations=40, num_reviews_per_simulation=np.arange(40) % 10 + 5)
+    inferrer = TimeSeriesInference(get_parameter_prior("double_rho"))
+    inferrer.simulator = simulator
+    inferrer.simulator_type, inferrer.simulation_type = simulator.simulator_type, simulator.simulation_type
+    # Length buckets also cover the z-scoring per star rating
+    inferrer.infer_snpe_posterior_streaming(
+        embedding_net_conf={"num_conv_layers": 1, "num_channels": 4, "num_dense_layers": 1, "pooled_length": 2},
+        batch_size=10,
+        hidden_features=10,
+        num_transforms=1,
+        max_num_epochs=2,
+        num_length_buckets=2,
+    )
+    assert inferrer.training_epochs == 2
+    posterior_samples = inferrer.get_posterior_samples(
+        timeseries_to_object_array([cumulative_timeseries(3)]), num_samples=5
+    )
+    assert posterior_samples.shape == (5, 1, 2)
+
+
+def test_parameter_prior_defaults_to_the_schema_prior(tmp_path):
+    simulator = DoubleRhoSimulator(
+        {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": "histogram", "seed": 7}
+    )
+    simulator.simulate(num_simulations=5, num_reviews_per_simulation=np.full(5, 8))
+    simulator.save_simulations(tmp_path)
+    inferrer = HistogramInference()
+    inferrer.load_simulator(tmp_path, simulator_type="double_rho", simulation_type="histogram")
+    assert torch.equal(inferrer.parameter_prior.base_dist.low, torch.zeros(2))
+    assert torch.equal(inferrer.parameter_prior.base_dist.high, torch.full((2,), 4.0))
+    # A prior that is given explicitly is kept
+    parameter_prior = BoxUniform(low=torch.zeros(2), high=torch.ones(2))
+    inferrer = HistogramInference(parameter_prior)
+    inferrer.load_simulator(tmp_path, simulator_type="double_rho", simulation_type="histogram")
+    assert inferrer.parameter_prior is parameter_prior
+
+
+def herding_simulator() -> HerdingSimulator:
+    return HerdingSimulator(
+        dict(
+            HerdingSimulator.placeholder_params,
+            review_prior=np.ones(5),
+            tendency_to_rate=0.05,
+            simulation_type="histogram",
+            seed=7,
+        )
+    )
+
+
+def within_prior_bounds(inferrer: HistogramInference, samples: np.ndarray) -> bool:
+    schema = get_parameter_schema(inferrer.simulator_type)
+    return bool(np.all((samples >= schema.low) & (samples <= schema.high)))
+
+
+@pytest.mark.parametrize("proposal_type", ["truncated", "atomic"])
+def test_sequential_inference_on_herding(proposal_type):
+    inferrer = HistogramInference()
+    observation = np.array([[10, 2, 5, 20, 40]])
+    inferrer.infer_snpe_posterior_sequential(
+        herding_simulator(),
+        observation,
+        num_rounds=2,
+        num_simulations_per_round=60,
+        proposal_type=proposal_type,
+        truncation_quantile=0.1,
+        hidden_features=10,
+        num_transforms=1,
+        num_reviews_per_simulation=np.full(60, 20),
+    )
+    assert inferrer.sequential_training_summary["num_simulations"] == [60, 60]
+    posterior_samples = inferrer.get_posterior_samples(observation, num_samples=50)
+    assert within_prior_bounds(inferrer, posterior_samples)
+    # The truncated prior is the prior restricted to a region of the posterior, so its samples stay within the box
+    truncated_samples, acceptance_rate = inferrer.sample_truncated_prior(
+        torch.from_numpy(observation).type(torch.FloatTensor),
+        100,
+        truncation_quantile=0.1,
+        num_threshold_samples=200,
+        max_sampling_batch_size=1_000,
+    )
+    assert truncated_samples.shape == (100, 3) and 0 < acceptance_rate <= 1
+    assert within_prior_bounds(inferrer, truncated_samples.numpy())
+
+
+@pytest.fixture(scope="module")
+def trained_histogram_inferrer() -> HistogramInference:
+    # Small density estimator trained for a few hundred steps on double rho histograms
+    torch.manual_seed(7)
+    simulator = online_simulator()
+    simulator.simulate(num_simulations=500, num_reviews_per_simulation=np.full(500, 50), batch_size=100)
+    inferrer = HistogramInference()
+    inferrer.simulator = simulator
+    inferrer.simulator_type, inferrer.simulation_type = simulator.simulator_type, simulator.simulation_type
+    inferrer.set_default_parameter_prior()
+    parameters = inferrer.get_training_parameters()
+    simulations = torch.from_numpy(simulator.simulations).type(torch.FloatTensor)
+    trainer = DensityEstimatorTrainer(parameters, simulations, hidden_features=20, num_transforms=2)
+    for _ in range(300):
+        rows = torch.randint(len(parameters), (50,))
+        trainer.training_step(parameters[rows], simulations[rows])
+    inferrer.posterior = trainer.build_posterior(inferrer.parameter_prior, torch.Size([1, 5]))
+    return inferrer
+
+
+def test_batched_posterior_samples_match_per_observation_samples(trained_histogram_inferrer):
+    inferrer = trained_histogram_inferrer
+    observations = np.array([[10, 2, 5, 20, 40], [30, 5, 5, 5, 5], [1, 1, 10, 30, 8], [5, 10, 10, 10, 15]])
+    num_samples = 2_000
+    # Chunks of 2 observations, so that chunking is exercised too
+    batched_samples = inferrer.sample_posterior_batch(
+        torch.from_numpy(observations).type(torch.FloatTensor), num_samples, max_sampling_batch_size=2 * num_samples
+    )
+    assert batched_samples.shape == (num_samples, len(observations), 2)
+    assert within_prior_bounds(inferrer, batched_samples)
+    for (i, observation) in enumerate(observations):
+        samples = inferrer.posterior.sample(
+            (num_samples,), x=torch.from_numpy(observation[None, :]).type(torch.FloatTensor), show_progress_bars=False
+        ).numpy()
+        for parameter in range(samples.shape[1]):
+            p_value = stats.ks_2samp(batched_samples[:, i, parameter], samples[:, parameter]).pvalue
+            assert p_value > 0.001 / 8, f"Posterior samples of observation {i} differ, KS p-value {p_value}"
+    # Embeddings of repeated observations come from the cache
+    assert len(inferrer.embedding_cache) == len(observations)
@@ -0,0 +1,207 @@
+import pickle
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pytest
+import torch
+
+from snpe.simulations.event_writer import PYARROW_AVAILABLE, read_marketplace_events
+from snpe.simulations.marketplace_simulator_class import MarketplaceSimulator
+from snpe.simulations.shared_artifacts import (
+    SHARED_MEMORY_PATH,
+    create_shared_artifacts_dir,
+    remove_shared_artifacts_dir,
+)
+from snpe.simulations.simulation_store import SimulationStore
+from snpe.utils.statistics import review_histogram_means
+
+NUM_MARKETPLACES = 2
+NUM_PRODUCTS = 20
+
+
+def simulate_marketplaces(
+    artifact_path: Path,
+    num_marketplaces: int = NUM_MARKETPLACES,
+    num_workers: int = 1,
+    events_dirname: Optional[Path] = None,
+    events_file_format: str = "npy",
+    **params,
+) -> MarketplaceSimulator:
+    simulator = MarketplaceSimulator(
+        dict(
+            {
+                "review_prior": np.ones(5),
+                "tendency_to_rate": 0.05,
+                "simulation_type": "timeseries",
+                "seed": 7,
+                "previous_rating_measure": "mean",
+                "min_reviews_for_herding": 5,
+                "one_star_lowest_limit": -1.5,
+                "five_star_highest_limit": 1.5,
+                "max_bias_5_star": 0.5,
+                "num_products": NUM_PRODUCTS,
+                "num_total_marketplace_reviews": 300,
+                "consideration_set_size": 5,
+            },
+            **params,
+        )
+    )
+    simulator.simulate(
+        num_marketplaces,
+        embeddings_artifact_path=artifact_path,
+        num_workers=num_workers,
+        events_dirname=events_dirname,
+        events_file_format=events_file_format,
+    )
+    return simulator
+
+
+def same_simulations(simulator_1: MarketplaceSimulator, simulator_2: MarketplaceSimulator) -> bool:
+    return all(np.array_equal(a, b) for (a, b) in zip(simulator_1.simulations.ravel(), simulator_2.simulations.ravel()))
+
+
+@pytest.mark.parametrize("review_storage", ["timeseries", "event_log"])
+def test_running_average_ratings_match_review_histograms(marketplace_artifact_path, review_storage):
+    # In debug mode, the running average ratings used in visitor choices are checked against the means of the review
+    # histograms after every review, so this run fails if they ever diverge
+    debug_simulator = simulate_marketplaces(
+        marketplace_artifact_path, simulation_type="histogram", review_storage=review_storage, debug=True
+    )
+    simulator = simulate_marketplaces(
+        marketplace_artifact_path, simulation_type="histogram", review_storage=review_storage
+    )
+    assert np.array_equal(debug_simulator.simulations, simulator.simulations)
+    # Every marketplace starts with 1 review per star for all products, and runs until it has 300 more
+    assert np.all(np.sum(simulator.simulations, axis=(1, 2)) == 5 * NUM_PRODUCTS + 300)
+    histograms = simulator.simulations.reshape(-1, 5)
+    assert np.allclose(
+        review_histogram_means(histograms), np.sum(histograms * np.arange(1, 6), axis=1) / np.sum(histograms, axis=1)
+    )
+
+
+def test_marketplaces_are_scheduled_on_any_number_of_workers(monkeypatch, marketplace_artifact_path):
+    # The number of marketplaces doesn't need to match the number of workers or CPUs, and simulate never stops to ask
+    def no_input(*args):
+        raise AssertionError("simulate asked for input")
+
+    monkeypatch.setattr("builtins.input", no_input)
+    simulators = [simulate_marketplaces(marketplace_artifact_path, 3, num_workers) for num_workers in (1, 2)]
+    assert same_simulations(*simulators)
+    for (num_workers, simulator) in zip((1, 2), simulators):
+        assert simulator.simulations.shape[:2] == (3, NUM_PRODUCTS)
+        utilisation = simulator.worker_utilisation
+        assert 1 <= len(utilisation) <= num_workers
+        assert sum(report["num_marketplaces"] for report in utilisation.values()) == 3
+        assert all(0.0 < report["utilisation"] <= 1.0 for report in utilisation.values())
+
+
+def test_workers_attach_shared_artifacts(marketplace_artifact_path):
+    # simulate removes the shared artifacts of its run once it is done
+    shared_dirnames = set(SHARED_MEMORY_PATH.glob("snpe_shared_artifacts_*"))
+    simulator = simulate_marketplaces(marketplace_artifact_path, num_workers=2)
+    assert set(SHARED_MEMORY_PATH.glob("snpe_shared_artifacts_*")) == shared_dirnames
+    full_pickle = pickle.dumps(simulator)
+    # Share the artifacts of the simulator the same way simulate does for a pool of workers
+    dirname = create_shared_artifacts_dir()
+    try:
+        simulator.predict_marketplace_product_ratings(dirname / "marketplace_products", NUM_MARKETPLACES)
+        simulator.share_artifacts(dirname)
+        simulator.shared_artifacts_dirname = dirname
+        # The large artifacts are left out of the pickle sent to workers
+        worker_pickle = pickle.dumps(simulator)
+        assert len(worker_pickle) < len(full_pickle)
+        assert "simulation_parameters" not in simulator.__getstate__()
+        worker_simulator = pickle.loads(worker_pickle)
+        for (key, val) in simulator.simulation_parameters.items():
+            assert isinstance(worker_simulator.simulation_parameters[key], np.memmap)
+            assert np.array_equal(worker_simulator.simulation_parameters[key], val)
+        assert np.array_equal(worker_simulator.marketplace_product_embeddings, simulator.marketplace_product_embeddings)
+        assert np.array_equal(
+            worker_simulator.marketplace_pred_product_ratings, simulator.marketplace_pred_product_ratings
+        )
+        embeddings = np.random.default_rng(0).normal(size=(50, simulator.marketplace_product_embeddings.shape[-1]))
+        for model in ("product_model", "user_model"):
+            assert np.allclose(
+                getattr(worker_simulator.embedding_density_estimator, model).score_samples(embeddings),
+                getattr(simulator.embedding_density_estimator, model).score_samples(embeddings),
+            )
+        del worker_simulator
+    finally:
+        remove_shared_artifacts_dir(dirname)
+    assert not dirname.exists()
+
+
+@pytest.mark.parametrize("previous_rating_measure", ["mean", "mode of latest"])
+@pytest.mark.parametrize("simulation_type", ["timeseries", "histogram"])
+def test_event_log_matches_timeseries_review_storage(
+    tmp_path, marketplace_artifact_path, simulation_type, previous_rating_measure
+):
+    params = {"simulation_type": simulation_type, "previous_rating_measure": previous_rating_measure}
+    if previous_rating_measure == "mode of latest":
+        params["num_latest_reviews_for_herding"] = 3
+    simulators = {
+        review_storage: simulate_marketplaces(marketplace_artifact_path, review_storage=review_storage, **params)
+        for review_storage in ("timeseries", "event_log")
+    }
+    simulations = simulators["timeseries"].simulations
+    log_simulations = simulators["event_log"].simulations
+    if simulation_type == "histogram":
+        assert np.array_equal(log_simulations, simulations)
+        assert log_simulations.dtype == simulations.dtype
+        return
+    # Timeseries of the review log come as a simulation store, indexed by the flattened (marketplace, product) id
+    assert isinstance(log_simulations, SimulationStore)
+    assert len(log_simulations) == NUM_MARKETPLACES * NUM_PRODUCTS
+    assert np.array_equal(log_simulations[NUM_PRODUCTS + 7], simulations[1, 7])
+    assert log_simulations.to_array().shape == simulations.shape
+    assert all(np.array_equal(a, b) for (a, b) in zip(log_simulations.to_array().ravel(), simulations.ravel()))
+    # Both are saved to the same simulation store
+    for (review_storage, simulator) in simulators.items():
+        simulator.save_simulations(tmp_path / review_storage)
+    stores = [
+        SimulationStore(tmp_path / review_storage / "MarketplaceSimulator_timeseries").get_arrays()
+        for review_storage in simulators
+    ]
+    assert stores[0].keys() == stores[1].keys()
+    assert all(np.array_equal(stores[0][key], stores[1][key]) for key in stores[0])
+
+
+@pytest.mark.parametrize(
+    "events_file_format",
+    [
+        "npy",
+        pytest.param("parquet", marks=pytest.mark.skipif(not PYARROW_AVAILABLE, reason="pyarrow is not installed")),
+    ],
+)
+def test_visitor_events_replay_the_marketplaces(tmp_path, marketplace_artifact_path, events_file_format):
+    simulator = simulate_marketplaces(marketplace_artifact_path)
+    events_simulator = simulate_marketplaces(
+        marketplace_artifact_path, events_dirname=tmp_path, events_file_format=events_file_format
+    )
+    # Writing events doesn't change the simulations
+    assert same_simulations(simulator, events_simulator)
+    for marketplace_id in range(NUM_MARKETPLACES):
+        events = read_marketplace_events(tmp_path / f"marketplace_{marketplace_id:05d}")
+        assert np.array_equal(events["visitor_id"], np.arange(len(events["visitor_id"])))
+        assert np.all(np.any(events["consideration_set"] == events["chosen_product"][:, None], axis=1))
+        # Only visitors who left a rating can have been herded
+        rated = events["rating_index"] >= 0
+        assert np.sum(rated) == 300
+        assert not np.any(events["herded"][~rated])
+        # The ratings in the events rebuild the final review histograms of the marketplace
+        histograms = np.ones((NUM_PRODUCTS, 5), dtype=int)
+        np.add.at(histograms, (events["chosen_product"][rated], events["rating_index"][rated]), 1)
+        assert np.array_equal(
+            histograms, [timeseries[-1] for timeseries in events_simulator.simulations[marketplace_id]]
+        )
+
+
+def test_marketplace_rating_predictions_match_torch_model(marketplace_artifact_path):
+    simulator = simulate_marketplaces(marketplace_artifact_path)
+    embeddings, _ = simulator.embedding_density_estimator.product_model.sample(100)
+    model = simulator.embedding_rating_predictor.model.eval()
+    with torch.no_grad():
+        torch_pred = model(torch.from_numpy(embeddings).float()).numpy()
+    assert np.allclose(simulator.predict_ratings_from_embeddings(embeddings), torch_pred, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from snpe.simulations.parameter_schema import get_parameter_schema
+from snpe.simulations.simulator_class import HerdingSimulator
+
+NUM_SIMULATIONS = 10
+
+
+def test_unpack_returns_contiguous_float64_parameters():
+    schema = get_parameter_schema("rating_scale")
+    parameters = np.random.default_rng(7).uniform(
+        schema.low, schema.high, size=(NUM_SIMULATIONS, schema.num_parameters)
+    )
+    simulation_parameters = schema.unpack(parameters.astype(np.float32))
+    for val in simulation_parameters.values():
+        assert val.dtype == np.float64 and val.flags["C_CONTIGUOUS"]
+        assert val.shape[:2] == (1, NUM_SIMULATIONS)
+    assert np.allclose(schema.pack(simulation_parameters), parameters)
+
+
+def test_herding_simulates_from_unpacked_parameters():
+    # Parameters unpacked from the float32 training parameters of inference (as in sequential inference) are read as
+    # scalar Python floats by the herding simulators
+    simulator = HerdingSimulator(
+        dict(
+            HerdingSimulator.placeholder_params,
+            review_prior=np.ones(5),
+            tendency_to_rate=0.05,
+            simulation_type="histogram",
+            seed=7,
+        )
+    )
+    schema = get_parameter_schema(simulator.simulator_type)
+    parameters = np.random.default_rng(7).uniform(
+        schema.low, schema.high, size=(NUM_SIMULATIONS, schema.num_parameters)
+    )
+    simulator.simulate(
+        num_simulations=NUM_SIMULATIONS,
+        num_reviews_per_simulation=np.full(NUM_SIMULATIONS, 20),
+        simulation_parameters=schema.unpack(parameters.astype(np.float32)),
+    )
+    assert np.all(np.sum(simulator.simulations, axis=1) == 20)
@@ -0,0 +1,55 @@
+import os
+import pickle
+
+from threading import Event, Thread
+
+import numpy as np
+
+from joblib import Parallel, delayed
+from snpe.utils.tqdm_utils import SharedProgressCounters, shared_progress_monitor
+
+NUM_TASKS = 4
+
+
+def run_task(progress: SharedProgressCounters, task_id: int) -> int:
+    progress.start(task_id)
+    for step in range(1, 101):
+        progress.update(task_id, step)
+    progress.update(task_id, 100, force=True)
+    return os.getpid()
+
+
+def test_updates_are_throttled(tmp_path):
+    progress = SharedProgressCounters(tmp_path / "progress.bin", NUM_TASKS, create=True, min_update_interval=60.0)
+    progress.start(1)
+    assert progress.counters[1, 1] == os.getpid()
+    progress.update(1, 5)
+    progress.update(1, 6)
+    assert progress.counters[0, 1] == 5
+    progress.update(1, 7, force=True)
+    assert np.array_equal(progress.counters[0], [0, 7, 0, 0])
+
+
+def test_workers_publish_progress_to_the_shared_counters(tmp_path):
+    progress = SharedProgressCounters(tmp_path / "progress.bin", NUM_TASKS, create=True)
+    # Only the location of the counters is pickled, and unpickled copies write to the same file
+    assert len(pickle.dumps(progress)) < 1_000
+    pickle.loads(pickle.dumps(progress)).update(0, 3)
+    assert progress.counters[0, 0] == 3
+    pids = Parallel(n_jobs=2)(delayed(run_task)(progress, task_id) for task_id in range(NUM_TASKS))
+    assert np.array_equal(progress.counters[0], np.full(NUM_TASKS, 100))
+    assert np.array_equal(progress.counters[1], pids)
+
+
+def test_monitor_stops_when_asked(tmp_path):
+    progress = SharedProgressCounters(tmp_path / "progress.bin", NUM_TASKS, create=True)
+    stop = Event()
+    monitor = Thread(
+        target=shared_progress_monitor, args=(progress, 100 * NUM_TASKS, stop), kwargs={"refresh_interval": 0.01}
+    )
+    monitor.start()
+    for task_id in range(NUM_TASKS):
+        run_task(progress, task_id)
+    stop.set()
+    monitor.join(timeout=10)
+    assert not monitor.is_alive()
@@ -0,0 +1,56 @@
+from collections import deque
+
+import numpy as np
+import pytest
+
+from snpe.simulations.review_timeseries import ReviewTimeseries, timeseries_to_object_array
+
+NUM_RATINGS = 200
+
+
+def test_timeseries_matches_deque_of_histograms():
+    # The buffer starts with capacity 4, so it has to grow several times
+    rating_indices = np.random.default_rng(7).integers(5, size=NUM_RATINGS)
+    timeseries = ReviewTimeseries(capacity=4)
+    histograms = deque([np.ones(5, dtype=int)])
+    for rating_index in rating_indices:
+        timeseries.append_rating(rating_index)
+        histogram = histograms[-1].copy()
+        histogram[rating_index] += 1
+        histograms.append(histogram)
+        assert len(timeseries) == len(histograms)
+        assert np.array_equal(timeseries[-1], histograms[-1])
+    assert np.array_equal(timeseries.to_array(), np.array(histograms))
+    assert np.array_equal(np.asarray(timeseries), np.array(histograms))
+    for index in (0, 17, -1, -6, -len(histograms)):
+        assert np.array_equal(timeseries[index], histograms[index])
+    with pytest.raises(IndexError):
+        timeseries[len(histograms)]
+    assert timeseries.num_reviews == NUM_RATINGS
+    assert timeseries.to_array().dtype == np.int32
+
+
+def test_timeseries_from_rating_indices_matches_appends():
+    rating_indices = np.random.default_rng(7).integers(5, size=NUM_RATINGS)
+    initial_timeseries = np.array([[1, 1, 1, 1, 1], [1, 2, 1, 1, 1]])
+    timeseries = ReviewTimeseries(initial_timeseries[0])
+    timeseries.append_histogram(initial_timeseries[1])
+    for rating_index in rating_indices:
+        timeseries.append_rating(rating_index)
+    built_timeseries = ReviewTimeseries.from_rating_indices(initial_timeseries, rating_indices)
+    assert np.array_equal(built_timeseries.to_array(), timeseries.to_array())
+
+
+def test_histograms_need_to_add_a_single_rating():
+    timeseries = ReviewTimeseries()
+    with pytest.raises(AssertionError):
+        timeseries.append_histogram(np.array([1, 1, 1, 2, 2]))
+    with pytest.raises(AssertionError):
+        timeseries.append_histogram(np.array([0, 1, 1, 1, 3]))
+
+
+def test_object_array_keeps_timeseries_of_equal_length_apart():
+    timeseries = [np.ones((3, 5), dtype=np.int32), 2 * np.ones((3, 5), dtype=np.int32)]
+    object_array = timeseries_to_object_array(timeseries)
+    assert object_array.shape == (2,) and object_array.dtype == object
+    assert np.array_equal(object_array[1], timeseries[1])
@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pytest
+
+from snpe.simulations.simulator_class import DoubleRhoSimulator
+
+PARAMS = {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": "histogram", "seed": 7}
+NUM_SIMULATIONS = 6
+SHARD_SIZE = 3
+
+
+def interrupt_after_first_shard(run_dirname):
+    # Makes the run look as if it was interrupted after its first shard was written
+    manifest_path = run_dirname / "manifest.json"
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    manifest["completed_shards"] = [0]
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+
+@pytest.fixture
+def interrupted_run(tmp_path):
+    simulator = DoubleRhoSimulator(dict(PARAMS))
+    num_reviews_per_simulation = np.full(NUM_SIMULATIONS, 50)
+    simulator.simulate_sharded(
+        tmp_path, NUM_SIMULATIONS, SHARD_SIZE, num_reviews_per_simulation=num_reviews_per_simulation, batch_size=3
+    )
+    simulator.load_simulator(tmp_path)
+    interrupt_after_first_shard(tmp_path / "DoubleRhoSimulator_histogram_run")
+    return tmp_path, simulator.simulations, num_reviews_per_simulation
+
+
+def test_resumed_run_matches_uninterrupted_run(interrupted_run):
+    dirname, simulations, num_reviews_per_simulation = interrupted_run
+    simulator = DoubleRhoSimulator(dict(PARAMS))
+    simulator.simulate_sharded(
+        dirname, NUM_SIMULATIONS, SHARD_SIZE, num_reviews_per_simulation=num_reviews_per_simulation, batch_size=3
+    )
+    simulator.load_simulator(dirname)
+    assert np.array_equal(simulator.simulations, simulations)
+
+
+@pytest.mark.parametrize(
+    "resume_kwargs",
+    [
+        {"batch_size": 2},
+        {"batch_size": None},
+        {"batch_size": 3, "shard_size": 2},
+        {"batch_size": 3, "num_simulations": 8},
+        {"batch_size": 3, "num_reviews_per_simulation": np.full(NUM_SIMULATIONS, 60)},
+    ],
+)
+def test_resume_with_different_arguments_fails(interrupted_run, resume_kwargs):
+    dirname, _, _ = interrupted_run
+    kwargs = dict({"num_simulations": NUM_SIMULATIONS, "shard_size": SHARD_SIZE}, **resume_kwargs)
+    simulator = DoubleRhoSimulator(dict(PARAMS))
+    with pytest.raises(AssertionError):
+        simulator.simulate_sharded(dirname, **kwargs)
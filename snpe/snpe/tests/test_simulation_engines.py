@@ -0,0 +1,151 @@
+import numpy as np
+import pytest
+
+from scipy import stats
+from snpe.simulations import compiled_kernels
+from snpe.simulations.simulator_class import DoubleRhoSimulator, RatingScaleSimulator, SingleRhoSimulator
+from snpe.utils.functions import check_simulation_parameters
+
+# The simulation engines draw their random variates differently, so they can't be compared simulation by simulation.
+# Instead, all products get the same parameters and number of reviews, and the per-product fractions of every rating
+# from the two engines are compared with two sample KS tests (Bonferroni corrected over the 5 ratings)
+NUM_PRODUCTS = 200
+NUM_REVIEWS = 100
+SIGNIFICANCE = 0.001 / 5
+
+BASE_PARAMS = {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": "histogram"}
+RATING_SCALE_PARAMS = dict(
+    BASE_PARAMS,
+    previous_rating_measure="mean",
+    min_reviews_for_herding=5,
+    one_star_lowest_limit=-3.5,
+    five_star_highest_limit=1.5,
+    max_bias_5_star=0.2,
+)
+RATING_SCALE_SIMULATION_PARAMETERS = {
+    "rho": np.tile(np.array([1.0, 0.25]), (1, NUM_PRODUCTS, 1)),
+    "h_p": np.full((1, NUM_PRODUCTS), 0.5),
+    "p_1": np.full((1, NUM_PRODUCTS), 0.75),
+    "p_2": np.full((1, NUM_PRODUCTS), 0.5),
+    "p_4": np.full((1, NUM_PRODUCTS), 0.5),
+    "p_5": np.full((1, NUM_PRODUCTS), 0.75),
+    "bias_5_star": np.full((1, NUM_PRODUCTS), 0.5),
+}
+
+
+def rating_fractions(simulations: np.ndarray) -> np.ndarray:
+    return simulations / np.sum(simulations, axis=1, keepdims=True)
+
+
+def assert_same_rating_distributions(simulations_1: np.ndarray, simulations_2: np.ndarray) -> None:
+    fractions_1, fractions_2 = rating_fractions(simulations_1), rating_fractions(simulations_2)
+    for rating in range(5):
+        p_value = stats.ks_2samp(fractions_1[:, rating], fractions_2[:, rating]).pvalue
+        assert p_value > SIGNIFICANCE, f"Distributions of {rating + 1} star fractions differ, KS p-value {p_value}"
+
+
+@pytest.mark.parametrize(
+    "simulator_class, simulation_parameters",
+    [
+        (SingleRhoSimulator, {"rho": np.full((1, NUM_PRODUCTS), 0.5)}),
+        (DoubleRhoSimulator, {"rho": np.tile(np.array([1.0, 0.25]), (1, NUM_PRODUCTS, 1))}),
+    ],
+)
+def test_batched_engine_matches_per_product_engine(simulator_class, simulation_parameters):
+    num_reviews_per_simulation = np.full(NUM_PRODUCTS, NUM_REVIEWS)
+    simulations = {}
+    for batch_size in (None, 50):
+        simulator = simulator_class(dict(BASE_PARAMS, seed=7))
+        simulator.simulate(
+            NUM_PRODUCTS,
+            num_reviews_per_simulation=num_reviews_per_simulation,
+            simulation_parameters=simulation_parameters,
+            batch_size=batch_size,
+        )
+        assert simulator.simulations.shape == (NUM_PRODUCTS, 5)
+        assert np.all(np.sum(simulator.simulations, axis=1) == NUM_REVIEWS)
+        simulations[batch_size] = simulator.simulations
+    assert_same_rating_distributions(simulations[None], simulations[50])
+
+
+def test_compiled_engine_matches_per_product_engine():
+    simulations = {}
+    for compiled in (False, True):
+        simulator = RatingScaleSimulator(dict(RATING_SCALE_PARAMS, seed=7))
+        simulator.simulate(
+            NUM_PRODUCTS,
+            num_reviews_per_simulation=np.full(NUM_PRODUCTS, NUM_REVIEWS),
+            simulation_parameters=RATING_SCALE_SIMULATION_PARAMETERS,
+            compiled=compiled,
+        )
+        assert np.all(np.sum(simulator.simulations, axis=1) == NUM_REVIEWS)
+        simulations[compiled] = simulator.simulations
+    assert_same_rating_distributions(simulations[False], simulations[True])
+
+
+def test_compiled_engine_leaves_global_random_state_alone(monkeypatch):
+    # Also covers the plain Python fallback of the kernel, which is what runs when numba is not installed
+    if compiled_kernels.NUMBA_AVAILABLE:
+        monkeypatch.setattr(
+            "snpe.simulations.simulator_class.rating_scale_review_kernel",
+            compiled_kernels.rating_scale_review_kernel.py_func,
+        )
+        monkeypatch.setattr(compiled_kernels, "dist_sample_index", compiled_kernels.dist_sample_index.py_func)
+    np.random.seed(0)
+    expected_draw = np.random.random()
+    np.random.seed(0)
+    simulator = RatingScaleSimulator(dict(RATING_SCALE_PARAMS, seed=7))
+    # The product is simulated in this process, as joblib workers would have random states of their own
+    simulator.prepare_simulations(NUM_PRODUCTS, simulation_parameters=RATING_SCALE_SIMULATION_PARAMETERS)
+    simulator.simulate_review_histogram_compiled(0, num_reviews_per_simulation=np.full(NUM_PRODUCTS, 20))
+    assert np.random.random() == expected_draw
+
+
+def test_compiled_and_batched_engines_are_exclusive():
+    simulator = RatingScaleSimulator(dict(RATING_SCALE_PARAMS, seed=7))
+    with pytest.raises(AssertionError):
+        simulator.simulate(2, compiled=True, batch_size=2)
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_point_parameters_match_tiled_parameters(compiled):
+    # Point parameters are stored once, with a single distribution sample, and broadcast against the distribution
+    # samples of distributional parameters. Simulations need to follow the same distribution as with the point
+    # parameters tiled to num_dist_samples identical copies, as they were stored before
+    num_dist_samples = 10
+    rng = np.random.default_rng(0)
+    simulation_parameters = dict(
+        RATING_SCALE_SIMULATION_PARAMETERS, rho=rng.uniform(0.0, 2.0, size=(num_dist_samples, NUM_PRODUCTS, 2))
+    )
+    tiled_simulation_parameters = {
+        key: np.repeat(val, num_dist_samples // val.shape[0], axis=0) for (key, val) in simulation_parameters.items()
+    }
+    assert check_simulation_parameters(simulation_parameters, NUM_PRODUCTS) == num_dist_samples
+    simulations = []
+    for parameters in (simulation_parameters, tiled_simulation_parameters):
+        simulator = RatingScaleSimulator(dict(RATING_SCALE_PARAMS, seed=7))
+        simulator.simulate(
+            NUM_PRODUCTS,
+            num_reviews_per_simulation=np.full(NUM_PRODUCTS, NUM_REVIEWS),
+            simulation_parameters=parameters,
+            compiled=compiled,
+        )
+        assert np.all(np.sum(simulator.simulations, axis=1) == NUM_REVIEWS)
+        simulations.append(simulator.simulations)
+    assert_same_rating_distributions(*simulations)
+
+
+def test_point_parameters_are_read_without_drawing():
+    simulator = RatingScaleSimulator(dict(RATING_SCALE_PARAMS, seed=7))
+    simulator.prepare_simulations(NUM_PRODUCTS, simulation_parameters=RATING_SCALE_SIMULATION_PARAMETERS)
+    state = simulator.rng.bit_generator.state
+    assert simulator.yield_simulation_param_per_visitor(3, "h_p") == 0.5
+    assert np.array_equal(simulator.yield_simulation_param_per_visitor(3, "rho"), [1.0, 0.25])
+    assert simulator.rng.bit_generator.state == state
+
+
+def test_distribution_samples_need_to_match_or_broadcast():
+    simulation_parameters = {"rho": np.ones((10, NUM_PRODUCTS, 2)), "h_p": np.ones((1, NUM_PRODUCTS))}
+    assert check_simulation_parameters(simulation_parameters, NUM_PRODUCTS) == 10
+    with pytest.raises(AssertionError):
+        check_simulation_parameters(dict(simulation_parameters, h_p=np.ones((3, NUM_PRODUCTS))), NUM_PRODUCTS)
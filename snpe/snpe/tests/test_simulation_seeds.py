@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from snpe.simulations import simulator_class
+from snpe.simulations.simulator_class import DoubleRhoSimulator
+
+NUM_SIMULATIONS = 12
+NUM_REVIEWS_PER_SIMULATION = np.full(NUM_SIMULATIONS, 30)
+
+
+def simulate(seed, **kwargs) -> DoubleRhoSimulator:
+    simulator = DoubleRhoSimulator(
+        {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": "timeseries", "seed": seed}
+    )
+    simulator.simulate(NUM_SIMULATIONS, num_reviews_per_simulation=NUM_REVIEWS_PER_SIMULATION, **kwargs)
+    return simulator
+
+
+def same_simulations(simulator_1: DoubleRhoSimulator, simulator_2: DoubleRhoSimulator) -> bool:
+    return all(np.array_equal(a, b) for (a, b) in zip(simulator_1.simulations, simulator_2.simulations))
+
+
+@pytest.mark.parametrize("batch_size", [None, 4])
+def test_simulations_do_not_depend_on_the_number_of_workers(monkeypatch, batch_size):
+    simulators = []
+    for num_workers in (1, 3):
+        monkeypatch.setattr(simulator_class.mp, "cpu_count", lambda: num_workers)
+        simulators.append(simulate(7, batch_size=batch_size))
+    assert np.array_equal(simulators[0].simulation_parameters["rho"], simulators[1].simulation_parameters["rho"])
+    assert same_simulations(*simulators)
+
+
+def test_every_simulation_can_be_regenerated_alone():
+    simulator = simulate(7)
+    for simulation_id in (0, 5, NUM_SIMULATIONS - 1):
+        timeseries = simulator.simulate_review_histogram(simulation_id, NUM_REVIEWS_PER_SIMULATION)
+        assert np.array_equal(timeseries, simulator.simulations[simulation_id])
+
+
+def test_seeds_give_reproducible_and_distinct_runs():
+    assert same_simulations(simulate(7), simulate(7))
+    assert not same_simulations(simulate(7), simulate(8))
+    # Without a seed, every run draws fresh entropy and saves it, so that it can be repeated
+    simulator = simulate(None)
+    repeated_simulator = simulate(simulator.simulation_seed)
+    assert same_simulations(simulator, repeated_simulator)
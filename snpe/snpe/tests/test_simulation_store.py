@@ -0,0 +1,54 @@
+import json
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from snpe.inference.inference_class import HistogramInference
+from snpe.simulations.simulation_store import SimulationStore, write_simulation_store
+from snpe.simulations.simulator_class import RatingScaleSimulator
+
+NUM_MARKETPLACES = 2
+NUM_PRODUCTS = 3
+
+
+def store_metadata(simulator: str, params: dict) -> dict:
+    return {
+        "simulator": simulator,
+        "simulation_type": "histogram",
+        "simulation_seed": 1,
+        "tendency_to_rate": 0.05,
+        "review_prior": np.ones(5),
+        "params": params,
+    }
+
+
+def test_metadata_with_non_numpy_values(tmp_path):
+    params = {"artifact_path": Path("/artifacts"), "limits": np.arange(2), "num_products": np.int64(3)}
+    write_simulation_store(
+        tmp_path / "store",
+        np.ones((3, 5), dtype=int),
+        {"rho": np.ones((1, 3))},
+        store_metadata("SingleRhoSimulator", params),
+    )
+    with open(tmp_path / "store" / "metadata.json", "r") as f:
+        metadata = json.load(f)
+    assert metadata["params"] == {"artifact_path": "/artifacts", "limits": [0, 1], "num_products": 3}
+    assert SimulationStore(tmp_path / "store").metadata["review_prior"] == [1.0] * 5
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_marketplace_histograms_are_flattened_for_inference(tmp_path, lazy):
+    num_simulations = NUM_MARKETPLACES * NUM_PRODUCTS
+    simulations = np.arange(num_simulations * 5).reshape(NUM_MARKETPLACES, NUM_PRODUCTS, 5)
+    write_simulation_store(
+        tmp_path / "MarketplaceSimulator_histogram",
+        simulations,
+        RatingScaleSimulator.generate_simulation_parameters(num_simulations, np.random.default_rng(0)),
+        store_metadata("MarketplaceSimulator", {}),
+    )
+    inferrer = HistogramInference(None)
+    inferrer.load_simulator(tmp_path, "marketplace", "histogram", lazy=lazy)
+    assert np.array_equal(np.asarray(inferrer.simulator.simulations, dtype=int), simulations.reshape(-1, 5))
+    assert len(inferrer.get_training_parameters()) == num_simulations
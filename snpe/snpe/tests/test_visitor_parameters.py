@@ -0,0 +1,41 @@
+import numpy as np
+
+from scipy.stats import chisquare
+from snpe.simulations.visitor_parameters import VisitorParameterSamples
+
+NUM_PRODUCTS = 100_000
+NUM_DIST_SAMPLES = 4
+
+
+def visitor_parameter_samples(num_products: int) -> VisitorParameterSamples:
+    # Distribution sample i of every product has the value i for h_p, so draws can be counted per distribution sample.
+    # tendency_to_rate is a point parameter
+    simulation_parameters = {
+        "h_p": np.repeat(np.arange(NUM_DIST_SAMPLES, dtype=float)[:, None], num_products, axis=1),
+        "tendency_to_rate": np.arange(num_products, dtype=float)[None, :],
+    }
+    return VisitorParameterSamples(simulation_parameters, 0, num_products, np.random.default_rng(7), block_size=64)
+
+
+def test_blocks_follow_the_visitors_of_products():
+    samples = visitor_parameter_samples(NUM_PRODUCTS)
+    num_visitors = {3: 1, 500: 20, 99_999: 1_000}
+    for (simulation_id, visitors) in num_visitors.items():
+        for _ in range(visitors):
+            samples.next_visitor(simulation_id)
+            assert samples.get(simulation_id, "tendency_to_rate") == simulation_id
+    # Only products with visitors get a block, which grows with the number of their visitors up to block_size
+    assert set(samples.blocks) == set(num_visitors)
+    assert len(samples.blocks[3]["h_p"]) == 16
+    assert len(samples.blocks[500]["h_p"]) == 32
+    assert len(samples.blocks[99_999]["h_p"]) == 64
+
+
+def test_visitors_draw_distribution_samples_uniformly():
+    samples = visitor_parameter_samples(2)
+    draws = []
+    for _ in range(5_000):
+        samples.next_visitor(1)
+        draws.append(samples.get(1, "h_p"))
+    counts = np.bincount(np.array(draws, dtype=int), minlength=NUM_DIST_SAMPLES)
+    assert chisquare(counts).pvalue > 0.001
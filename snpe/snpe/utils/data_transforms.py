@@ -1,6 +1,10 @@
+from typing import List, Optional, Tuple, Union
+
 import numpy as np
 import torch
 
+from snpe.simulations.simulation_store import SimulationStore
+
 
 def pad_timeseries_for_cnn(simulations: np.ndarray, device: str) -> torch.Tensor:
     # Time series data comes in as np array of type object
@@ -24,3 +28,143 @@ def pad_timeseries_for_cnn(simulations: np.ndarray, device: str) -> torch.Tensor
     padded_simulations = padded_simulations.permute(0, 2, 1)
 
     return padded_simulations
+
+
+def get_timeseries_lengths(simulations: Union[np.ndarray, SimulationStore]) -> np.ndarray:
+    # Number of histograms in every review timeseries. Simulation stores keep these lengths in their offsets, so they
+    # don't need to rebuild any timeseries to get them
+    if isinstance(simulations, SimulationStore):
+        return simulations.lengths
+    return np.array([len(simulation) for simulation in simulations], dtype=np.int64)
+
+
+def get_timeseries_checkpoints(length: int, num_checkpoints: int, spacing: str = "linear") -> np.ndarray:
+    # Indices of num_checkpoints histograms picked from a timeseries of the given length, always including the first
+    # and the last histogram. With log spacing, checkpoints are dense early on in the timeseries (where every review
+    # changes the histogram a lot) and sparse later. Short timeseries repeat histograms to reach num_checkpoints
+    assert spacing in ("linear", "log"), f"Checkpoint spacing can be linear or log, found {spacing} instead"
+    if spacing == "linear":
+        checkpoints = np.linspace(0, length - 1, num_checkpoints)
+    else:
+        checkpoints = np.geomspace(1, length, num_checkpoints) - 1
+    return np.round(checkpoints).astype(np.int64)
+
+
+def resample_timeseries(simulation: np.ndarray, num_checkpoints: int, spacing: str = "linear") -> np.ndarray:
+    # Fixed length version of a review timeseries of any length, made up of the histograms at num_checkpoints evenly
+    # (or log) spaced positions in the timeseries. This replaces padding to the length of the longest timeseries
+    return np.asarray(simulation)[get_timeseries_checkpoints(len(simulation), num_checkpoints, spacing)]
+
+
+def pad_timeseries_batch(
+    simulations: Union[np.ndarray, SimulationStore],
+    simulation_ids: np.ndarray,
+    padded_length: Optional[int] = None,
+    num_checkpoints: Optional[int] = None,
+    checkpoint_spacing: str = "linear",
+) -> torch.Tensor:
+    # Pads only the timeseries of the selected simulation ids, to a fixed length, in the same way as
+    # pad_timeseries_for_cnn (repeating the last histogram of each timeseries). Returns a float tensor of shape
+    # (batch X 5 X padded_length), ready for the 1D CNN
+    # If padded_length is None, timeseries are padded to the longest one in the batch. If num_checkpoints is given,
+    # timeseries are resampled to num_checkpoints histograms instead of being padded
+    batch_simulations = simulations[np.asarray(simulation_ids)]
+    if num_checkpoints is not None:
+        padded_simulations = np.stack(
+            [resample_timeseries(simulation, num_checkpoints, checkpoint_spacing) for simulation in batch_simulations]
+        ).astype(np.float32)
+        return torch.from_numpy(padded_simulations).permute(0, 2, 1)
+    if padded_length is None:
+        padded_length = max(len(simulation) for simulation in batch_simulations)
+    padded_simulations = np.empty((len(simulation_ids), padded_length, 5), dtype=np.float32)
+    for i, simulation in enumerate(batch_simulations):
+        assert (
+            len(simulation) <= padded_length
+        ), f"Found timeseries of length {len(simulation)}, longer than the padded length {padded_length}"
+        padded_simulations[i, : len(simulation), :] = simulation
+        padded_simulations[i, len(simulation) :, :] = simulation[-1]
+    return torch.from_numpy(padded_simulations).permute(0, 2, 1)
+
+
+class PaddedTimeseriesDataset(torch.utils.data.Dataset):
+    # Dataset of (parameters, padded timeseries) pairs that pads timeseries only when a minibatch is requested,
+    # instead of padding all the simulations up front like pad_timeseries_for_cnn. Memory then scales with the batch
+    # size and not with the number of simulations. Simulations can be the ragged object array of timeseries or a
+    # lazily loaded SimulationStore, in which case timeseries are also only read from disk per minibatch
+    # The dataset is indexed with a whole list of simulation ids at a time, so use it with a batch sampler and
+    # batch_size=None in the DataLoader, e.g, DataLoader(dataset, sampler=BatchSampler(...), batch_size=None)
+    # Timeseries are padded to the longest timeseries overall by default. With pad_per_batch=True, they are padded
+    # to the longest one in each minibatch instead (use with LengthBucketBatchSampler), and with num_checkpoints
+    # they are resampled to a fixed length (see resample_timeseries)
+    def __init__(
+        self,
+        simulations: Union[np.ndarray, SimulationStore],
+        parameters: torch.Tensor,
+        padded_length: Optional[int] = None,
+        pad_per_batch: bool = False,
+        num_checkpoints: Optional[int] = None,
+        checkpoint_spacing: str = "linear",
+    ):
+        assert len(simulations) == len(
+            parameters
+        ), f"Found {len(simulations)} simulations but parameters for {len(parameters)} simulations"
+        assert not (
+            pad_per_batch and num_checkpoints is not None
+        ), "Timeseries can either be padded per batch or resampled to num_checkpoints, not both"
+        self.simulations = simulations
+        self.parameters = parameters
+        self.lengths = get_timeseries_lengths(simulations)
+        self.pad_per_batch = pad_per_batch
+        self.num_checkpoints = num_checkpoints
+        self.checkpoint_spacing = checkpoint_spacing
+        # Pad to the longest timeseries by default, as pad_timeseries_for_cnn does
+        if num_checkpoints is not None:
+            self.padded_length = int(num_checkpoints)
+        else:
+            self.padded_length = int(np.max(self.lengths)) if padded_length is None else int(padded_length)
+
+    def __len__(self) -> int:
+        return len(self.parameters)
+
+    def __getitem__(self, simulation_ids: List[int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        simulation_ids = np.asarray(simulation_ids)
+        return self.parameters[simulation_ids], pad_timeseries_batch(
+            self.simulations,
+            simulation_ids,
+            None if self.pad_per_batch else self.padded_length,
+            self.num_checkpoints,
+            self.checkpoint_spacing,
+        )
+
+
+class LengthBucketBatchSampler(torch.utils.data.Sampler):
+    # Batch sampler that groups timeseries of similar lengths into the same minibatch, so that padding each minibatch
+    # to its own longest timeseries wastes little work on padding. Simulation ids are sorted by length and split into
+    # num_buckets buckets of (roughly) equal size. Every epoch, ids are shuffled within each bucket, cut into
+    # minibatches, and the minibatches of all buckets are shuffled together
+    def __init__(
+        self, lengths: np.ndarray, indices: List[int], batch_size: int, num_buckets: int = 10, drop_last: bool = True
+    ):
+        self.indices = np.asarray(indices)
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        sorted_indices = self.indices[np.argsort(np.asarray(lengths)[self.indices], kind="stable")]
+        # Every bucket needs at least batch_size ids, otherwise it would not produce any full minibatch
+        num_buckets = max(min(num_buckets, len(self.indices) // batch_size), 1)
+        self.buckets = [bucket for bucket in np.array_split(sorted_indices, num_buckets) if len(bucket) > 0]
+
+    def __iter__(self):
+        batches = []
+        for bucket in self.buckets:
+            bucket = np.random.permutation(bucket)
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start : start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch.tolist())
+        for batch_index in np.random.permutation(len(batches)):
+            yield batches[batch_index]
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return int(np.sum([len(bucket) // self.batch_size for bucket in self.buckets]))
+        return int(np.sum([int(np.ceil(len(bucket) / self.batch_size)) for bucket in self.buckets]))
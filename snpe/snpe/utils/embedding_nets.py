@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 import numpy as np
 import torch
 
@@ -9,11 +11,17 @@ def get_cnn_1d(
     conv_kernel_size: int = 5,
     maxpool_kernel_size: int = 5,
     num_dense_layers: int = 3,
+    pooled_length: Optional[int] = None,
 ) -> torch.nn.Module:
     # Get the input dimensionality of the first linear layer in the model
     # Depends on whether conv_kernel_size is odd or even
     # https://discuss.pytorch.org/t/how-can-i-ensure-that-my-conv1d-retains-the-same-shape-with-unknown-sequence-lengths/73647/8
-    linear_input_dim = ((x.size()[-1] - ((conv_kernel_size + 1) % 2)) // maxpool_kernel_size) * num_channels
+    # If pooled_length is given, max pooling is adaptive and always pools down to pooled_length, so that the CNN
+    # accepts timeseries of any length (as needed when every minibatch is padded to a different length)
+    if pooled_length is None:
+        linear_input_dim = ((x.size()[-1] - ((conv_kernel_size + 1) % 2)) // maxpool_kernel_size) * num_channels
+    else:
+        linear_input_dim = pooled_length * num_channels
 
     # Build the modules that will make up the embedding CNN
     # https://discuss.pytorch.org/t/append-for-nn-sequential-or-directly-converting-nn-modulelist-to-nn-sequential/7104/4
@@ -39,7 +47,10 @@ def get_cnn_1d(
                 dilation=2 ** layer,
             )
         )
-    cnn_modules.append(torch.nn.MaxPool1d(kernel_size=maxpool_kernel_size))
+    if pooled_length is None:
+        cnn_modules.append(torch.nn.MaxPool1d(kernel_size=maxpool_kernel_size))
+    else:
+        cnn_modules.append(torch.nn.AdaptiveMaxPool1d(output_size=pooled_length))
     # We put non-linearity after Max Pooling and Flattening the last layer as ReLU and MaxPooling commute
     # i.e, their MaxPool(Relu) = Relu(MaxPool) - the RHS is faster as MaxPool has reduced dimensions
     # https://stackoverflow.com/questions/35543428/activation-function-after-pooling-layer-or-convolutional-layer
@@ -91,3 +102,63 @@ class RatingPredictorModel(torch.nn.Module):
         if not self.predict_fractions:
             y_pred = torch.exp(y_pred)
         return y_pred
+
+
+class NumpyRatingPredictor:
+    # Pure NumPy forward pass of a trained RatingPredictorModel, for predicting the ratings of products from their
+    # embeddings during marketplace simulations without any torch overhead (eval mode, tensor conversions, torch
+    # thread pools). The weights and biases of the linear layers of fc_rating_predictor are copied out as float32 arrays
+    # and the forward pass is run in float32 too, same as the torch model
+    def __init__(
+        self,
+        weights: List[np.ndarray],
+        biases: List[np.ndarray],
+        predict_fractions: bool = False,
+        negative_slope: float = 0.01,
+    ):
+        assert 0 < negative_slope < 1, f"Expected the negative slope of LeakyReLU to be in (0, 1), got {negative_slope}"
+        assert len(weights) == len(
+            biases
+        ), f"Found {len(weights)} weight matrices but {len(biases)} bias vectors for the linear layers"
+        self.weights = [np.ascontiguousarray(weight.T, dtype=np.float32) for weight in weights]
+        self.biases = [np.asarray(bias, dtype=np.float32) for bias in biases]
+        self.predict_fractions = predict_fractions
+        self.negative_slope = negative_slope
+
+    @classmethod
+    def from_model(cls, model: RatingPredictorModel) -> "NumpyRatingPredictor":
+        weights, biases = [], []
+        negative_slope = 0.01
+        for module in model.net:
+            if isinstance(module, torch.nn.Linear):
+                weights.append(module.weight.detach().cpu().numpy())
+                biases.append(module.bias.detach().cpu().numpy())
+            elif isinstance(module, torch.nn.LeakyReLU):
+                negative_slope = module.negative_slope
+            else:
+                assert isinstance(
+                    module, torch.nn.LogSoftmax
+                ), f"Cannot export layer {module} of the rating predictor network to NumPy"
+        return cls(weights, biases, predict_fractions=model.predict_fractions, negative_slope=negative_slope)
+
+    def __call__(self, x: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        # Rows of x are pushed through the network in batches of batch_size, to bound the memory used by the hidden
+        # activations when the products of many marketplaces are predicted together
+        x = np.asarray(x)
+        y_pred = np.empty((x.shape[0], self.biases[-1].shape[0]), dtype=np.float32)
+        for start in range(0, x.shape[0], batch_size):
+            h = x[start : start + batch_size].astype(np.float32)
+            for (layer, (weight, bias)) in enumerate(zip(self.weights, self.biases)):
+                if layer > 0:
+                    # LeakyReLU, as max(h, negative_slope * h) for 0 < negative_slope < 1
+                    np.maximum(h, h * np.float32(self.negative_slope), out=h)
+                h = h @ weight
+                h += bias
+            if self.predict_fractions:
+                # LogSoftmax over the 5 outputs, shifted by the max to guard against overflow
+                h -= np.max(h, axis=1, keepdims=True)
+                h -= np.log(np.sum(np.exp(h), axis=1, keepdims=True))
+            else:
+                np.exp(h, out=h)
+            y_pred[start : start + batch_size] = h
+        return y_pred
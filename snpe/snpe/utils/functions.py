@@ -1,7 +1,11 @@
 import copy
+import json
+import os
+import pickle
 import subprocess
 
-from typing import List
+from pathlib import Path
+from typing import Any, List
 
 import numpy as np
 import torch
@@ -47,6 +51,8 @@ def nn_converged(epoch: int, stop_after_epochs: int, validation_loss: torch.Tens
 # A utility function to check that all the params in the dict of simulation parameters are arrays of the right shape
 # For each simulation id, we have a distribution for each simulation parameter
 # So the shape of the simulation parameter arrays should be (num_dist_samples X num_simulations X parameter dims)
+# Point parameters (such as the ones drawn from the prior to train SNPE) are stored once, with num_dist_samples = 1,
+# and broadcast against the distributional ones (such as posterior samples) instead of being tiled
 def check_simulation_parameters(simulation_parameters: dict, num_simulations: int) -> int:
     # Assert that the shape of the simulation parameter arrays is (num_dist_samples X num_simulations X param dims)
     # So we check that all parameter arrays have shape >= 2
@@ -66,14 +72,14 @@ def check_simulation_parameters(simulation_parameters: dict, num_simulations: in
     {[key + ": " + str(val.shape[1]) for (key, val) in simulation_parameters.items()]}
     \n Leave as None to generate parameters during simulation, or provide {num_simulations} for each.
     """
-    # Finally check that all simulation parameters have the same number of distribution samples (i.e their 1st dim
-    # is equal). Easy way is to take num_dist_samples from one of the parameters and see if all the other parameters
-    # have the same num_dist_samples
-    num_dist_samples = list(simulation_parameters.values())[0].shape[0]
+    # Finally check that all distributional parameters have the same number of distribution samples (i.e their 1st
+    # dim is equal). Point parameters have a single distribution sample, which broadcasts against any
+    # num_dist_samples. So num_dist_samples is the largest 1st dim, and all the others need to be either 1 or equal to it
+    num_dist_samples = max([val.shape[0] for (key, val) in simulation_parameters.items()])
     assert np.all(
-        [val.shape[0] == num_dist_samples for (key, val) in simulation_parameters.items()]
+        [val.shape[0] in (1, num_dist_samples) for (key, val) in simulation_parameters.items()]
     ), f"""
-    Found unequal number of distribution samples for the simulation parameters as follows:
+    Found incompatible number of distribution samples for the simulation parameters as follows:
     {[key + ": " + str(val.shape[0]) for (key, val) in simulation_parameters.items()]}
     """
     # If all tests passed return the num_dist_samples that was found
@@ -109,3 +115,20 @@ def check_existing_reviews(existing_reviews: List[np.ndarray]) -> List[np.ndarra
             )
         existing_reviews[product] = existing_reviews[product][1:, :]
     return existing_reviews
+
+
+# Utility functions to write pickles and json files atomically. The object is first written to a temporary file in the
+# same directory, which is then renamed to the final path. A crash during writing thus never leaves a partially
+# written file behind at that path
+def atomic_pickle_dump(obj: Any, path: Path) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def atomic_json_dump(obj: Any, path: Path) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp_path, path)
@@ -1,9 +1,13 @@
 import contextlib
+import os
+import time
 
-from multiprocessing import Queue
-from typing import Any, List
+from pathlib import Path
+from threading import Event
+from typing import Any
 
 import joblib
+import numpy as np
 
 from tqdm.auto import tqdm
 
@@ -31,32 +35,61 @@ def tqdm_joblib(tqdm_object) -> Any:
         tqdm_object.close()
 
 
-# Custom multi-progressbar version of tqdm to track progress of long running processes
-# Modified from the batch processing example in:
-# https://towardsdatascience.com/parallel-batch-processing-in-python-8dcce607d226
-# Define the multi-progressbar that will then be directly used in the marketplace simulations (For eg.)
-def multi_progressbar(
-    totals: List,
-    queue: Queue,
+# Progress counters of long running parallel tasks (for eg. marketplace simulations), kept in a memory-mapped file
+# The file is meant to be in shared memory (/dev/shm), so worker processes publish their progress by writing to it
+# directly, without any locks or IPC round trips. Every task only writes to its own slot, and the writes are throttled
+# to once every min_update_interval seconds. Row 0 of the counters holds the progress of every task, and row 1 holds
+# the pid of the worker process running it
+class SharedProgressCounters:
+    def __init__(self, filename: Path, num_tasks: int, create: bool = False, min_update_interval: float = 0.2):
+        self.filename = filename
+        self.num_tasks = num_tasks
+        self.min_update_interval = min_update_interval
+        self.counters = np.memmap(filename, dtype=np.int64, mode="w+" if create else "r+", shape=(2, num_tasks))
+        self._last_update = 0.0
+
+    def __getstate__(self) -> dict:
+        # Only the location of the counters is sent to worker processes, which re-open the memory-mapped file
+        return {"filename": self.filename, "num_tasks": self.num_tasks, "min_update_interval": self.min_update_interval}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def start(self, task_id: int) -> None:
+        self.counters[1, task_id] = os.getpid()
+
+    def update(self, task_id: int, progress: int, force: bool = False) -> None:
+        # Publishes the progress of a task, unless it was already published less than min_update_interval seconds ago
+        now = time.monotonic()
+        if force or now - self._last_update >= self.min_update_interval:
+            self.counters[0, task_id] = progress
+            self._last_update = now
+
+
+def shared_progress_monitor(
+    progress: SharedProgressCounters, total: int, stop: Event, refresh_interval: float = 0.5, desc: str = "Progress"
 ) -> None:
-    pbars = [
-            tqdm(
-                desc=f'Worker {pid + 1}',
-                total=total,
-                position=pid,
+    # Renders the progress published to the shared counters as a single progress bar with the overall rate and ETA,
+    # along with the throughput of every worker process. Runs in a thread in the parent process, until stop is set
+    pbar = tqdm(desc=desc, total=total)
+    start = time.monotonic()
+
+    def render() -> None:
+        counters = np.array(progress.counters)
+        pbar.update(int(np.sum(counters[0])) - pbar.n)
+        elapsed = max(time.monotonic() - start, 1e-9)
+        # Workers are numbered in the order of the first task each of them ran
+        started = counters[1] != 0
+        workers, first_task = np.unique(counters[1, started], return_index=True)
+        worker_progress = {worker: np.sum(counters[0, started][counters[1, started] == worker]) for worker in workers}
+        pbar.set_postfix_str(
+            ", ".join(
+                f"worker {i + 1}: {worker_progress[worker] / elapsed:.0f}/s"
+                for (i, worker) in enumerate(workers[np.argsort(first_task)])
             )
-            for pid, total in enumerate(totals)
-        ]
-
-    while True:
-        try:
-            message = queue.get()
-            if message.startswith('update'):
-                pid = int(message[6:])
-                pbars[pid].update(1)
-            elif message == 'done':
-                break
-        except:
-            pass
-    for pbar in pbars:
-        pbar.close()
+        )
+
+    while not stop.wait(refresh_interval):
+        render()
+    render()
+    pbar.close()
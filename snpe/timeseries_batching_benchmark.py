@@ -0,0 +1,119 @@
+import argparse
+import time
+
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from snpe.inference.inference_class import TimeSeriesInference
+from snpe.simulations.simulator_class import DoubleRhoSimulator
+from snpe.utils.data_transforms import pad_timeseries_batch
+
+ARTIFACT_PATH = Path("./artifacts/timeseries_batching_benchmark")
+
+# Ways of preparing timeseries for the CNN that are compared here, as keyword arguments of
+# infer_snpe_posterior_streaming. "padding" is the existing approach of padding every timeseries to the longest one
+# Length buckets need a CNN that accepts any length, so the CNN of every mode pools down to the same number of
+# features for a fair comparison
+BATCHING_MODES = {
+    "padding": {},
+    "linear_checkpoints": {"num_checkpoints": 100, "checkpoint_spacing": "linear"},
+    "log_checkpoints": {"num_checkpoints": 100, "checkpoint_spacing": "log"},
+    "length_buckets": {"num_length_buckets": 10},
+}
+
+
+def generate_simulations(num_simulations: int, max_num_reviews: int) -> None:
+    # Products get a random number of reviews, as in real marketplaces, so that the timeseries have very different
+    # lengths and padding matters
+    simulator = DoubleRhoSimulator(
+        {"review_prior": np.ones(5), "tendency_to_rate": 0.05, "simulation_type": "timeseries", "seed": 42}
+    )
+    num_reviews_per_simulation = np.random.default_rng(42).integers(10, max_num_reviews, size=num_simulations)
+    simulator.simulate(
+        num_simulations=num_simulations, num_reviews_per_simulation=num_reviews_per_simulation, batch_size=1_000
+    )
+    simulator.save_simulations(ARTIFACT_PATH)
+
+
+def benchmark_mode(
+    mode: str, num_epochs: int, num_test_simulations: int, num_posterior_samples: int, pooled_length: int
+) -> Dict[str, float]:
+    inferrer = TimeSeriesInference()
+    inferrer.load_simulator(dirname=ARTIFACT_PATH, simulator_type="double_rho", simulation_type="timeseries")
+    # Hold out the last simulations to check the quality of the posterior
+    simulations, simulation_parameters = inferrer.simulator.simulations, inferrer.simulator.simulation_parameters
+    num_training_simulations = len(simulations) - num_test_simulations
+    inferrer.simulator.simulations = simulations[np.arange(num_training_simulations)]
+    inferrer.simulator.simulation_parameters = {
+        key: val[:, :num_training_simulations] for (key, val) in simulation_parameters.items()
+    }
+
+    start = time.time()
+    inferrer.infer_snpe_posterior_streaming(
+        embedding_net_conf={"pooled_length": pooled_length},
+        batch_size=128,
+        max_num_epochs=num_epochs,
+        **BATCHING_MODES[mode],
+    )
+    training_time = time.time() - start
+
+    # Posterior quality: error of the posterior mean, and coverage of the 90% posterior interval, of the true
+    # parameters of the held out simulations
+    test_simulation_ids = np.arange(num_training_simulations, len(simulations))
+    test_parameters = simulation_parameters["rho"][0, test_simulation_ids, :]
+    if inferrer.num_checkpoints is not None:
+        observations = pad_timeseries_batch(
+            simulations,
+            test_simulation_ids,
+            num_checkpoints=inferrer.num_checkpoints,
+            checkpoint_spacing=inferrer.checkpoint_spacing,
+        )
+    else:
+        observations = pad_timeseries_batch(simulations, test_simulation_ids, inferrer.padded_simulation_length)
+    posterior_samples = np.stack(
+        [
+            inferrer.posterior.sample((num_posterior_samples,), x=observation[None, :, :], show_progress_bars=False)
+            .cpu()
+            .numpy()
+            for observation in observations
+        ]
+    )
+    lower, upper = np.percentile(posterior_samples, [5, 95], axis=1)
+    return {
+        "seconds_per_epoch": training_time / inferrer.training_epochs,
+        "simulations_per_second": num_training_simulations * inferrer.training_epochs / training_time,
+        "best_validation_log_prob": inferrer.best_validation_log_prob,
+        "posterior_mean_abs_error": float(np.mean(np.abs(posterior_samples.mean(axis=1) - test_parameters))),
+        "posterior_90_coverage": float(np.mean((test_parameters >= lower) & (test_parameters <= upper))),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of padding, resampling and length bucketing of timeseries")
+    parser.add_argument("--num_simulations", required=False, type=int, default=20_000)
+    parser.add_argument("--max_num_reviews", required=False, type=int, default=3_000)
+    parser.add_argument("--num_epochs", required=False, type=int, default=20)
+    parser.add_argument("--num_test_simulations", required=False, type=int, default=200)
+    parser.add_argument("--num_posterior_samples", required=False, type=int, default=1_000)
+    parser.add_argument("--pooled_length", required=False, type=int, default=20)
+    parser.add_argument("--modes", required=False, nargs="+", default=list(BATCHING_MODES), choices=BATCHING_MODES)
+    args, *_ = parser.parse_known_args()
+
+    ARTIFACT_PATH.mkdir(parents=True, exist_ok=True)
+    print("\t Generating simulations")
+    generate_simulations(args.num_simulations, args.max_num_reviews)
+
+    results = {}
+    for mode in args.modes:
+        print(f"\t Benchmarking {mode}")
+        results[mode] = benchmark_mode(
+            mode, args.num_epochs, args.num_test_simulations, args.num_posterior_samples, args.pooled_length
+        )
+    for mode, result in results.items():
+        print(f"{mode:>20}: " + ", ".join(f"{key}={val:.4g}" for (key, val) in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,6 @@ from typing import Dict
 
 import hyperopt.hp as hp
 import mlflow
-import sbi.utils as sbi_utils
-import torch
 
 from hyperopt import STATUS_FAIL, STATUS_OK, Trials, fmin, tpe
 from snpe.inference.inference_class import TimeSeriesInference
@@ -106,7 +104,7 @@ def main() -> None:
         "--simulator_type",
         required=True,
         type=str,
-        choices=["double_rho", "herding", "double_herding", "rating_scale", "marketplace"],
+        choices=["double_rho", "single_herding", "double_herding", "rating_scale", "marketplace"],
     )
     args, *_ = parser.parse_known_args()
 
@@ -121,34 +119,7 @@ def main() -> None:
     mlflow.set_experiment(f"snpe-fully-padded-cnn-timeseries-tuning")
     # Initialize the model and load context - needs to be done whether using local data or doing transforms
     print("\t Initialize inference object")
-    # Parameter prior depends on the type of simulator used
-    if args.simulator_type == "double_rho":
-        parameter_prior = sbi_utils.BoxUniform(
-            low=torch.tensor([0.0, 0.0]).type(torch.FloatTensor),
-            high=torch.tensor([4.0, 4.0]).type(torch.FloatTensor),
-            device="cuda",
-        )
-    elif args.simulator_type == "herding":
-        parameter_prior = sbi_utils.BoxUniform(
-            low=torch.tensor([0.0, 0.0, 0.0]).type(torch.FloatTensor),
-            high=torch.tensor([4.0, 4.0, 1.0]).type(torch.FloatTensor),
-            device="cuda",
-        )
-    elif args.simulator_type == "double_herding":
-        parameter_prior = sbi_utils.BoxUniform(
-            low=torch.tensor([0.0, 0.0, 0.0, 0.0]).type(torch.FloatTensor),
-            high=torch.tensor([4.0, 4.0, 1.0, 1.0]).type(torch.FloatTensor),
-            device="cuda",
-        )
-    elif args.simulator_type in ("rating_scale", "marketplace"):
-        parameter_prior = sbi_utils.BoxUniform(
-            low=torch.tensor([0.0, 0.0, 0.0, 0.5, 0.25, 0.25, 0.5, 0.0]).type(torch.FloatTensor),
-            high=torch.tensor([4.0, 4.0, 1.0, 1.0, 0.75, 0.75, 1.0, 1.0]).type(torch.FloatTensor),
-            device="cuda",
-        )
-    else:
-        raise ValueError(f"Unknown simulator type {args.simulator_type}")
-    inferrer = TimeSeriesInference(parameter_prior=parameter_prior, device="cuda")
+    inferrer = TimeSeriesInference(device="cuda")
     inferrer.load_simulator(dirname=artifact_path, simulator_type=args.simulator_type, simulation_type="timeseries")
 
     print("\t Tuning model")